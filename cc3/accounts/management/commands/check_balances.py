@@ -1,10 +1,10 @@
 import logging
-import MySQLdb
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import translation
 
+from cc3.cyclos.dbaccess import cyclos_connection, cyclos_query_results
 from cc3.cyclos.models import CC3Profile, CyclosAccount
 
 LOG = logging.getLogger('cc3.accounts.check_balances')
@@ -77,12 +77,12 @@ class Command(BaseCommand):
         cyclos_sql = CYCLOS_BALANCE_QUERY % id_list
         args = ()
 
-        conn = get_cyclos_connection()
-
         LOG.info("Fetching latest balance for these accounts")
+        with cyclos_connection(results_as_dict=False) as conn:
+            balances = list(cyclos_query_results(conn, cyclos_sql, args))
+
         balances_checked = 0
-        for cyclos_account_id, balance in \
-                cyclos_query_results(conn, cyclos_sql, args):
+        for cyclos_account_id, balance in balances:
             cyclos_account = CyclosAccount.objects.get(pk=cyclos_account_id)
             LOG.debug(u"Checking {0}; current balance={1}".format(
                 cyclos_account.cc3_profile, balance))
@@ -97,7 +97,6 @@ class Command(BaseCommand):
 
             balances_checked += 1
 
-        close_cyclos_connection(conn)
         LOG.info("Retrieved and checked {0} balances".format(balances_checked))
 
         # Now send any negative-balance notification emails that are due today
@@ -115,38 +114,3 @@ class Command(BaseCommand):
                     negative_balance_collect_sent__isnull=True).all():
                 if profile.negative_balance_collect_due():
                     profile.send_negative_balance_collect_emails()
-
-
-# These values work for the Vagrant setup
-CYCLOS_DB_CONFIG = {
-    'user': getattr(settings, "CYCLOS_DB_USER", 'cyclos3'),
-    'passwd': getattr(settings, "CYCLOS_DB_PASSWD", 'cyclos3'),
-    'host': getattr(settings, "CYCLOS_DB_HOST", '192.168.100.2'),
-    'db': getattr(settings, "CYCLOS_DB", 'cyclos3'),
-}
-
-ROWLIMIT = 1000
-
-
-def get_cyclos_connection():
-    db = MySQLdb.connect(**CYCLOS_DB_CONFIG)
-    return {
-        'db': db,
-        'cursor': db.cursor()
-    }
-
-
-def close_cyclos_connection(connection):
-    connection['cursor'].close()
-    connection['db'].close()
-
-
-def cyclos_query_results(connection, sql, args):
-    connection['cursor'].execute(sql, args)
-    while True:
-        results = connection['cursor'].fetchmany(ROWLIMIT)
-        LOG.debug("Fetched {0} results".format(len(results)))
-        if not results:
-            break
-        for row in results:
-            yield row
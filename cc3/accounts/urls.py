@@ -21,7 +21,7 @@ from .views import (
     TransactionsSearchListView, ExchangeToMoneyView, TimeoutView,
     TransactionsMonthlyPDFView, TransactionsLast10PDFView,
     TransactionsExportView, ReallyCloseAccountView,
-    AccountStatsView,
+    AccountStatsView, account_balance,
 )
 
 
@@ -180,6 +180,9 @@ urlpatterns = patterns(
         login_required(must_have_completed_profile(contact_name_auto)),
         name='contact_name_auto'),
 
+    url(r'^balance/$', login_required(account_balance),
+        name='accounts_balance'),
+
     # Catch the sorting view, placed last to avoid upsetting other possible
     # URLs.
     url(r'^([\w-]+)/([\w-]+)/$',
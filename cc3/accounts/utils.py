@@ -8,7 +8,7 @@ from datetime import timedelta, date
 from cc3.accounts.sql import (
     EUROS_EARNED_AND_REDEEMED_SQL, TOTAL_DONATIONS_FROM_REWARDS)
 from cc3.cyclos import dbaccess
-from cc3.cyclos.utils import close_cyclos_connection, get_cyclos_connection
+from cc3.cyclos.utils import cyclos_connection
 from django import forms
 from django.conf import settings
 from django.core.mail import mail_admins
@@ -117,14 +117,13 @@ def run_euro_redeemed_amounts_sql(conn, username):
 
 
 def get_euros_earned_and_redeemed(username):
-    conn = earned = redeemed = donated = None
+    earned = redeemed = donated = None
     try:
-        conn = get_cyclos_connection()
-
-        for trans in run_euro_redeemed_amounts_sql(conn, username):
-            earned = trans['total_saved_e']
-            redeemed = trans['total_spent_e']
-            donated = trans['total_donated_e']
+        with cyclos_connection() as conn:
+            for trans in run_euro_redeemed_amounts_sql(conn, username):
+                earned = trans['total_saved_e']
+                redeemed = trans['total_spent_e']
+                donated = trans['total_donated_e']
 
     except OperationalError, e:
         LOG.error(e)
@@ -135,9 +134,6 @@ def get_euros_earned_and_redeemed(username):
     except Exception, e:
         LOG.error(e)
 
-    if conn:
-        close_cyclos_connection(conn)
-
     return {
         'earned': earned,
         'redeemed': redeemed,
@@ -146,17 +142,15 @@ def get_euros_earned_and_redeemed(username):
 
 
 def total_donations_originated_by_user(username):
-    conn = None
     donation = 0
     try:
-        conn = get_cyclos_connection()
+        with cyclos_connection() as conn:
+            select_sql = TOTAL_DONATIONS_FROM_REWARDS
+            args = [username, ]
 
-        select_sql = TOTAL_DONATIONS_FROM_REWARDS
-        args = [username, ]
-
-        results = dbaccess.cyclos_query_results(conn, select_sql, args)
-        result = results.next()   # single row
-        donation = result['donation']
+            results = dbaccess.cyclos_query_results(conn, select_sql, args)
+            result = results.next()   # single row
+            donation = result['donation']
 
     except OperationalError, e:
         LOG.error(e)
@@ -167,7 +161,4 @@ def total_donations_originated_by_user(username):
     except Exception, e:
         LOG.error(e)
 
-    if conn:
-        close_cyclos_connection(conn)
-
     return donation or 0
@@ -20,6 +20,7 @@ from django.http import Http404, HttpResponse, HttpResponseRedirect, \
     HttpResponseForbidden
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template.context import RequestContext
+from django.template.defaultfilters import floatformat
 from django.utils.datastructures import SortedDict
 from django.utils.formats import date_format, time_format, number_format
 from django.utils.translation import get_language, ugettext, ugettext_lazy as _
@@ -33,6 +34,7 @@ from cc3.cyclos.services import (
     AccountNotFoundException, MemberNotFoundException)
 from cc3.cyclos.common import TransactionException
 from cc3.cyclos import backends
+from cc3.cyclos.context_processors import get_account_balance
 from cc3.excelexport.views import ExcelResponse
 from cc3.mail.models import MailMessage, MAIL_TYPE_EXCHANGE_TO_MONEY
 from cc3.marketplace.models import Ad, AdPaymentTransaction
@@ -887,7 +889,7 @@ def want_credit_view(request, form_class=WantCreditForm,
     Taken from django contact form. might not be necessary
     (ie just use contact form view?)...
     """
-    group_id = backends.get_group(request.user.email)
+    group_id = request.user.cc3_profile.get_cyclos_group_id()
     if group_id == backends.get_member_group_id():
         return apply_full_view(
             request, success_url=success_url, extra_context=extra_context,
@@ -1191,6 +1193,21 @@ def contact_name_auto(request, community=None):
     return HttpResponse(json_data, content_type='application/json')
 
 
+def account_balance(request):
+    """
+    Returns the balance and credit limits of the user as JSON, for pages
+    rendered without them (``CYCLOS_BALANCE_ASYNC``).
+    """
+    data = get_account_balance(request, add_messages=False)
+    if data['balance'] is not None:
+        data['formatted_balance'] = floatformat(data['balance'], -2)
+        data['balance'] = unicode(data['balance'])
+    else:
+        data['formatted_balance'] = u''
+
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+
 class PostLoginView(View):
     """
     Redirect staff members directly to the Django admin
@@ -29,6 +29,7 @@ class ProductPricingInline(admin.TabularInline):
 
 class TransactionParamsInline(admin.StackedInline):
     model = TransactionParams
+    readonly_fields = ('transfer_type_name',)
 
 
 @admin.register(Product)
@@ -196,6 +197,7 @@ class InvoiceSetAdmin(admin.ModelAdmin):
     list_display = ['description', 'period_start', 'period_end',
                     'invoices_created_at', 'generated_at', 'sent_at', ]
     exclude = ['invoices', ]  # done by inline instead
+    readonly_fields = ['audit_log', ]
     #actions = [generate_tf_files, generate_extra_tf_files, send_tf_files, ]
     actions = [generate_tf_files, send_tf_files, ]
 
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0050_auto_20161005_1719'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceset',
+            name='audit_log',
+            field=models.TextField(verbose_name='Audit log', blank=True),
+        ),
+    ]
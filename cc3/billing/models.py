@@ -14,7 +14,7 @@ from django.db import models
 from django.utils.translation import ugettext, ugettext_lazy as _
 
 from cc3.core.models import SingletonModel
-from cc3.cyclos import utils
+from cc3.cyclos import backends, utils
 from cc3.cyclos.models import CC3Profile, User
 
 from .twinfield_exports import (
@@ -181,7 +181,7 @@ class Product(models.Model):
         """Whether the pricing should be unit_price or percentage_price"""
         return self.price_type == self.PRICE_TYPE_PERCENTAGE
 
-    def get_pricing_for_date(self, price_date):
+    def get_pricing_for_date(self, price_date, prices=None):
         """
         Find the price of this product on price_date
 
@@ -193,15 +193,23 @@ class Product(models.Model):
         If no match found, log error and return None
         If more than one match found, log error and return the one with the
         latest start date
+
+        ``prices`` are the ProductPricings of this product, if already
+        loaded (they are queried otherwise)
         """
-        matches = self.prices.filter(
-            valid_from__lte=price_date).exclude(valid_to__lt=price_date)
-        if matches.count() == 1:
+        if prices is None:
+            prices = self.prices.filter(
+                valid_from__lte=price_date).exclude(valid_to__lt=price_date)
+        matches = [
+            pricing for pricing in prices
+            if pricing.valid_from <= price_date and (
+                pricing.valid_to is None or pricing.valid_to >= price_date)]
+        if len(matches) == 1:
             return matches[0]
-        if matches.count() > 1:
+        if len(matches) > 1:
             LOG.warning(u"Multiple pricing found for '{0}' at {1}".format(
                 self.name, price_date))
-            return matches.order_by('-valid_from')[0]
+            return max(matches, key=lambda pricing: pricing.valid_from)
         LOG.error(u"No pricing found for '{0}' at {1}".format(
             self.name, price_date))
         return None
@@ -437,13 +445,13 @@ class AssignedProduct(models.Model):
             return False
         return True
 
-    def get_prices_for_date(self, price_date):
+    def get_prices_for_date(self, price_date, prices=None):
         """Get price and discount for this user and product at the given date
 
         Assumes the quantity and value fields are already correct
         """
         price_info = {}
-        pricing = self.product.get_pricing_for_date(price_date)
+        pricing = self.product.get_pricing_for_date(price_date, prices=prices)
         price_type = self.product.price_type
         # some prices are based on quantity, some on value
         qty = self.quantity
@@ -462,7 +470,7 @@ class AssignedProduct(models.Model):
             else:
                 raise NotImplementedError
 
-            tax_percent = pricing.product.tax_regime.percent
+            tax_percent = self.product.tax_regime.percent
             discount = get_discount(total_price, self.discount_percent)
 
             price_info = {
@@ -482,15 +490,30 @@ class AssignedProduct(models.Model):
 
         Also update the next_invoice_date
         """
+        invoice_item = self.build_next_invoice_item()
+        if invoice_item:
+            invoice_item.invoice = invoice
+            invoice_item.save()
+        self.update_next_invoice_date()
+        return invoice_item
+
+    def build_next_invoice_item(self, prices=None):
+        """Make an unsaved InvoiceItem, without invoice, for the
+        next_invoice_date
+
+        Returns None if the quantity is zero, and raises RuntimeError if
+        there is no price. ``prices`` are passed on to
+        ``Product.get_pricing_for_date``.
+        """
         invoice_item = None
-        price_info = self.get_prices_for_date(self.next_invoice_date)
+        price_info = self.get_prices_for_date(
+            self.next_invoice_date, prices=prices)
 
         if price_info:
             if price_info.get('quantity', 0):
                 # don't create invoice line if quantity is zero
-                invoice_item = InvoiceItem.objects.create(
+                invoice_item = InvoiceItem(
                     assigned_product=self,
-                    invoice=invoice,
                     payment_for_date=self.next_invoice_date,
                     quantity=price_info['quantity'],
                     unit_price_ex_tax=price_info['unit_price_ex_tax'],
@@ -502,7 +525,6 @@ class AssignedProduct(models.Model):
                     tax_percent=self.product.tax_regime.percent,
                     tax_name=self.product.tax_regime.name,
                 )
-            self.update_next_invoice_date()
         else:
             msg = u"Failed to raise invoice for '{0}' (no price found)".format(
                 self.__unicode__())
@@ -512,18 +534,24 @@ class AssignedProduct(models.Model):
 
     def update_next_invoice_date(self):
         """Update next_invoice_date according to billing frequency"""
+        self.next_invoice_date = self.get_next_invoice_date()
+        self.save()
+
+    def get_next_invoice_date(self):
+        """The next_invoice_date following the current one"""
+        next_invoice_date = self.next_invoice_date
         freq = self.billing_frequency
         if freq == BILLING_PERIOD_ONEOFF:
-            self.next_invoice_date = None
+            next_invoice_date = None
         elif freq == BILLING_PERIOD_MONTHLY:
-            self.next_invoice_date += relativedelta(months=+1)
+            next_invoice_date += relativedelta(months=+1)
         elif freq == BILLING_PERIOD_YEARLY:
-            self.next_invoice_date += relativedelta(years=+1)
+            next_invoice_date += relativedelta(years=+1)
         # don't ask for payment past the end_date
-        if self.end_date and self.next_invoice_date and (
-                self.next_invoice_date > self.end_date):
-            self.next_invoice_date = None
-        self.save()
+        if self.end_date and next_invoice_date and (
+                next_invoice_date > self.end_date):
+            next_invoice_date = None
+        return next_invoice_date
 
     def update_auto_quantity(self,
                              period_start=None, period_end=None, save=False):
@@ -554,24 +582,31 @@ class AssignedProduct(models.Model):
                     self.product.transaction_params.get_transaction_totals(
                         self.user_profile.user.username,
                         period_start, period_end)
+                self.set_transaction_quantity(
+                    total_txns, total_points, save=save)
 
-                self.quantity = 0
-                self.value = 0
+    def set_transaction_quantity(self, total_txns, total_points, save=False):
+        """
+        Set quantity (and value) of a transaction product from the totals
+        of the invoiced period
+        """
+        self.quantity = 0
+        self.value = 0
 
-                if (self.product.auto_qty_type ==
-                        AUTO_QTY_TYPE_TRANSACTION_VALUE and total_points):
-                    self.quantity = 1
-                    self.value = float(
-                        total_points) / settings.CC3_CURRENCY_CONVERSION
-                elif (self.product.auto_qty_type ==
-                        AUTO_QTY_TYPE_TRANSACTION_POINTS and total_points):
-                    self.quantity = int(total_points)
-                elif (self.product.auto_qty_type ==
-                        AUTO_QTY_TYPE_TRANSACTION_COUNT) and total_txns:
-                    self.quantity = total_txns
+        if (self.product.auto_qty_type ==
+                AUTO_QTY_TYPE_TRANSACTION_VALUE and total_points):
+            self.quantity = 1
+            self.value = float(
+                total_points) / settings.CC3_CURRENCY_CONVERSION
+        elif (self.product.auto_qty_type ==
+                AUTO_QTY_TYPE_TRANSACTION_POINTS and total_points):
+            self.quantity = int(total_points)
+        elif (self.product.auto_qty_type ==
+                AUTO_QTY_TYPE_TRANSACTION_COUNT) and total_txns:
+            self.quantity = total_txns
 
-                if save:
-                    self.save()
+        if save:
+            self.save()
 
 
 class InvoiceSet(models.Model):
@@ -593,6 +628,7 @@ class InvoiceSet(models.Model):
     sent_at = models.DateTimeField(
         _('Files sent at'), null=True, blank=True)
     sent_to = models.TextField(_('Files sent to'), blank=True)
+    audit_log = models.TextField(_('Audit log'), blank=True)
 
     def generate_twinfield_files(self,
                                  include_headings=True,
@@ -904,11 +940,26 @@ class TransactionParams(models.Model):
     class Meta:
         verbose_name_plural = "Transaction parameters"
 
-    def _get_user_from_username(self, username):
-        try:
-            return User.objects.get(username=username)
-        except User.DoesNotExist:
-            return None
+    @property
+    def transfer_type(self):
+        """
+        The Cyclos ``TransferType`` for ``txn_type_id``, from the transfer
+        type registry (``None`` if unknown).
+        """
+        return backends.get_transfer_type(self.txn_type_id)
+
+    def transfer_type_name(self):
+        transfer_type = self.transfer_type
+        if transfer_type is None:
+            return u''
+        return transfer_type.name
+    transfer_type_name.short_description = _('Transaction Type')
+
+    def _get_group_map(self, usernames):
+        """Map usernames to the id of their Cyclos group"""
+        return dict(CC3Profile.objects.filter(
+            user__username__in=usernames).values_list(
+                'user__username', 'cyclos_group_id'))
 
     def get_transaction_totals(self, username, from_date, to_date):
         """
@@ -917,47 +968,80 @@ class TransactionParams(models.Model):
 
         Return total number of transactions, and total number of points
         """
-        conn = utils.get_cyclos_connection()
+        return self.get_transaction_totals_by_user(
+            [username], from_date, to_date).get(username, (0, 0))
+
+    def get_transaction_totals_by_user(self, usernames, from_date, to_date):
+        """
+        Total up matching transactions for all ``usernames`` between the two
+        dates (which are inclusive), in one grouped query
+
+        Return a dict of (total number of transactions, total number of
+        points) by username. Users without transactions are left out.
+        """
+        usernames = list(usernames)
+        if not usernames:
+            return {}
+
         senders = None
         recipients = None
         if self.invoice_sender:
-            senders = [username, ]
+            senders = usernames
         if self.invoice_recipient:
-            recipients = [username, ]
-
-        txns = utils.get_cyclos_transfers(
-            conn, senders=senders, recipients=recipients,
-            transfer_type_ids=[self.txn_type_id, ],
-            from_date=from_date, to_date=to_date)
-
-        # txns is a list; further filtering needed
-        total = 0
-        count = 0
+            recipients = usernames
         exclude_desc = getattr(settings,
                                'BILLING_EXCLUDE_TRANSFERS_CONTAINING', "")
-        for txn in txns:
-            # exclude non-charged transactions
-            if exclude_desc and (exclude_desc in txn['description']):
+
+        with utils.cyclos_connection() as conn:
+            rows = list(utils.get_cyclos_transfer_pair_totals(
+                conn, senders=senders, recipients=recipients,
+                transfer_type_ids=[self.txn_type_id, ],
+                from_date=from_date, to_date=to_date,
+                exclude_description=exclude_desc))
+
+        group_map = {}
+        if self.sender_group_id or self.recipient_group_id:
+            group_usernames = set()
+            for row in rows:
+                if self.sender_group_id:
+                    group_usernames.add(row['sender'])
+                if self.recipient_group_id:
+                    group_usernames.add(row['recipient'])
+            group_map = self._get_group_map(group_usernames)
+
+        totals = {}
+        for row in rows:
+            if self.sender_group_id and (
+                    group_map.get(row['sender']) != self.sender_group_id):
                 continue
-            if self.sender_group:
-                sender_user = self._get_user_from_username(txn['sender'])
-                if not sender_user or (
-                        sender_user.get_profile().cyclos_group !=
-                        self.sender_group):
-                    continue
-            if self.recipient_group:
-                recipient_user = self._get_user_from_username(txn['recipient'])
-                if not recipient_user or (
-                        recipient_user.get_profile().cyclos_group !=
-                        self.recipient_group):
+            if self.recipient_group_id and (
+                    group_map.get(row['recipient']) !=
+                    self.recipient_group_id):
+                continue
+
+            if self.invoice_sender and self.invoice_recipient:
+                # only transactions to themselves
+                if row['sender'] != row['recipient']:
                     continue
-            # valid transaction -- add it to total and count
-            total += txn['amount']
-            count += 1
+                username = row['sender']
+            elif self.invoice_sender:
+                username = row['sender']
+            elif self.invoice_recipient:
+                username = row['recipient']
+            else:
+                # all matching transactions count for every user
+                username = None
+
+            count, total = totals.get(username, (0, 0))
+            totals[username] = (
+                count + int(row['total_count']), total + row['total_amount'])
 
-        utils.close_cyclos_connection(conn)
+        if None in totals:
+            all_users_totals = totals.pop(None)
+            totals = dict(
+                (username, all_users_totals) for username in usernames)
 
         if self.negate_amounts:
-            return count, -total
-        else:
-            return count, total
+            return dict((username, (count, -total))
+                        for username, (count, total) in totals.items())
+        return totals
@@ -1,8 +1,11 @@
 from datetime import timedelta, date
+from decimal import Decimal
 import logging
 
 from django.test import TestCase
 
+from mock import patch
+
 from cc3.cards.models import Terminal
 from cc3.cards.tests.test_factories import TerminalFactory
 from cc3.cyclos.tests.test_factories import (
@@ -20,7 +23,7 @@ from ..common import (BILLING_PERIOD_ONEOFF,
 from ..models import (
     TaxRegime,
     # Product, ProductPricing, Invoice, InvoiceItem,
-    AssignedProduct, TerminalDeposit,
+    AssignedProduct, TerminalDeposit, TransactionParams,
     apply_tax, get_discount, get_percent,
     )
 
@@ -118,6 +121,25 @@ class ProductTestCase(TestCase):
         pricing = product.get_pricing_for_date(price_date=self.today)
         self.assertEqual(pricing, None)
 
+    def test_get_pricing_for_date_preloaded(self):
+        tax_regime = TaxRegime.objects.create(name="VAT", percent=21)
+        product = ProductFactory.create(
+            tax_regime=tax_regime,
+            max_discount_percent=25)
+        pricing1 = ProductPricingFactory.create(
+            product=product, valid_from=self.today - timedelta(days=30),
+            valid_to=self.today - timedelta(days=1), unit_price_euros=5)
+        pricing2 = ProductPricingFactory.create(
+            product=product, valid_from=self.today, unit_price_euros=10)
+        prices = list(product.prices.all())
+        with self.assertNumQueries(0):
+            pricing = product.get_pricing_for_date(
+                price_date=self.today, prices=prices)
+            self.assertEqual(pricing, pricing2)
+            pricing = product.get_pricing_for_date(
+                price_date=self.today - timedelta(days=2), prices=prices)
+            self.assertEqual(pricing, pricing1)
+
 
 class AssignedProductTestCase(TestCase):
 
@@ -369,3 +391,68 @@ class TerminalDepositTestCase(TestCase):
         term.save()
         td = TerminalDeposit.objects.get(business=self.user1, terminal=term)
         self.assertTrue(td.deposit_due)
+
+
+class TransactionParamsTestCase(TestCase):
+    """
+    Test case for the grouped ``TransactionParams`` transaction totals.
+    """
+    def setUp(self):
+        self.rows = [
+            {'sender': 'alice', 'recipient': 'shop', 'total_count': 2,
+             'total_amount': Decimal('10.00')},
+            {'sender': 'bob', 'recipient': 'shop', 'total_count': 1,
+             'total_amount': Decimal('5.00')},
+            {'sender': 'alice', 'recipient': 'cafe', 'total_count': 3,
+             'total_amount': Decimal('7.50')},
+        ]
+        self.today = date.today()
+
+    def _get_totals(self, transaction_params, usernames):
+        with patch('cc3.cyclos.utils.cyclos_connection'), \
+                patch('cc3.cyclos.utils.get_cyclos_transfer_pair_totals',
+                      return_value=iter(self.rows)):
+            return transaction_params.get_transaction_totals_by_user(
+                usernames, self.today, self.today)
+
+    def test_totals_by_sender(self):
+        """
+        Tests that the totals of all invoiced senders come from one query.
+        """
+        transaction_params = TransactionParams(
+            txn_type_id=31, invoice_sender=True, invoice_recipient=False)
+
+        totals = self._get_totals(transaction_params, ['alice', 'bob'])
+
+        self.assertEqual(totals['alice'], (5, Decimal('17.50')))
+        self.assertEqual(totals['bob'], (1, Decimal('5.00')))
+
+    def test_totals_by_recipient_negated(self):
+        """
+        Tests that amounts are negated if so configured.
+        """
+        transaction_params = TransactionParams(
+            txn_type_id=31, invoice_sender=False, invoice_recipient=True,
+            negate_amounts=True)
+
+        totals = self._get_totals(transaction_params, ['shop', 'cafe'])
+
+        self.assertEqual(totals['shop'], (3, Decimal('-15.00')))
+        self.assertEqual(totals['cafe'], (3, Decimal('-7.50')))
+
+    def test_totals_filtered_by_group(self):
+        """
+        Tests that transactions are filtered on the group of the sender,
+        from a single lookup of the groups.
+        """
+        transaction_params = TransactionParams(
+            txn_type_id=31, invoice_sender=False, invoice_recipient=True,
+            sender_group_id=1)
+
+        with patch.object(TransactionParams, '_get_group_map',
+                          return_value={'alice': 1, 'bob': 2}) as mock:
+            totals = self._get_totals(transaction_params, ['shop', 'cafe'])
+
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(totals['shop'], (2, Decimal('10.00')))
+        self.assertEqual(totals['cafe'], (3, Decimal('7.50')))
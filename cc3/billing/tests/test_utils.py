@@ -0,0 +1,209 @@
+from datetime import date
+from decimal import Decimal
+
+from django.test import TestCase
+
+from mock import patch
+
+from cc3.cyclos.tests.test_factories import CC3ProfileFactory
+
+from .test_factories import (
+    AssignedProductFactory, InvoicingCompanyFactory, ProductFactory,
+    ProductPricingFactory)
+from ..common import BILLING_PERIOD_MONTHLY, BILLING_PERIOD_ONEOFF
+from ..models import AssignedProduct, Invoice, InvoiceSet, TaxRegime
+from ..utils import generate_monthly_invoices
+
+
+class GenerateMonthlyInvoicesTestCase(TestCase):
+    """
+    Test case for the monthly invoice run.
+    """
+    def setUp(self):
+        self.company_a = InvoicingCompanyFactory.create()
+        self.company_b = InvoicingCompanyFactory.create()
+        tax_regime = TaxRegime.objects.create(name="VAT", percent=21)
+        self.monthly_product = self._product(
+            self.company_a, BILLING_PERIOD_MONTHLY, 10, tax_regime)
+        self.oneoff_product = self._product(
+            self.company_a, BILLING_PERIOD_ONEOFF, 5, tax_regime)
+        self.product_b = self._product(
+            self.company_b, BILLING_PERIOD_MONTHLY, 7, tax_regime)
+
+        self.profile_1 = CC3ProfileFactory.create()
+        self.profile_2 = CC3ProfileFactory.create()
+        march = date(2016, 3, 1)
+        self.monthly_1 = self._assign(
+            self.monthly_product, self.profile_1, 2, march,
+            discount_percent=10)
+        self.oneoff_1 = self._assign(
+            self.oneoff_product, self.profile_1, 1, march)
+        self.product_b_1 = self._assign(
+            self.product_b, self.profile_1, 1, march)
+        self.monthly_2 = self._assign(
+            self.monthly_product, self.profile_2, 3, march)
+        # no item, so no invoice from company B for profile 2
+        self.product_b_2 = self._assign(
+            self.product_b, self.profile_2, 0, march)
+        # due after the period
+        self.next_month = self._assign(
+            self.oneoff_product, self.profile_2, 1, date(2016, 4, 1))
+
+    def _product(self, invoiced_by, billing_frequency, unit_price,
+                 tax_regime):
+        product = ProductFactory.create(
+            invoiced_by=invoiced_by, billing_frequency=billing_frequency,
+            tax_regime=tax_regime, max_discount_percent=25)
+        ProductPricingFactory.create(
+            product=product, valid_from=date(2016, 1, 1),
+            unit_price_euros=unit_price)
+        return product
+
+    def _assign(self, product, cc3_profile, quantity, next_invoice_date,
+                discount_percent=0):
+        return AssignedProductFactory.create(
+            product=product, user_profile=cc3_profile, quantity=quantity,
+            start_date=date(2016, 1, 1), next_invoice_date=next_invoice_date,
+            discount_percent=discount_percent)
+
+    def _generate_per_product(self, invoice_date, description):
+        """
+        Generates the invoices for March 2016 one assigned product at a time,
+        as the monthly invoice run used to.
+        """
+        invoice_set = InvoiceSet.objects.create(description=description)
+        for assigned_product in AssignedProduct.objects.filter(
+                next_invoice_date__gte=date(2016, 3, 1),
+                next_invoice_date__lte=date(2016, 3, 31)):
+            invoice, _created = Invoice.objects.get_or_create(
+                invoice_set=invoice_set,
+                invoicing_company=assigned_product.product.invoiced_by,
+                invoice_date=invoice_date,
+                user_profile=assigned_product.user_profile,
+                description=description,
+                date_exported=None,
+            )
+            assigned_product.generate_next_invoice_item(invoice)
+        for invoice in invoice_set.invoices.all():
+            if not invoice.items.count():
+                invoice.delete()
+        return invoice_set
+
+    def _invoices(self, invoice_set):
+        """Returns the invoices and their items, comparable across runs"""
+        return dict(
+            ((invoice.invoicing_company_id, invoice.user_profile_id,
+              invoice.invoice_date, invoice.description),
+             sorted((item.assigned_product_id, item.payment_for_date,
+                     item.quantity, item.unit_price_ex_tax,
+                     item.unit_price_incl_tax, item.discount_amount_ex_tax,
+                     item.discount_amount_incl_tax, item.tax_name,
+                     item.tax_percent)
+                    for item in invoice.items.all()))
+            for invoice in invoice_set.invoices.all())
+
+    def _next_invoice_dates(self):
+        return dict(AssignedProduct.objects.values_list(
+            'pk', 'next_invoice_date'))
+
+    @patch.object(InvoiceSet, 'generate_twinfield_files')
+    def test_as_per_product(self, generate_twinfield_files):
+        """
+        Tests that the invoices, invoice items and next payment dates are
+        the same as when generating them one assigned product at a time.
+        """
+        invoice_date = date(2016, 4, 2)
+        next_invoice_dates = self._next_invoice_dates()
+
+        generate_monthly_invoices(2016, 3, invoice_date=invoice_date,
+                                  send_to_twinfield=False)
+
+        invoice_set = InvoiceSet.objects.get(period_start=date(2016, 3, 1))
+        invoices = self._invoices(invoice_set)
+        bulk_next_invoice_dates = self._next_invoice_dates()
+
+        # run the old way from the same starting point
+        for pk, next_invoice_date in next_invoice_dates.items():
+            AssignedProduct.objects.filter(pk=pk).update(
+                next_invoice_date=next_invoice_date)
+        expected_set = self._generate_per_product(invoice_date, u'03-2016')
+
+        self.assertEqual(invoices, self._invoices(expected_set))
+        self.assertEqual(bulk_next_invoice_dates, self._next_invoice_dates())
+        self.assertTrue(generate_twinfield_files.called)
+
+    @patch.object(InvoiceSet, 'generate_twinfield_files')
+    def test_invoices(self, generate_twinfield_files):
+        """
+        Tests the invoices created, that each item is on the invoice of its
+        invoicing company and user, and the next payment dates.
+        """
+        generate_monthly_invoices(2016, 3, invoice_date=date(2016, 4, 2),
+                                  send_to_twinfield=False)
+
+        invoice_set = InvoiceSet.objects.get(period_start=date(2016, 3, 1))
+        self.assertEqual(
+            sorted((invoice.invoicing_company_id, invoice.user_profile_id)
+                   for invoice in invoice_set.invoices.all()),
+            sorted([(self.company_a.pk, self.profile_1.pk),
+                    (self.company_b.pk, self.profile_1.pk),
+                    (self.company_a.pk, self.profile_2.pk)]))
+        for invoice in invoice_set.invoices.all():
+            for item in invoice.items.select_related(
+                    'assigned_product__product'):
+                self.assertEqual(
+                    item.assigned_product.product.invoiced_by_id,
+                    invoice.invoicing_company_id)
+                self.assertEqual(item.assigned_product.user_profile_id,
+                                 invoice.user_profile_id)
+        self.assertEqual(
+            sorted(invoice_set.invoices.values_list(
+                'items__assigned_product', flat=True)),
+            sorted([self.monthly_1.pk, self.oneoff_1.pk, self.product_b_1.pk,
+                    self.monthly_2.pk]))
+
+        item = invoice_set.invoices.get(
+            invoicing_company=self.company_a,
+            user_profile=self.profile_1).items.get(
+                assigned_product=self.monthly_1)
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual(item.unit_price_incl_tax, Decimal('12.10'))
+        self.assertEqual(item.discount_amount_ex_tax, -2)
+
+        next_invoice_dates = self._next_invoice_dates()
+        self.assertEqual(next_invoice_dates[self.monthly_1.pk],
+                         date(2016, 4, 1))
+        self.assertEqual(next_invoice_dates[self.oneoff_1.pk], None)
+        self.assertEqual(next_invoice_dates[self.product_b_2.pk],
+                         date(2016, 4, 1))
+        self.assertEqual(next_invoice_dates[self.next_month.pk],
+                         date(2016, 4, 1))
+
+    @patch.object(InvoiceSet, 'generate_twinfield_files')
+    def test_audit_log(self, generate_twinfield_files):
+        """
+        Tests that the audit log records each assigned product, the items
+        which failed, the duration of each phase and the result.
+        """
+        generate_monthly_invoices(2016, 3, invoice_date=date(2016, 4, 2),
+                                  send_to_twinfield=False)
+
+        invoice_set = InvoiceSet.objects.get(period_start=date(2016, 3, 1))
+        audit_log = invoice_set.audit_log.splitlines()
+        self.assertEqual(audit_log[0], u'03-2016')
+        self.assertEqual(audit_log[-1], invoice_set.description)
+        self.assertIn(u'(3 invoices)', invoice_set.description)
+        for assigned_product in (self.monthly_1, self.oneoff_1,
+                                 self.product_b_1, self.monthly_2,
+                                 self.product_b_2):
+            self.assertIn(u'{0}, next payment date 2016-03-01...'.format(
+                assigned_product), audit_log)
+        self.assertEqual(audit_log.count(u'...Failed (missing price?)'), 1)
+        failed_index = audit_log.index(
+            u'{0}, next payment date 2016-03-01...'.format(
+                self.product_b_2)) + 1
+        self.assertEqual(audit_log[failed_index],
+                         u'...Failed (missing price?)')
+        self.assertTrue(any(
+            line.startswith(u'.. Creating 3 invoices and 4 invoice items took')
+            for line in audit_log))
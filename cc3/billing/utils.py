@@ -1,6 +1,7 @@
 from calendar import monthrange
 from datetime import date, datetime
 import logging
+import time
 
 from django.db import transaction, IntegrityError
 from django.utils.translation import ugettext, ugettext_lazy as _
@@ -8,7 +9,8 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 #from cc3.cyclos import backends
 
 from .models import (
-    AssignedProduct, Invoice, InvoiceSet, TerminalDeposit, Product)
+    AssignedProduct, Invoice, InvoiceItem, InvoiceSet, TerminalDeposit,
+    Product, ProductPricing)
 from .common import (
     AUTO_ASSIGN_TYPE_TERMINAL_DEPOSIT, AUTO_ASSIGN_TYPE_TERMINAL_REFUND,
     AUTO_ASSIGN_TYPE_TERMINAL_RENTAL, AUTO_ASSIGN_TYPE_SIM_CARD,
@@ -21,6 +23,9 @@ from .common import (
 
 LOG = logging.getLogger(__name__)
 
+# Number of rows per bulk insert/update query
+BULK_BATCH_SIZE = 500
+
 
 def _pre_monthly_invoicing_actions(period_start, period_end):
     """Perform auto-updates needed before generating invoices
@@ -82,13 +87,37 @@ def _pre_monthly_invoicing_actions(period_start, period_end):
             auto_assign_type=AUTO_ASSIGN_TYPE_USER_GROUPS).all():
         product.assign_to_user_groups()
 
+    _update_transaction_quantities(period_start, period_end)
+
+
+def _update_transaction_quantities(period_start, period_end):
+    """Update quantities of all transaction products due in the period
+
+    Totals are calculated with one query per product (transaction params),
+    for all users the product is assigned to.
+    """
+    assigned_products = {}
     for txn_ap in AssignedProduct.objects.filter(
             product__auto_qty_type__in=[AUTO_QTY_TYPE_TRANSACTION_VALUE,
                                         AUTO_QTY_TYPE_TRANSACTION_POINTS,
                                         AUTO_QTY_TYPE_TRANSACTION_COUNT],
             next_invoice_date__gte=period_start,
-            next_invoice_date__lte=period_end):
-        txn_ap.update_auto_quantity(period_start, period_end, save=True)
+            next_invoice_date__lte=period_end).select_related(
+                'product__transaction_params', 'user_profile__user'):
+        assigned_products.setdefault(txn_ap.product_id, []).append(txn_ap)
+
+    for product_assignments in assigned_products.values():
+        transaction_params = product_assignments[0].product.transaction_params
+        totals = transaction_params.get_transaction_totals_by_user(
+            set(txn_ap.user_profile.user.username
+                for txn_ap in product_assignments),
+            period_start, period_end)
+
+        for txn_ap in product_assignments:
+            total_txns, total_points = totals.get(
+                txn_ap.user_profile.user.username, (0, 0))
+            txn_ap.set_transaction_quantity(
+                total_txns, total_points, save=True)
 
 
 def generate_monthly_invoices(year, month, invoice_date=None,
@@ -116,6 +145,7 @@ def generate_monthly_invoices(year, month, invoice_date=None,
             audit_messages = [description, '',]
 
             # perform pre-invoicing updates and actions
+            started = time.time()
             msg = ugettext(".. Performing pre-invoicing actions")
             LOG.info(msg)
             audit_messages.append(msg)
@@ -123,44 +153,28 @@ def generate_monthly_invoices(year, month, invoice_date=None,
             audit_messages.append(
                 ugettext(".. Completed pre-invoicing actions"))
 
-            for assigned_product in AssignedProduct.objects.filter(
-                next_invoice_date__gte=period_start,
-                next_invoice_date__lte=period_end):
-
-                msg = _("{0}, next payment date {1}...").format(
-                    assigned_product, assigned_product.next_invoice_date)
-                audit_messages.append(msg)
-
-                invoice, _created = Invoice.objects.get_or_create(
-                    invoice_set=invoice_set,
-                    invoicing_company=assigned_product.product.invoiced_by,
-                    invoice_date=invoice_date,
-                    user_profile=assigned_product.user_profile,
-                    description=description,
-                    date_exported=None,
-                )
+            _audit_timing(
+                audit_messages, ugettext("Pre-invoicing actions"), started)
 
-                # generate the invoice item
-                invoice_item = assigned_product.generate_next_invoice_item(
-                    invoice)
-                if not invoice_item:
-                    audit_messages.append(
-                        ugettext("...Failed (missing price?)"))
+            _bulk_generate_invoices(
+                invoice_set, AssignedProduct.objects.filter(
+                    next_invoice_date__gte=period_start,
+                    next_invoice_date__lte=period_end),
+                invoice_date, description, audit_messages)
     except Exception:
         LOG.error("\n!! Monthly invoicing failed. Database has "
                   "been rolled back so it can be safely re-tried once the "
                   "problem has been fixed")
         raise
 
-    for invoice in invoice_set.invoices.all():
-        if not invoice.items.count():
-            invoice.delete()
     num_invoices = invoice_set.invoices.count()
     LOG.info(".. Generated {0} invoices".format(num_invoices))
     invoice_set.description = _(
         'Monthly invoice run for {0:02d}-{1} ({2} invoices)'
         ).format(month, year, num_invoices)
     audit_messages.extend(('', invoice_set.description))
+    invoice_set.audit_log = u'\n'.join(
+        unicode(msg) for msg in audit_messages)
     invoice_set.invoices_created_at = datetime.now()
     invoice_set.save()
 
@@ -182,6 +196,95 @@ def generate_monthly_invoices(year, month, invoice_date=None,
             LOG.error(".. Files not sent to Twinfield")
 
 
+def _audit_timing(audit_messages, phase, started):
+    """Log how long a phase of the invoice run took, returns the time now"""
+    now = time.time()
+    msg = ugettext(".. {0} took {1:.2f}s").format(phase, now - started)
+    LOG.info(msg)
+    audit_messages.append(msg)
+    return now
+
+
+def _bulk_generate_invoices(invoice_set, assigned_products_qs, invoice_date,
+                            description, audit_messages):
+    """Generate Invoices and InvoiceItems for all assigned products
+
+    Does the same as calling ``generate_next_invoice_item`` for every
+    assigned product, but with pricing and tax regimes loaded up front and
+    invoices, items and next invoice dates written in bulk. Invoices are
+    only created for users with at least one invoice item.
+    """
+    started = time.time()
+    assigned_products = list(assigned_products_qs.select_related(
+        'product__tax_regime', 'user_profile'))
+    prices = {}
+    for pricing in ProductPricing.objects.filter(product_id__in=set(
+            assigned_product.product_id
+            for assigned_product in assigned_products)):
+        prices.setdefault(pricing.product_id, []).append(pricing)
+    started = _audit_timing(
+        audit_messages, ugettext("Loading {0} assigned products").format(
+            len(assigned_products)), started)
+
+    invoice_items = []
+    next_invoice_dates = {}
+    for assigned_product in assigned_products:
+        msg = _("{0}, next payment date {1}...").format(
+            assigned_product, assigned_product.next_invoice_date)
+        audit_messages.append(msg)
+
+        invoice_item = assigned_product.build_next_invoice_item(
+            prices=prices.get(assigned_product.product_id, []))
+        if invoice_item:
+            invoice_items.append((
+                (assigned_product.product.invoiced_by_id,
+                 assigned_product.user_profile_id),
+                invoice_item))
+        else:
+            audit_messages.append(ugettext("...Failed (missing price?)"))
+        next_invoice_dates.setdefault(
+            assigned_product.get_next_invoice_date(), []).append(
+                assigned_product.pk)
+    started = _audit_timing(
+        audit_messages, ugettext("Pricing {0} invoice items").format(
+            len(invoice_items)), started)
+
+    Invoice.objects.bulk_create([
+        Invoice(
+            invoice_set=invoice_set,
+            invoicing_company_id=invoicing_company_id,
+            invoice_date=invoice_date,
+            user_profile_id=user_profile_id,
+            description=description,
+            date_exported=None,
+        ) for invoicing_company_id, user_profile_id in sorted(set(
+            key for key, invoice_item in invoice_items))
+    ], batch_size=BULK_BATCH_SIZE)
+    # bulk_create doesn't set the ids (on MySQL), so read them back
+    invoice_ids = dict(
+        ((invoicing_company_id, user_profile_id), invoice_id)
+        for invoice_id, invoicing_company_id, user_profile_id in
+        invoice_set.invoices.values_list(
+            'id', 'invoicing_company_id', 'user_profile_id'))
+    for key, invoice_item in invoice_items:
+        invoice_item.invoice_id = invoice_ids[key]
+    InvoiceItem.objects.bulk_create(
+        [invoice_item for key, invoice_item in invoice_items],
+        batch_size=BULK_BATCH_SIZE)
+    started = _audit_timing(
+        audit_messages,
+        ugettext("Creating {0} invoices and {1} invoice items").format(
+            len(invoice_ids), len(invoice_items)), started)
+
+    for next_invoice_date, pks in next_invoice_dates.items():
+        for i in xrange(0, len(pks), BULK_BATCH_SIZE):
+            AssignedProduct.objects.filter(
+                pk__in=pks[i:i + BULK_BATCH_SIZE]).update(
+                    next_invoice_date=next_invoice_date)
+    _audit_timing(
+        audit_messages, ugettext("Updating next payment dates"), started)
+
+
 def generate_adhoc_invoices(assigned_products_qs,
                             invoice_date,
                             send_to_twinfield):
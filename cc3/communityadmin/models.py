@@ -26,4 +26,10 @@ class CommunityMember(models.Model):
         raise NotImplementedError
 
     def member(self):
+        if getattr(self, '_member', None) is not None:
+            return self._member
         return CC3Profile.viewable.get(pk=self.id)
+
+    def set_member(self, cc3_profile):
+        """Sets the profile of the member, loaded with other members"""
+        self._member = cc3_profile
@@ -1,4 +1,25 @@
 """ Raw SQL for community admin members list. """
+
+# The ad counts of the profiles matching {where}
+AD_COUNTS = """
+      ( SELECT ad.`created_by_id`
+             , SUM( CASE WHEN ad.`adtype_id` = 1 THEN 1 ELSE 0 END ) AS offers
+             , SUM( CASE WHEN ad.`adtype_id` = 2 THEN 1 ELSE 0 END ) AS wants
+             , SUM( CASE WHEN ad.`status` = 'active' THEN 1 ELSE 0 END )
+                 AS active
+      FROM marketplace_ad AS ad
+        INNER JOIN `cyclos_cc3profile` AS ad_profile
+          ON ad.`created_by_id` = ad_profile.`id`
+      WHERE {where}
+      GROUP BY ad.`created_by_id` ) ads
+     ON `profile`.`id` = ads.created_by_id
+"""
+
+AD_COUNTS_WHERE_COMMUNITY = "ad_profile.`community_id` = %s"
+
+AD_COUNTS_WHERE_PROFILES = "ad_profile.`id` IN ({0})"
+
+# The members of a page of the list, with {where} selecting the profiles
 COMMUNITY_MEMBER_LIST = """
 SELECT
       `profile`.`id`
@@ -9,35 +30,46 @@ SELECT
     , `user`.`email` AS member_email
     , `profile`.`business_name`
     , `profile`.`company_website`
-    , COALESCE( offers.cnt, 0 ) AS count_offers
-    , COALESCE( wants.cnt, 0 ) AS count_wants
+    , COALESCE( ads.offers, 0 ) AS count_offers
+    , COALESCE( ads.wants, 0 ) AS count_wants
     , FALSE AS has_full_account
-    , COALESCE( active.cnt, 0) AS count_active_ads
+    , COALESCE( ads.active, 0) AS count_active_ads
     , `user`.`date_joined` AS date_joined
  FROM `cyclos_cc3profile` AS profile
    LEFT JOIN
-      ( SELECT created_by_id, COUNT(*) AS cnt
-      FROM marketplace_ad
-      WHERE marketplace_ad.`adtype_id` = 1
-      GROUP BY created_by_id ) offers
-     ON `profile`.`id` = offers.created_by_id
-   LEFT JOIN
-      ( SELECT created_by_id, COUNT(*) AS cnt
-      FROM marketplace_ad
-      WHERE marketplace_ad.`adtype_id` = 2
-      GROUP BY created_by_id ) wants
-     ON `profile`.`id` = wants.created_by_id
-   LEFT JOIN
-      ( SELECT created_by_id, COUNT(*) AS cnt
-      FROM marketplace_ad
-      WHERE marketplace_ad.`status` = 'active'
-      GROUP BY created_by_id ) active
-     ON `profile`.`id` = active.created_by_id
+""" + AD_COUNTS + """
+    LEFT JOIN
+        auth_user AS `user`
+        ON `profile`.`user_id` = `user`.id
+
+    WHERE `profile`.`id` IN ({profiles})
+"""
+
+# The ids of a page of members, ordered by {order_by}. {ad_counts} is only
+# joined when ordering by an ad count.
+COMMUNITY_MEMBER_LIST_PAGE = """
+SELECT `profile`.`id`
+ FROM `cyclos_cc3profile` AS profile
+   {ad_counts}
     LEFT JOIN
         auth_user AS `user`
         ON `profile`.`user_id` = `user`.id
 
     WHERE `profile`.`community_id` = %s
+    {where_extra}
+    ORDER BY {order_by} {direction}, `profile`.`id` {direction}
+    LIMIT %s OFFSET %s
+"""
+
+COMMUNITY_MEMBER_LIST_COUNT = """
+SELECT COUNT(*)
+ FROM `cyclos_cc3profile` AS profile
+    LEFT JOIN
+        auth_user AS `user`
+        ON `profile`.`user_id` = `user`.id
+
+    WHERE `profile`.`community_id` = %s
+    {where_extra}
 """
 
 COMMUNITY_MEMBER_LIST_WHERE_EXTRA = """
@@ -48,3 +80,15 @@ COMMUNITY_MEMBER_LIST_WHERE_EXTRA = """
         `user`.`email` LIKE %s
       )
 """
+
+# The columns the list can be ordered by
+COMMUNITY_MEMBER_LIST_ORDER_BY = {
+    'last_name': "`profile`.`last_name`",
+    'first_name': "`profile`.`first_name`",
+    'business_name': "`profile`.`business_name`",
+    'company_website': "`profile`.`company_website`",
+    'date_joined': "`user`.`date_joined`",
+    'count_offers': "COALESCE( ads.offers, 0 )",
+    'count_wants': "COALESCE( ads.wants, 0 )",
+    'count_active_ads': "COALESCE( ads.active, 0 )",
+}
@@ -6,7 +6,8 @@ from django.test import TestCase
 from django.test.client import RequestFactory
 
 from cc3.communityadmin.views import ContentListView, MemberListView
-from cc3.core.tests.test_factories import CategoryFactory
+from cc3.core.tests.test_factories import (
+    CategoryFactory, CategoryTranslationFactory)
 from cc3.core.utils.test_backend import DummyCyclosBackend
 from cc3.cyclos.tests.test_factories import (
     CC3ProfileFactory, CommunityAdminFactory, CommunityMessageFactory,
@@ -196,6 +197,37 @@ class MemberListViewTestCase(TestCase):
             [repr(member) for member in members],
             ordered=False)
 
+    def test_memberlist_get_queryset_paginated(self):
+        """
+        Tests that the members list is counted, and only loads the members of
+        the requested page, with their ad counts.
+        """
+        request = self.factory.get(self.url)
+        request.user = self.profile.user
+        view = MemberListView()
+        view.request = request
+
+        community = self.profile.community
+        for i in range(10):
+            CC3ProfileFactory.create(community=community)
+        AdFactory.create(created_by=self.member_1)
+        AdFactory.create(created_by=self.member_1)
+        AdFactory.create(created_by=self.member_2)
+
+        member_list = view.get_queryset('active_ads', 'desc')
+        self.assertEqual(member_list.count(), 12)
+
+        with self.assertNumQueries(3):
+            page = member_list[0:5]
+        self.assertEqual(len(page), 5)
+        self.assertEqual(page[0].member(), self.member_1)
+        self.assertEqual(page[0].count_active_ads, 2)
+        self.assertEqual(page[1].count_active_ads, 0)
+
+        self.assertEqual(len(member_list[10:15]), 2)
+        self.assertEqual(
+            len(set(member.id for member in member_list)), 12)
+
 
 class TransactionListViewTestCase(TestCase):
     """
@@ -621,3 +653,87 @@ class CommunityAdUpdateViewTestCase(TestCase):
         # TODO: Check that the edit ad submit degrades when no javascript is present
         self.assertEqual(response.status_code, 200)
         #self.assertRedirects(response, reverse('communityadmin_ns:wantsoffers'))
+
+
+class CategoriesReportViewTestCase(TestCase):
+    """
+    Test case for the ``CategoriesReportView`` class-based views.
+    """
+    def setUp(self):
+        set_backend(DummyCyclosBackend())
+
+        self.url = reverse('communityadmin_ns:categoriesreport')
+        self.want_url = reverse('communityadmin_ns:wantcategoriesreport')
+
+        self.profile = CC3ProfileFactory.create(is_approved=True)
+        self.anonymous_profile = CC3ProfileFactory.create()
+        CommunityAdminFactory.create(
+            user=self.profile.user,
+            community=self.profile.community
+        )
+
+        self.category_1 = CategoryFactory.create(title='Bakery')
+        self.category_2 = CategoryFactory.create(title='Garden')
+        CategoryTranslationFactory.create(
+            category=self.category_2, title='Tuin',
+            language=settings.LANGUAGE_CODE)
+
+        self.member_1 = CC3ProfileFactory.create(
+            community=self.profile.community, is_approved=True,
+            business_name='Member one')
+        self.member_1.categories.add(self.category_1, self.category_2)
+        self.member_1.want_categories.add(self.category_1)
+        self.member_2 = CC3ProfileFactory.create(
+            community=self.profile.community, is_approved=True,
+            business_name='Member two')
+        self.member_2.categories.add(self.category_2)
+        # Not approved, so not in the report.
+        self.member_3 = CC3ProfileFactory.create(
+            community=self.profile.community, is_approved=False)
+        self.member_3.categories.add(self.category_1)
+
+    def _get_rows(self, url):
+        self.client.login(
+            username=self.profile.user.username, password='testing')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        content = ''.join(response.streaming_content).decode('utf8')
+        return [line.split(',') for line in content.splitlines()]
+
+    def test_categoriesreport_permission_denied_non_community_member_user(
+            self):
+        """
+        Tests permission denied for those users who are not community admins
+        in the ``categoriesreport`` view.
+        """
+        self.client.login(
+            username=self.anonymous_profile.user.username, password='testing')
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_categoriesreport_rows(self):
+        """
+        Tests that the report has a row per approved member with their offer
+        categories, the translated category titles and the totals.
+        """
+        rows = self._get_rows(self.url)
+
+        self.assertEqual(rows[0][1:], [u'Bakery', u'Tuin'])
+        by_name = dict((row[0], row[1:]) for row in rows[1:-1])
+        self.assertEqual(len(by_name), 3)
+        self.assertEqual(by_name[u'Member one'], [u'1', u'1'])
+        self.assertEqual(by_name[u'Member two'], [u'', u'1'])
+        self.assertEqual(rows[-1][1:], [u'1', u'2'])
+
+    def test_wantcategoriesreport_rows(self):
+        """
+        Tests that the want categories report uses the want categories of the
+        members.
+        """
+        rows = self._get_rows(self.want_url)
+
+        by_name = dict((row[0], row[1:]) for row in rows[1:-1])
+        self.assertEqual(by_name[u'Member one'], [u'1', u''])
+        self.assertEqual(by_name[u'Member two'], [u'', u''])
+        self.assertEqual(rows[-1][1:], [u'1', u'0'])
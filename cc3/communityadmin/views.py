@@ -12,7 +12,7 @@ from django.core.files.storage import FileSystemStorage
 from django.core.mail import send_mail
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import connection, models
 from django.db.models import Q
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
@@ -23,7 +23,8 @@ from django.utils.datastructures import SortedDict
 from django.utils.decorators import method_decorator
 from django.utils.formats import date_format, time_format
 from django.utils.translation import ugettext, ugettext_lazy as _
-from django.views.generic import ListView, UpdateView, TemplateView, CreateView
+from django.views.generic import (
+    ListView, UpdateView, TemplateView, CreateView, View)
 
 from formtools.wizard.views import SessionWizardView
 from registration.models import RegistrationProfile
@@ -35,7 +36,8 @@ from cc3.cyclos.models import (
     User, CC3Profile, CyclosAccount, CommunityMessage, CyclosGroup,
     CommunityRegistrationCode, CC3Community)
 from cc3.cyclos.forms import CC3ProfileForm
-from cc3.excelexport.views import ExcelResponse
+from cc3.excelexport.utils import iter_queryset
+from cc3.excelexport.views import ExcelResponse, StreamingCSVResponse
 from cc3.marketplace.forms import AdImageFormSet
 from cc3.marketplace.models import (
     Ad, AdImage, AdPaymentTransaction, PreAdImage)
@@ -45,7 +47,10 @@ from cc3.registration.forms import TradeQoinRegistrationForm
 
 from .models import CommunityMember
 from .sql.profile import (
-    COMMUNITY_MEMBER_LIST, COMMUNITY_MEMBER_LIST_WHERE_EXTRA)
+    AD_COUNTS, AD_COUNTS_WHERE_COMMUNITY, AD_COUNTS_WHERE_PROFILES,
+    COMMUNITY_MEMBER_LIST, COMMUNITY_MEMBER_LIST_COUNT,
+    COMMUNITY_MEMBER_LIST_ORDER_BY, COMMUNITY_MEMBER_LIST_PAGE,
+    COMMUNITY_MEMBER_LIST_WHERE_EXTRA)
 from .forms import (
     OffersWantsForm, CommunityMessageForm, ChangeGroupForm, AdHoldForm,
     CommunityAdminAdForm, CommunityAdminCreatedByForm,
@@ -108,6 +113,87 @@ class EditContent(CommunityMixin, UpdateView):
         return reverse('communityadmin_ns:contentlist')
 
 
+class CommunityMemberList(object):
+    """
+    The (matching) members of a community, as ``CommunityMember`` objects,
+    for the paginator: it counts the members, and only loads the members of
+    the requested page, with the ad counts of those members.
+    """
+    def __init__(self, community, field, direction, query=None):
+        self.community = community
+        self.order_by = COMMUNITY_MEMBER_LIST_ORDER_BY[field]
+        self.order_by_ad_count = field.startswith('count_')
+        self.direction = direction
+        self.where_extra = u''
+        self.where_params = []
+        if query:
+            query = u"%{0}%".format(query)
+            self.where_extra = COMMUNITY_MEMBER_LIST_WHERE_EXTRA
+            self.where_params = [query, query, query, query]
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            cursor = connection.cursor()
+            cursor.execute(
+                COMMUNITY_MEMBER_LIST_COUNT.format(
+                    where_extra=self.where_extra),
+                [self.community.id] + self.where_params)
+            self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[0:self.count()])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        if stop <= start:
+            return []
+        return self.get_members(self.get_member_ids(start, stop - start))
+
+    def get_member_ids(self, offset, limit):
+        ad_counts = u''
+        params = [self.community.id] + self.where_params + [limit, offset]
+        if self.order_by_ad_count:
+            ad_counts = u'LEFT JOIN {0}'.format(
+                AD_COUNTS.format(where=AD_COUNTS_WHERE_COMMUNITY))
+            params.insert(0, self.community.id)
+
+        cursor = connection.cursor()
+        cursor.execute(COMMUNITY_MEMBER_LIST_PAGE.format(
+            ad_counts=ad_counts, where_extra=self.where_extra,
+            order_by=self.order_by, direction=self.direction), params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_members(self, member_ids):
+        """
+        Returns the ``CommunityMember`` objects of the member ids, in the same
+        order, with their profiles.
+        """
+        if not member_ids:
+            return []
+        placeholders = u', '.join([u'%s'] * len(member_ids))
+        members = dict(
+            (member.id, member) for member in CommunityMember.objects.raw(
+                COMMUNITY_MEMBER_LIST.format(
+                    where=AD_COUNTS_WHERE_PROFILES.format(placeholders),
+                    profiles=placeholders),
+                member_ids + member_ids))
+
+        profiles = CC3Profile.viewable.filter(
+            pk__in=member_ids).select_related(
+                'user', 'community', 'cyclos_group', 'cyclos_account')
+        for profile in profiles:
+            members[profile.pk].set_member(profile)
+        return [members[member_id] for member_id in member_ids]
+
+
 class MemberListView(CommunityMixin, ListView):
     model = CommunityMember
     template_name = 'communityadmin/member_list.html'
@@ -138,25 +224,9 @@ class MemberListView(CommunityMixin, ListView):
         if field in ['offers', 'wants', 'active_ads']:
             field = u'count_{0}'.format(field)
 
-        member_list_query = COMMUNITY_MEMBER_LIST
-        member_list_params = [community.id]  # which community
-        query = self.request.GET.get('q')
-        if query:
-            query = u"%{0}%".format(self.request.GET.get('q'))
-            member_list_query = u"{0} {1}".format(
-                member_list_query,
-                COMMUNITY_MEMBER_LIST_WHERE_EXTRA
-            )
-            member_list_params = member_list_params + [
-                query, query, query, query]
-
-        # use raw to get better ordering capabilities
-        member_list_query = u"{0} ORDER BY {1} {2}".format(
-            member_list_query, field, direction)
-        member_list = CommunityMember.objects.raw(
-            member_list_query, member_list_params)
-
-        return list(member_list)
+        # use raw SQL to get better ordering capabilities, a page at a time
+        return CommunityMemberList(
+            community, field, direction, query=self.request.GET.get('q'))
 
     def get_context_data(self, **kwargs):
         context = super(MemberListView, self).get_context_data(**kwargs)
@@ -173,55 +243,75 @@ class MemberListView(CommunityMixin, ListView):
 
 # Quick and dirty excel exports. Will later add a proper
 # page in Comm Admin
-class CategoriesReportView(CommunityMixin, ListView):
-    report_output_name = "categories_report"
+class CategoriesReport(object):
+    """
+    The rows of a categories report: for each approved member of a community,
+    a 1 for each active category it has in ``category_field``, followed by
+    the totals per category.
 
-    def get_queryset(self):
-        community = self.request.user.get_admin_community()
-        queryset = CC3Profile.objects.filter(community=community,
-                                             is_approved=True)
-        return queryset
+    The category titles and the members' categories are fetched up front, in
+    one query each, and the members are read in chunks while the rows are
+    written.
+    """
+    def __init__(self, community, category_field='categories'):
+        self.community = community
+        self.category_field = category_field
+        self.categories = list(Category.objects.active())
+        self.titles = Category.objects.get_titles(self.categories)
+        self.profile_categories = self.get_profile_categories()
+
+    def get_profiles(self):
+        return CC3Profile.objects.filter(
+            community=self.community, is_approved=True)
+
+    def get_profile_categories(self):
+        """
+        Returns the ids of the categories of each member, as a dict of sets
+        by profile id.
+        """
+        through = getattr(CC3Profile, self.category_field).through
+        profile_categories = {}
+        for profile_id, category_id in through.objects.filter(
+                cc3profile__community=self.community,
+                cc3profile__is_approved=True,
+                category__active=True).values_list(
+                    'cc3profile_id', 'category_id'):
+            profile_categories.setdefault(profile_id, set()).add(category_id)
+        return profile_categories
+
+    def get_headings(self):
+        return [ugettext('Business name')] + [
+            self.titles[category.id] for category in self.categories]
+
+    def __iter__(self):
+        yield self.get_headings()
+
+        totals = [0] * len(self.categories)
+        for profile_id, business_name in iter_queryset(
+                self.get_profiles().values_list('id', 'business_name')):
+            profile_categories = self.profile_categories.get(
+                profile_id, ())
+            row = [business_name]
+            for index, category in enumerate(self.categories):
+                if category.id in profile_categories:
+                    row.append(1)
+                    totals[index] += 1
+                else:
+                    row.append('')
+            yield row
 
-    def get_profile_categories(self, profile):
-        return [cat.id for cat in profile.categories.all()]
+        yield [ugettext('Total')] + totals
 
-    def dispatch(self, request, *args, **kwargs):
-        processed_profiles = []
-        categories = [
-            {'id': cat.id, 'title': cat.get_title()}
-            for cat in Category.objects.active()]
-        category_counts = {}
-        for category in categories:
-            category_counts[category['title']] = 0
-
-        for profile in self.get_queryset():
-            profile_dict = SortedDict()
-            profile_dict['business_name'] = profile.business_name
-            profile_categories = self.get_profile_categories(profile)
-            for category in categories:
-                if category['id'] in profile_categories:
-                    profile_dict[category['title']] = 1
-                    category_counts[category['title']] += 1
-                else:
-                    profile_dict[category['title']] = ''
-            processed_profiles.append(profile_dict)
 
-        if not processed_profiles:
-            processed_profiles = [[]]
-            headings = None
-        else:
-            total_dict = SortedDict()
-            total_dict['business_name'] = ugettext('Total')
-            for category in categories:
-                total_dict[category['title']] = \
-                    category_counts[category['title']]
-            processed_profiles.append(total_dict)
-            headings = [ugettext('Business name')]
-            headings.extend([cat['title'] for cat in categories])
+class CategoriesReportView(CommunityMixin, View):
+    report_output_name = "categories_report"
+    category_field = 'categories'
 
-        return ExcelResponse(
-            processed_profiles, force_csv=True,
-            output_name=self.report_output_name, header_override=headings)
+    def get(self, request, *args, **kwargs):
+        community = request.user.get_admin_community()
+        report = CategoriesReport(community, self.category_field)
+        return StreamingCSVResponse(
+            report, output_name=self.report_output_name)
 
 
 class OfferCategoriesReportView(CategoriesReportView):
@@ -230,9 +320,7 @@ class OfferCategoriesReportView(CategoriesReportView):
 
 class WantCategoriesReportView(CategoriesReportView):
     report_output_name = "want_categories_report"
-
-    def get_profile_categories(self, profile):
-        return [cat.id for cat in profile.want_categories.all()]
+    category_field = 'want_categories'
 
 
 class TransactionListView(CommunityMixin, ListView):
@@ -571,7 +659,7 @@ class ChangeGroupView(ProfileMixin, TemplateView):
         # Filter query to user's community's groups
         cc3_profile = context['cc3_profile']
         form.fields['groups'].queryset = self.get_groups_queryset()
-        group_id = backends.get_group(cc3_profile.user.email)
+        group_id = cc3_profile.get_cyclos_group_id()
         form.fields['groups'].initial = group_id
 
         context['form'] = form
@@ -586,7 +674,7 @@ class ChangeGroupView(ProfileMixin, TemplateView):
         form.fields['groups'].queryset = self.get_groups_queryset()
 
         # Set original_group_id on form, for validation purposes.
-        form.set_original_group_id(backends.get_group(cc3_profile.user.email))
+        form.set_original_group_id(cc3_profile.get_cyclos_group_id())
         context['form'] = form
 
         if form.is_valid():
@@ -24,6 +24,31 @@ class CategoryManager(models.Manager):
     def active(self):
         return self.model.objects.filter(active=True)
 
+    def get_titles(self, categories):
+        """
+        Returns the titles of categories in the current language, as a dict
+        by category id, with one query for all their translations.
+
+        Falls back like ``Category.get_title``.
+        """
+        current_language = get_language()
+        base_language = current_language.split('-')[0]
+        translations = {}
+        for category_id, language, title in \
+                CategoryTranslation.objects.filter(
+                    category__in=categories,
+                    language__in=(current_language, base_language)
+                ).values_list('category_id', 'language', 'title'):
+            translations[(category_id, language)] = title
+
+        titles = {}
+        for category in categories:
+            titles[category.id] = translations.get(
+                (category.id, current_language),
+                translations.get((category.id, base_language),
+                                 category.title))
+        return titles
+
 
 class Category(Sortable):
     parent = SortableForeignKey(
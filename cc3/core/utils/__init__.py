@@ -110,6 +110,12 @@ def instance_from_kwargs(model, **kwargs):
     })
 
 
+def chunks(items, size):
+    """Yield successive lists of (at most) size items from the list items."""
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
+
+
 def get_verification_docs_folder_name():
 
     fullpath = None
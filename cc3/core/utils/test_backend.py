@@ -85,6 +85,9 @@ class DummyCyclosBackend(object):
     def get_group(self, email):
         return self.dummy_group_id
 
+    def get_transfer_type(self, transfer_type_id=None, name=None):
+        return None
+
     def get_member_group_id(self):
         return self.dummy_group_id
 
@@ -95,3 +98,7 @@ class DummyCyclosBackend(object):
     def from_system_payment(self, sender, amount, description, transfer_type_id):
         return Transaction(sender, 'system', amount, datetime.datetime.now(),
                            description, USER_PAYMENT_TRANSACTION_ID)
+
+    def user_fund_donation(self, sender, amount, description):
+        return Transaction(sender, 'system', amount, datetime.datetime.now(),
+                           description, USER_PAYMENT_TRANSACTION_ID)
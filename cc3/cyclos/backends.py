@@ -1,7 +1,27 @@
 """Backends for the credits/payments/transactions system"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
 from cc3.cyclos.transactions import CyclosBackend
 
+# Seconds an account status (balance, credit limits) is cached. Payments done
+# through this module invalidate the status of sender and receiver. Set to 0
+# to disable caching.
+ACCOUNT_STATUS_CACHE_TIMEOUT = getattr(
+    settings, 'CYCLOS_ACCOUNT_STATUS_CACHE_TIMEOUT', 30)
+
+# Backend calls whose responses are shared within a request, and backend
+# calls which change what they return
+MEMOIZED_CALLS = ('get_account_status', 'get_group', 'search')
+CHANGING_CALLS = ('new', 'update', 'update_group', 'user_payment',
+                  'to_system_payment', 'from_system_payment',
+                  'user_fund_donation')
+
 _backend = None
+_local = threading.local()
 
 
 def get_backend():
@@ -16,6 +36,71 @@ def set_backend(backend):
     _backend = backend
 
 
+class CallMemo(object):
+    """
+    The Cyclos calls done while handling one request.
+
+    Calls of ``MEMOIZED_CALLS`` with the same arguments share one response,
+    calls of ``CHANGING_CALLS`` forget the shared responses.
+    """
+    def __init__(self):
+        self.responses = {}
+        self.calls = 0
+        self.memoized = 0
+
+    def forget(self):
+        self.responses.clear()
+
+
+def start_call_memo():
+    """
+    Starts sharing the responses of Cyclos calls in the current thread, until
+    ``stop_call_memo`` is called (see ``CyclosCallMemoMiddleware``).
+    """
+    _local.call_memo = CallMemo()
+    return _local.call_memo
+
+
+def stop_call_memo():
+    """Stops sharing responses. Returns the ``CallMemo``, if any."""
+    call_memo = getattr(_local, 'call_memo', None)
+    _local.call_memo = None
+    return call_memo
+
+
+def get_call_memo():
+    return getattr(_local, 'call_memo', None)
+
+
+def _call(method, *args, **kwargs):
+    """
+    Calls the backend, counting the call and sharing its response if a
+    ``CallMemo`` is started.
+    """
+    call_memo = get_call_memo()
+    if call_memo is None:
+        return getattr(get_backend(), method)(*args, **kwargs)
+
+    key = None
+    if method in MEMOIZED_CALLS:
+        key = (method, args, tuple(sorted(kwargs.items())))
+        try:
+            if key in call_memo.responses:
+                call_memo.memoized += 1
+                return call_memo.responses[key]
+        except TypeError:
+            # unhashable arguments, e.g. a list of group ids
+            key = None
+    elif method in CHANGING_CALLS:
+        call_memo.forget()
+
+    call_memo.calls += 1
+    response = getattr(get_backend(), method)(*args, **kwargs)
+    if key is not None:
+        call_memo.responses[key] = response
+    return response
+
+
 def new(username, name, email, business_name, initial_group_id,
         community_code=None, extra_fields=None):
     """
@@ -24,16 +109,17 @@ def new(username, name, email, business_name, initial_group_id,
     :Returns:
         a NewMember namedtuple
     """
-    return get_backend().new(
-        username, name, email, business_name, initial_group_id, community_code,
-        extra_fields)
+    return _call(
+        'new', username, name, email, business_name, initial_group_id,
+        community_code, extra_fields)
 
 
 def update(_id, name, email, business_name, community_code=None,
            extra_fields=None):
     """ Update account details. """
-    return get_backend().update(
-        _id, name, email, business_name, community_code, extra_fields)
+    return _call(
+        'update', _id, name, email, business_name, community_code,
+        extra_fields)
 
 
 def update_group(_id, new_group_id, comments):
@@ -46,8 +132,16 @@ def update_group(_id, new_group_id, comments):
     :param comments: A mandatory comment (string) for the reason of the group
     change.
     :return: The result of the ``CyclosBackend.update_group`` method.
+
+    The new group is stored as the group membership of the local
+    ``CyclosAccount``.
     """
-    return get_backend().update_group(_id, new_group_id, comments)
+    from cc3.cyclos.models import CyclosAccount
+
+    result = _call('update_group', _id, new_group_id, comments)
+    CyclosAccount.objects.filter(cyclos_id=_id).update(
+        cyclos_group=new_group_id)
+    return result
 
 
 def search(currentPage=None, pageSize=None,
@@ -60,10 +154,10 @@ def search(currentPage=None, pageSize=None,
     :return: a list of tuples (id, name, email, username, group_id)
     """
     # TODO: Result should probably be a namedtuple for consistency.
-    return get_backend().search(currentPage, pageSize,
-                                username, name, email,
-                                randomOrder, groupIds, groupFilterIds, fields,
-                                showCustomFields, showImages)
+    return _call('search', currentPage, pageSize,
+                 username, name, email,
+                 randomOrder, groupIds, groupFilterIds, fields,
+                 showCustomFields, showImages)
 
 
 def user_payment(sender, receiver, amount, description,
@@ -91,9 +185,11 @@ def user_payment(sender, receiver, amount, description,
     # :Returns:
     #     a Transaction namedtuple
     #     or raises TransactionException
-    return get_backend().user_payment(
-        sender, receiver, amount, description, transfer_type_id,
-        custom_fields)
+    transaction = _call(
+        'user_payment', sender, receiver, amount, description,
+        transfer_type_id, custom_fields)
+    invalidate_account_status(sender, receiver)
+    return transaction
 
 
 def to_system_payment(sender, amount, description, transfer_type_id):
@@ -109,8 +205,10 @@ def to_system_payment(sender, amount, description, transfer_type_id):
         a Transaction namedtuple
         or raises TransactionException
     """
-    return get_backend().to_system_payment(
-        sender, amount, description, transfer_type_id)
+    transaction = _call(
+        'to_system_payment', sender, amount, description, transfer_type_id)
+    invalidate_account_status(sender)
+    return transaction
 
 
 def from_system_payment(receiver, amount, description, transfer_type_id):
@@ -126,8 +224,28 @@ def from_system_payment(receiver, amount, description, transfer_type_id):
         a Transaction namedtuple
         or raises TransactionException
     """
-    return get_backend().from_system_payment(
-        receiver, amount, description, transfer_type_id)
+    transaction = _call(
+        'from_system_payment', receiver, amount, description, transfer_type_id)
+    invalidate_account_status(receiver)
+    return transaction
+
+
+def user_fund_donation(sender, amount, description):
+    """
+
+    :Params:
+        `sender`: user making the donation
+        `amount`: transaction amount
+        `description`: description of transaction
+
+    :Returns:
+        a Transaction namedtuple
+        or raises TransactionException
+    """
+    transaction = _call('user_fund_donation', sender, amount, description)
+    # the fund is whichever account the backend paid the donation to
+    invalidate_account_status(sender, transaction.recipient)
+    return transaction
 
 
 # The following are consolidated in to one call
@@ -151,10 +269,44 @@ def get_account_status(username):
     """
     Get account status of user.
 
+    The status is cached for ``CYCLOS_ACCOUNT_STATUS_CACHE_TIMEOUT`` seconds.
+
     :Returns:
         AccountStatus namedtuple
     """
-    return get_backend().get_account_status(username)
+    if not ACCOUNT_STATUS_CACHE_TIMEOUT:
+        return _call('get_account_status', username)
+
+    key = _account_status_cache_key(username)
+    account_status = cache.get(key)
+    if account_status is None:
+        account_status = _call('get_account_status', username)
+        cache.set(key, account_status, ACCOUNT_STATUS_CACHE_TIMEOUT)
+    return account_status
+
+
+def invalidate_account_status(*accounts):
+    """
+    Remove the cached account status of the given accounts.
+
+    Accounts are usernames, ``User`` or ``CC3Profile`` instances. ``None``
+    (the system account) is ignored.
+    """
+    keys = [_account_status_cache_key(_get_username(account))
+            for account in accounts if account is not None]
+    if keys:
+        cache.delete_many(keys)
+
+
+def _get_username(account):
+    if hasattr(account, 'user'):
+        account = account.user
+    return getattr(account, 'username', account)
+
+
+def _account_status_cache_key(username):
+    return 'cyclos_account_status_{0}'.format(
+        hashlib.md5(username.encode('utf-8')).hexdigest())
 
 
 # def get_total_count(username):
@@ -171,7 +323,8 @@ def transactions(username=None, description=None, from_to=None, from_date=None,
                  to_date=None, direction=None, community=None,
                  account_type_id=None, currency=None):
     """ Get a list of transaction for a user or a group of users. """
-    return get_backend().transactions(
+    return _call(
+        'transactions',
         username=username,
         description=description,
         from_to=from_to,
@@ -183,8 +336,18 @@ def transactions(username=None, description=None, from_to=None, from_date=None,
         currency=currency)
 
 
+def get_transfer_type(transfer_type_id=None, name=None):
+    """
+    Get a Cyclos transfer type by id or by name, without calling Cyclos.
+
+    :Returns:
+        TransferType namedtuple or None
+    """
+    return get_backend().get_transfer_type(transfer_type_id, name)
+
+
 def get_group(email):
-    return get_backend().get_group(email)
+    return _call('get_group', email)
 
 
 def get_member_group_id():
@@ -3,14 +3,23 @@ from xml.parsers.expat import ExpatError
 
 from cc3.cyclos import backends
 from cc3.cyclos.services import MemberNotFoundException
+from django.conf import settings
 from django.contrib import messages
 from django.utils.translation import ugettext_lazy as _
 
 
 LOG = logging.getLogger(__name__)
 
+# Render pages without the balance, which the page requests afterwards from
+# the ``accounts_balance`` JSON view
+BALANCE_ASYNC = getattr(settings, 'CYCLOS_BALANCE_ASYNC', False)
 
-def balance(request):
+
+def get_account_balance(request, add_messages=True):
+    """
+    Returns the balance and credit limits of the user of the request, from
+    Cyclos.
+    """
     _balance = upper_credit_limit = lower_credit_limit = None
     has_account = False
 
@@ -35,9 +44,10 @@ def balance(request):
             #     has_account = False
             #     _balance = None
             except ExpatError as e:
-                messages.add_message(
-                    request, messages.WARNING, _("Unable to get account "
-                                                 "details at present"))
+                if add_messages:
+                    messages.add_message(
+                        request, messages.WARNING, _("Unable to get account "
+                                                     "details at present"))
                 LOG.info(u"Exception {0}".format(e))
                 has_account = False
                 _balance = None
@@ -52,3 +62,54 @@ def balance(request):
         'upper_credit_limit': upper_credit_limit,
         'lower_credit_limit': lower_credit_limit
     }
+
+
+class LazyAccountBalance(object):
+    """
+    The balance of the user of the request, requested from Cyclos when a
+    template first reads one of its values.
+
+    Its methods are put in the context: templates call them when resolving
+    ``{{ balance }}`` etc.
+    """
+    def __init__(self, request):
+        self.request = request
+        self._account_balance = None
+
+    def get(self, key):
+        if self._account_balance is None:
+            self._account_balance = get_account_balance(self.request)
+        return self._account_balance[key]
+
+    def balance(self):
+        return self.get('balance')
+
+    def has_account(self):
+        return self.get('has_account')
+
+    def upper_credit_limit(self):
+        return self.get('upper_credit_limit')
+
+    def lower_credit_limit(self):
+        return self.get('lower_credit_limit')
+
+
+def balance(request):
+    if BALANCE_ASYNC:
+        # filled in by the page, see ``accounts.views.account_balance``
+        return {
+            'balance': None,
+            'has_account': False,
+            'upper_credit_limit': None,
+            'lower_credit_limit': None,
+            'balance_async': request.user.is_authenticated(),
+        }
+
+    account_balance = LazyAccountBalance(request)
+    return {
+        'balance': account_balance.balance,
+        'has_account': account_balance.has_account,
+        'upper_credit_limit': account_balance.upper_credit_limit,
+        'lower_credit_limit': account_balance.lower_credit_limit,
+        'balance_async': False,
+    }
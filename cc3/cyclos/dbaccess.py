@@ -1,8 +1,25 @@
-"""Direct access to the Cyclos database"""
+"""Direct access to the Cyclos database
+
+Connections are taken from a process-wide ``ConnectionPool`` instead of
+connecting for every query. Use the ``cyclos_connection`` context manager::
+
+    with cyclos_connection() as connection:
+        rows = list(cyclos_query_results(connection, sql, args))
+
+or pair ``get_cyclos_connection`` with ``close_cyclos_connection``, which
+returns the connection to the pool.
+"""
 
 import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import MySQLdb
 import MySQLdb.cursors
+from MySQLdb import Error as DatabaseError
 
 from django.conf import settings
 
@@ -20,22 +37,214 @@ CYCLOS_DB_CONFIG = {
 }
 ROWLIMIT = 1000
 
+# Maximum number of connections (in use or idle) per process, 0 disables
+# pooling (a new connection for every query)
+POOL_SIZE = getattr(settings, 'CYCLOS_DB_POOL_SIZE', 5)
+# Seconds an idle connection is kept open
+POOL_MAX_IDLE_TIME = getattr(settings, 'CYCLOS_DB_POOL_MAX_IDLE_TIME', 300)
+# Seconds to wait for a free connection when all are in use
+POOL_CHECKOUT_TIMEOUT = getattr(
+    settings, 'CYCLOS_DB_POOL_CHECKOUT_TIMEOUT', 30)
+
+
+class PoolExhaustedError(DatabaseError):
+    """No connection became available within the checkout timeout."""
+
+
+class ConnectionPool(object):
+    """
+    Bounded, thread-safe pool of connections to the Cyclos database.
+
+    Idle connections are pinged before being handed out, and closed once
+    they have been idle for longer than ``max_idle_time`` seconds. When all
+    ``max_connections`` are in use, ``checkout`` waits (at most
+    ``checkout_timeout`` seconds) for one to be returned.
+    """
+    def __init__(self, config, max_connections=POOL_SIZE,
+                 max_idle_time=POOL_MAX_IDLE_TIME,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT):
+        self.config = config
+        self.max_connections = max_connections
+        self.max_idle_time = max_idle_time
+        self.checkout_timeout = checkout_timeout
+
+        self._condition = threading.Condition(threading.Lock())
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # (connection, returned at) tuples, most recently returned last
+        self._idle = deque()
+        self._size = 0
+        self.checkouts = 0
+        self.exhausted = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def connect(self):
+        return MySQLdb.connect(**self.config)
+
+    def checkout(self):
+        started = time.time()
+        connection = None
+        with self._condition:
+            if self._pid != os.getpid():
+                # Forked: the connections belong to the parent process
+                self._reset()
+
+            waited = False
+            while True:
+                if self._idle:
+                    connection, returned = self._idle.pop()
+                    break
+                if self._size < self.max_connections:
+                    self._size += 1
+                    break
+                if not waited:
+                    waited = True
+                    self.exhausted += 1
+                    LOG.warning(u'Cyclos database connection pool exhausted '
+                                u'({0} connections in use)'.format(
+                                    self._size))
+                remaining = started + self.checkout_timeout - time.time()
+                if remaining <= 0:
+                    raise PoolExhaustedError(
+                        u'No Cyclos database connection available after '
+                        u'{0} seconds'.format(self.checkout_timeout))
+                self._condition.wait(remaining)
+
+            wait_time = time.time() - started
+            self.checkouts += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        if connection is not None and not self._is_usable(
+                connection, returned):
+            connection = None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except:
+                self._release_slot()
+                raise
+        return connection
+
+    def _is_usable(self, connection, returned):
+        if time.time() - returned > self.max_idle_time:
+            LOG.debug(u'Closing idle Cyclos database connection')
+            self._close(connection)
+            return False
+        try:
+            connection.ping()
+        except DatabaseError, e:
+            LOG.info(u'Discarding broken Cyclos database connection: '
+                     u'{0}'.format(e))
+            self._close(connection)
+            return False
+        return True
+
+    def checkin(self, connection, discard=False):
+        """
+        Return a connection to the pool, or close it if ``discard`` is set
+        (after an error, for example).
+        """
+        if not discard:
+            try:
+                # End the transaction, so the next user doesn't read from a
+                # stale (repeatable read) snapshot
+                connection.rollback()
+            except DatabaseError:
+                discard = True
+
+        if discard or self._pid != os.getpid():
+            self._close(connection)
+            self._release_slot()
+            return
+
+        with self._condition:
+            self._idle.append((connection, time.time()))
+            self._condition.notify()
+
+    def _release_slot(self):
+        with self._condition:
+            self._size = max(self._size - 1, 0)
+            self._condition.notify()
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except DatabaseError:
+            pass
+
+    def close(self):
+        """Close all idle connections."""
+        with self._condition:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection, returned in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'checkouts': self.checkouts,
+                'exhausted': self.exhausted,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+            }
+
+
+if POOL_SIZE:
+    pool = ConnectionPool(CYCLOS_DB_CONFIG)
+else:
+    pool = None
+
 
 def get_cyclos_connection(results_as_dict=True):
     if results_as_dict:
         cursorclass = MySQLdb.cursors.DictCursor
     else:
         cursorclass = MySQLdb.cursors.Cursor
-    db = MySQLdb.connect(**CYCLOS_DB_CONFIG)
+    if pool is not None:
+        db = pool.checkout()
+    else:
+        db = MySQLdb.connect(**CYCLOS_DB_CONFIG)
     return {
         'db': db,
         'cursor': db.cursor(cursorclass)
     }
 
 
-def close_cyclos_connection(connection):
-    connection['cursor'].close()
-    connection['db'].close()
+def close_cyclos_connection(connection, discard=False):
+    try:
+        connection['cursor'].close()
+    except DatabaseError:
+        discard = True
+    if pool is not None:
+        pool.checkin(connection['db'], discard=discard)
+    else:
+        connection['db'].close()
+
+
+@contextmanager
+def cyclos_connection(results_as_dict=True):
+    """
+    Context manager version of ``get_cyclos_connection``. The connection is
+    returned to the pool afterwards, or discarded after a database error.
+    """
+    connection = get_cyclos_connection(results_as_dict=results_as_dict)
+    discard = False
+    try:
+        yield connection
+    except DatabaseError:
+        discard = True
+        raise
+    finally:
+        close_cyclos_connection(connection, discard=discard)
 
 
 def cyclos_query_results(connection, sql, args):
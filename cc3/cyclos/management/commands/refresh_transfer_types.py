@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cc3.cyclos.backends import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Load the Cyclos transfer types into the transfer type registry'
+
+    def handle(self, *args, **options):
+        count = get_backend().transfer_types.refresh()
+        self.stdout.write(u'Loaded {0} transfer types'.format(count))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from cc3.cyclos.utils import reconcile_cyclos_groups
+
+
+class Command(BaseCommand):
+    help = ('Store the current Cyclos group of all Cyclos accounts. Schedule '
+            'this to run regularly (e.g. nightly), to pick up group changes '
+            'made in Cyclos itself.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size', type=int, dest='page_size', default=500,
+            help='Number of Cyclos members requested at a time')
+
+    def handle(self, *args, **options):
+        updated = reconcile_cyclos_groups(page_size=options['page_size'])
+        self.stdout.write(
+            u'Updated the Cyclos group of {0} accounts'.format(updated))
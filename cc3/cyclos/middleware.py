@@ -0,0 +1,26 @@
+import logging
+
+from cc3.cyclos import backends
+
+
+LOG = logging.getLogger(__name__)
+
+
+class CyclosCallMemoMiddleware(object):
+    """
+    Shares the responses of duplicate Cyclos calls (account status, group,
+    member search) within a request, so a page render asks Cyclos at most
+    once per account. Logs the number of Cyclos calls of each request.
+
+    The ``CallMemo`` of the request is available as ``request.cyclos_calls``.
+    """
+    def process_request(self, request):
+        request.cyclos_calls = backends.start_call_memo()
+
+    def process_response(self, request, response):
+        call_memo = backends.stop_call_memo()
+        if call_memo is not None and call_memo.calls:
+            LOG.debug(u"{0} {1}: {2} Cyclos calls, {3} shared".format(
+                request.method, request.path, call_memo.calls,
+                call_memo.memoized))
+        return response
@@ -10,6 +10,7 @@ from django.conf import settings
 from django.contrib.auth import user_logged_in
 from django.contrib.auth.models import User as AuthUser
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import mail_admins
 from django.core.urlresolvers import reverse, NoReverseMatch
@@ -64,6 +65,11 @@ SYSTEM_USER_IDS = (
     settings.CYCLOS_FONDS_USER_ID
 )
 
+# Seconds the Cyclos group of a profile without (local) Cyclos account is
+# cached
+CYCLOS_GROUP_CACHE_TIMEOUT = getattr(
+    settings, 'CYCLOS_GROUP_CACHE_TIMEOUT', 3600)
+
 LOG = logging.getLogger('cc3.cyclos.account')
 
 get_fullname_signal = Signal(providing_args=["instance", ])
@@ -566,11 +572,44 @@ class CC3Profile(models.Model):
         except IOError:
             return None
 
+    def get_cyclos_group_id(self):
+        """
+        Return the id of the Cyclos group this ``CC3Profile`` is a member of,
+        from the group membership stored in ``CyclosAccount.cyclos_group``.
+
+        Cyclos is only asked if the membership is not stored yet (it is
+        stored then), or if the profile has no Cyclos account (the group is
+        cached then).
+        """
+        try:
+            cyclos_account = self.cyclos_account
+        except ObjectDoesNotExist:
+            group_id = cache.get(self._cyclos_group_cache_key())
+            if group_id is None:
+                group_id = backends.get_group(self.user.email)
+                self._cache_cyclos_group_id(group_id)
+            return group_id or None
+
+        if cyclos_account.cyclos_group is None:
+            cyclos_account.set_cyclos_group(
+                backends.get_group(self.user.email))
+        return cyclos_account.cyclos_group
+
+    def _cyclos_group_cache_key(self):
+        return 'cyclos_group_id_{0}'.format(self.user_id)
+
+    def _cache_cyclos_group_id(self, group_id):
+        # 0: no group
+        cache.set(self._cyclos_group_cache_key(), group_id or 0,
+                  CYCLOS_GROUP_CACHE_TIMEOUT)
+
     def get_cyclos_group(self):
         """
         Return the ``CyclosGroup`` for this ``CC3Profile`` or ``None``.
         """
-        group_id = backends.get_group(self.user.email)
+        return self._find_cyclos_group(self.get_cyclos_group_id())
+
+    def _find_cyclos_group(self, group_id):
         if self.community:
             groups = self.community.get_groups()
             initial_groups = groups.filter(initial=True, id=group_id)
@@ -583,10 +622,15 @@ class CC3Profile(models.Model):
 
     def sync_cyclos_group(self):
         """
-        Updates the ``cyclos_group`` field with the current Cyclos group in the
-        Cyclos remote database.
+        Updates the ``cyclos_group`` field, and the stored group membership,
+        with the current Cyclos group in the Cyclos remote database.
         """
-        group = self.get_cyclos_group()
+        group_id = backends.get_group(self.user.email)
+        try:
+            self.cyclos_account.set_cyclos_group(group_id)
+        except ObjectDoesNotExist:
+            self._cache_cyclos_group_id(group_id)
+        group = self._find_cyclos_group(group_id)
         if group:
             self.cyclos_group = group
             self.save()
@@ -639,7 +683,7 @@ class CC3Profile(models.Model):
 
     def has_full_account(self):
         if getattr(settings, 'CYCLOS_HAS_TRIAL_ACCOUNTS', True):
-            group_id = backends.get_group(self.user.email)
+            group_id = self.get_cyclos_group_id()
             if group_id is None or (self.community and group_id in list(
                     self.community.get_initial_groups().values_list(
                         'id', flat=True))):
@@ -1264,6 +1308,7 @@ class CC3Profile(models.Model):
                 backends.update_group(self.cyclos_account.cyclos_id,
                                       inactive_group.id,
                                       ugettext(u"User closed account"))
+                self.cyclos_account.cyclos_group = inactive_group.id
 
                 self.cyclos_group = inactive_group
                 self.web_payments_enabled = False
@@ -1428,6 +1473,7 @@ class CyclosAccount(models.Model):
                 # SDW: NB - cyclos initial group set in cyclos, not saved to
                 # django. Also - group set by another method in SamenDoen -
                 # via the 'IndividualProfile' save method.
+                # The group is stored as the group membership though.
 
                 # Create the new account.
                 new_account = backends.new(
@@ -1442,9 +1488,13 @@ class CyclosAccount(models.Model):
                 )
 
                 self.cyclos_id = new_account.id
+                self.cyclos_group = initial_group_id
             else:
                 # Assign the previously created account.
                 self.cyclos_id = existent[0]
+                # (an empty string when Cyclos has no group id)
+                if existent[4]:
+                    self.cyclos_group = int(existent[4])
         else:
             # An update
             backends.update(
@@ -1465,6 +1515,17 @@ class CyclosAccount(models.Model):
         """User instance linked to this Cyclos account"""
         return self.cc3_profile.user
 
+    def set_cyclos_group(self, group_id):
+        """
+        Stores the Cyclos group the account is a member of, without updating
+        the account in Cyclos.
+        """
+        if group_id is None:
+            return
+        self.cyclos_group = group_id
+        CyclosAccount.objects.filter(cyclos_id=self.cyclos_id).update(
+            cyclos_group=group_id)
+
 
 @receiver(post_save, sender=CC3Profile,
           dispatch_uid='cc3_qoin_profile_save')
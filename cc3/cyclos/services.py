@@ -22,6 +22,7 @@ import logging
 import os
 import tempfile
 import textwrap
+import threading
 from collections import namedtuple
 from pprint import pprint
 from string import ascii_letters, digits
@@ -97,6 +98,9 @@ class CyclosSoapClient(SoapClient):
         self.basic_auth_obfuscated = None
         self.response = None
         self.content = None
+        # Optional shared transport (ie ``KeepAliveTransport``), used instead
+        # of the client's own ``http`` for sending requests
+        self.transport = None
 
     def enable_http_basic_auth(self, basic_auth_user, basic_auth_pass):
         self.basic_auth_enabled = True
@@ -137,7 +141,8 @@ class CyclosSoapClient(SoapClient):
             print '\n'.join([
                   '{0}: {1}'.format(k, v) for k, v in headers.items()])
             print u'\n{0}'.format(xml.decode('utf8', 'ignore'))
-        response, content = self.http.request(
+        transport = self.transport or self.http
+        response, content = transport.request(
             location, 'POST', body=xml, headers=headers)
 
         self.response = response
@@ -153,13 +158,81 @@ class CyclosSoapClient(SoapClient):
         return content
 
 
+class SoapClientPool(object):
+    """
+    Per-thread cache of ``CyclosSoapClient`` instances.
+
+    Building a client parses the WSDL and rebuilds the port map, which is
+    expensive compared to the actual webservice call. ``SoapClient`` is not
+    thread safe, so instead of sharing one client between threads every thread
+    keeps its own client per service class and location. The client keeps its
+    parsed service definitions and its HTTP connection between calls.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get_clients(self):
+        clients = getattr(self._local, 'clients', None)
+        if clients is None or self._local.generation != self._generation:
+            clients = self._local.clients = {}
+            self._local.generation = self._generation
+        return clients
+
+    def get(self, service):
+        """
+        Return the client of the current thread for the given ``service``,
+        building (and caching) it if there is none yet.
+        """
+        key = (service.__class__, service.location, service.wsdl,
+               service.basic_auth_user, service.trace, service.cache,
+               service.transport)
+        clients = self._get_clients()
+        client = clients.get(key)
+
+        with self._lock:
+            if client is not None:
+                self.hits += 1
+                return client
+            self.misses += 1
+
+        client = clients[key] = service.build_client()
+        with self._lock:
+            self.size += 1
+        return client
+
+    def clear(self):
+        """
+        Drop all cached clients. Threads build new clients on their next call.
+        """
+        with self._lock:
+            self._generation += 1
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+client_pool = SoapClientPool()
+
+
 class BaseService(object):
     """Base class for the SOAP webservice `ports`"""
     service_location = None  # relative path of the webservice
     wsdl = None
 
     def __init__(self, base_location, basic_auth_user=None,
-                 basic_auth_pass=None, trace=False, cache=False):
+                 basic_auth_pass=None, trace=False, cache=False,
+                 pool=client_pool, transport=None):
         if self.service_location is None:
             raise ValueError('Webservice location required')
         if self.wsdl is None:
@@ -170,14 +243,17 @@ class BaseService(object):
         self.trace = trace
         self.basic_auth_user = basic_auth_user
         self.basic_auth_pass = basic_auth_pass
+        self.pool = pool
+        self.transport = transport
 
         LOG.debug('Initializing webservice for {0} on {1}'.format(
             self.wsdl, self.location))
 
-    def get_client(self):
+    def build_client(self):
         client = CyclosSoapClient(
             location=self.location, wsdl=self.wsdl, ns=NAMESPACE_PREFIX,
             cache=_get_cache_dir(self.cache), trace=self.trace)
+        client.transport = self.transport
 
         if self.basic_auth_user is not None and \
                 self.basic_auth_pass is not None:
@@ -191,9 +267,15 @@ class BaseService(object):
 
         return client
 
+    def get_client(self):
+        # SoapClient is not thread safe, so the pool hands out one client per
+        # thread (or a new instance if pooling is disabled)
+        if self.pool is None:
+            return self.build_client()
+        return self.pool.get(self)
+
     @property
     def client(self):
-        # SoapClient is not thread safe, so new instance
         return self.get_client()
 
 
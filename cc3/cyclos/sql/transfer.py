@@ -96,9 +96,84 @@ GROUP BY recipient
 WITH ROLLUP
 """
 
+TRANSFERS_TOTALS_BY_SENDER_AND_RECIPIENT = """SELECT
+	  tf.owner_name AS sender
+	, tt.owner_name AS recipient
+	, COUNT(*) AS total_count
+	, SUM(t.amount) AS total_amount
+FROM
+	transfers t 		JOIN
+	accounts tf ON
+		t.from_account_id = tf.id	JOIN
+	accounts tt ON
+		t.to_account_id = tt.id
+
+{where_sql}
+
+GROUP BY sender, recipient
+"""
+
 TRANSFERS_WHERE_SENDER = "tf.owner_name in %s"
 TRANSFERS_WHERE_RECIPIENT = "tt.owner_name in %s"
 TRANSFERS_WHERE_SENDER_OR_RECIPIENT = "(tf.owner_name in %s OR tt.owner_name in %s)"
 TRANSFERS_WHERE_TYPE_ID = "t.type_id in %s"
 TRANSFERS_WHERE_FROM_DATE = "DATE(t.date) >= %s"
 TRANSFERS_WHERE_TO_DATE = "DATE(t.date) <= %s"
+# case sensitive, like the ``in`` operator in Python
+TRANSFERS_WHERE_DESCRIPTION_EXCLUDES = \
+    "(t.description IS NULL OR INSTR(t.description, BINARY %s) = 0)"
+
+
+# Account history (see ``transactions.DatabaseTransactions``)
+# Names of system accounts are taken from their account type.
+TRANSFERS_HISTORY_FROM = """FROM
+	transfers t 		JOIN
+	accounts tf ON
+		t.from_account_id = tf.id	JOIN
+	account_types atf ON
+		tf.type_id = atf.id	JOIN
+	accounts tt ON
+		t.to_account_id = tt.id	JOIN
+	account_types att ON
+		tt.type_id = att.id
+"""
+
+TRANSFERS_HISTORY_SELECT = """SELECT
+	  t.id AS transfer_id
+	, COALESCE(tf.owner_name, atf.name) AS sender
+	, COALESCE(tt.owner_name, att.name) AS recipient
+	, t.date
+	, t.process_date
+	, t.amount
+	, t.type_id AS transfer_type_id
+	, t.description
+""" + TRANSFERS_HISTORY_FROM + """
+{where_sql}
+
+ORDER BY t.date {direction}, t.id {direction}
+
+LIMIT %s OFFSET %s
+"""
+
+# Takes the username twice (or NULL for multiple accounts), before the
+# where clause args
+TRANSFERS_HISTORY_TOTALS = """SELECT
+	  COUNT(*) AS total_count
+	, SUM(t.amount) AS total_amount
+	, SUM(CASE WHEN tf.owner_name = %s THEN t.amount ELSE 0 END) AS total_sent
+	, SUM(CASE WHEN tt.owner_name = %s THEN t.amount ELSE 0 END) AS total_received
+""" + TRANSFERS_HISTORY_FROM + """
+{where_sql}
+"""
+
+TRANSFERS_WHERE_ACCOUNT_TYPE_ID = "(tf.type_id = %s OR tt.type_id = %s)"
+TRANSFERS_WHERE_CURRENCY = \
+    "att.currency_id = (SELECT c.id FROM currencies c WHERE c.symbol = %s)"
+# Without DATE(), so the index on transfers.date can be used
+TRANSFERS_WHERE_FROM_DATETIME = "t.date >= %s"
+TRANSFERS_WHERE_BEFORE_DATETIME = "t.date < %s"
+# Keyset pagination, continuing after the (date, id) of the last transfer
+TRANSFERS_WHERE_AFTER_KEY = {
+    'ASC': "(t.date > %s OR (t.date = %s AND t.id > %s))",
+    'DESC': "(t.date < %s OR (t.date = %s AND t.id < %s))",
+}
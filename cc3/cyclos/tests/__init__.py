@@ -1,4 +1,10 @@
+from .test_backends import (
+    AccountStatusCacheTestCase, CallMemoTestCase, DatabaseTransactionsTestCase,
+    PageableTransactionsTestCase, TransferTypeRegistryTestCase)
 from .test_context_processors import BalanceTestCase
+from .test_dbaccess import ConnectionPoolTestCase
 from .test_forms import CC3ProfileFormTestCase
-from .test_models import CC3ProfileTestCase, CyclosAccountTestCase
+from .test_models import (
+    CC3ProfileTestCase, CyclosAccountTestCase, CyclosGroupMembershipTestCase)
 from .test_operations import PaymentTests, RegisterTests, UpdateTests
+from .test_services import KeepAliveTransportTestCase, SoapClientPoolTestCase
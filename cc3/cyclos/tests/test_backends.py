@@ -0,0 +1,380 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from mock import MagicMock, patch
+
+from cc3.core.utils.test_backend import DummyCyclosBackend
+from cc3.cyclos import backends
+from cc3.cyclos.common import AccountHistory, TransactionException
+from cc3.cyclos.dbaccess import DatabaseError
+from cc3.cyclos.middleware import CyclosCallMemoMiddleware
+from cc3.cyclos.transactions import (
+    CyclosBackend, DatabaseTransactions, PageableTransactions)
+from cc3.cyclos.services import TransferType, TransferTypeTarget
+from cc3.cyclos.transfer_types import TransferTypeRegistry
+
+
+class AccountStatusCacheTestCase(TestCase):
+    """
+    Test case for the cached ``backends.get_account_status``.
+    """
+    def setUp(self):
+        cache.clear()
+        self.backend = DummyCyclosBackend()
+        backends.set_backend(self.backend)
+
+    def test_account_status_cached(self):
+        """
+        Tests that the account status is only requested from the backend once.
+        """
+        with patch.object(self.backend, 'get_account_status',
+                          wraps=self.backend.get_account_status) as mock:
+            status = backends.get_account_status('sender')
+            self.assertEqual(backends.get_account_status('sender'), status)
+
+        self.assertEqual(mock.call_count, 1)
+
+    def test_invalidated_by_user_payment(self):
+        """
+        Tests that a payment invalidates the status of sender and receiver.
+        """
+        with patch.object(self.backend, 'get_account_status',
+                          wraps=self.backend.get_account_status) as mock:
+            backends.get_account_status('sender')
+            backends.get_account_status('receiver')
+            backends.user_payment('sender', 'receiver', 10, 'Test')
+            backends.get_account_status('sender')
+            backends.get_account_status('receiver')
+
+        self.assertEqual(mock.call_count, 4)
+
+    def test_invalidated_by_system_payments(self):
+        """
+        Tests that payments to and from the system invalidate the status of
+        the member account.
+        """
+        with patch.object(self.backend, 'get_account_status',
+                          wraps=self.backend.get_account_status) as mock:
+            backends.get_account_status('member')
+            backends.to_system_payment('member', 10, 'Test', 1)
+            backends.get_account_status('member')
+            backends.from_system_payment('member', 10, 'Test', 1)
+            backends.get_account_status('member')
+
+        self.assertEqual(mock.call_count, 3)
+
+    def test_invalidated_by_fund_donation(self):
+        """
+        Tests that a donation invalidates the status of the member and of
+        the fund account.
+        """
+        with patch.object(self.backend, 'get_account_status',
+                          wraps=self.backend.get_account_status) as mock:
+            backends.get_account_status('member')
+            backends.get_account_status('system')
+            backends.user_fund_donation('member', 10, 'Test')
+            backends.get_account_status('member')
+            backends.get_account_status('system')
+
+        self.assertEqual(mock.call_count, 4)
+
+    @patch('cc3.cyclos.backends.ACCOUNT_STATUS_CACHE_TIMEOUT', 0)
+    def test_cache_disabled(self):
+        """
+        Tests that a timeout of 0 disables caching.
+        """
+        with patch.object(self.backend, 'get_account_status',
+                          wraps=self.backend.get_account_status) as mock:
+            backends.get_account_status('sender')
+            backends.get_account_status('sender')
+
+        self.assertEqual(mock.call_count, 2)
+
+
+class TransferTypeRegistryTestCase(TestCase):
+    """
+    Test case for the ``TransferTypeRegistry``.
+    """
+    def setUp(self):
+        cache.clear()
+        target = TransferTypeTarget(id=1, name='Member account', currency='P')
+        self.accounts = MagicMock()
+        self.accounts.search_transfer_types.return_value = [
+            TransferType(id=31, name=u'Trade', from_=target, to=target),
+            TransferType(id=32, name=u'Donation', from_=target, to=target),
+        ]
+        self.registry = TransferTypeRegistry(self.accounts)
+
+    def test_lookup(self):
+        """
+        Tests lookups by id and by name after a refresh.
+        """
+        self.registry.refresh()
+
+        self.assertEqual(self.registry.get_by_id(32).name, u'Donation')
+        self.assertEqual(self.registry.get_by_id('31').name, u'Trade')
+        self.assertEqual(self.registry.get_by_name(u'Trade').id, 31)
+        self.assertIsNone(self.registry.get_by_name(u'Unknown'))
+
+    def test_loaded_from_cache(self):
+        """
+        Tests that a new registry uses the transfer types in the cache,
+        without calling Cyclos.
+        """
+        self.registry.refresh()
+        registry = TransferTypeRegistry(self.accounts)
+
+        self.assertEqual(registry.get_by_name(u'Donation').id, 32)
+        self.assertEqual(self.accounts.search_transfer_types.call_count, 1)
+
+    @patch('cc3.cyclos.transfer_types.TransferTypeRegistry.'
+           'refresh_in_background')
+    def test_not_loaded(self, mock):
+        """
+        Tests that a lookup on an empty registry starts a background refresh
+        instead of calling Cyclos.
+        """
+        self.assertIsNone(self.registry.get_by_id(31))
+        self.assertTrue(mock.called)
+        self.assertFalse(self.accounts.search_transfer_types.called)
+
+    @patch('cc3.cyclos.transfer_types.TransferTypeRegistry.'
+           'refresh_in_background')
+    def test_not_loaded_wait(self, mock):
+        """
+        Tests that a lookup which waits loads an empty registry from Cyclos,
+        once.
+        """
+        self.assertEqual(
+            self.registry.get_by_name(u'Trade', wait=True).id, 31)
+        self.assertIsNone(self.registry.get_by_name(u'Unknown', wait=True))
+        self.assertEqual(self.accounts.search_transfer_types.call_count, 1)
+        self.assertFalse(mock.called)
+
+    def _get_backend(self):
+        backend = CyclosBackend.__new__(CyclosBackend)
+        backend.transfer_types = self.registry
+        backend.payments = MagicMock()
+        backend.payments.doPayment.return_value.status = 'PROCESSED'
+        return backend
+
+    def test_payment_registry_not_loaded(self):
+        """
+        Tests that a payment is not sent without a transfer type when the
+        transfer types can't be loaded.
+        """
+        self.accounts.search_transfer_types.side_effect = Exception(
+            'Cyclos is down')
+        backend = self._get_backend()
+
+        self.assertRaises(
+            TransactionException, backend.user_payment, 'sender', 'receiver',
+            Decimal('10'), 'Test payment')
+        self.assertFalse(backend.payments.doPayment.called)
+
+    def test_payment_without_member_transaction(self):
+        """
+        Tests that a payment uses the default Cyclos transfer type when the
+        loaded transfer types have no member transaction type.
+        """
+        backend = self._get_backend()
+
+        backend.user_payment('sender', 'receiver', Decimal('10'),
+                             'Test payment')
+
+        self.assertIsNone(
+            backend.payments.doPayment.call_args[1]['transferTypeId'])
+
+
+class PageableTransactionsTestCase(TestCase):
+    """
+    Test case for the lazy ``PageableTransactions`` sequence.
+    """
+    def setUp(self):
+        self.accounts = MagicMock()
+        self.accounts.searchHistory.side_effect = self._search_history
+        self.transactions = PageableTransactions(
+            username='member', accounts=self.accounts)
+        self.transactions.page_size = 10
+
+    def _search_history(self, pageSize=None, currentPage=None, **kwargs):
+        start = pageSize * currentPage
+        return AccountHistory(
+            accountStatus=None, currentPage=currentPage, totalCount=25,
+            transfers=range(start, min(start + pageSize, 25)))
+
+    @patch('cc3.cyclos.transactions._cyclos_transfer_to_transaction',
+           lambda transfer, user: transfer)
+    def test_iterate_in_pages(self):
+        """
+        Tests that iterating fetches one page per ``page_size`` transactions.
+        """
+        self.assertEqual([t for t in self.transactions], range(25))
+        self.assertEqual(self.accounts.searchHistory.call_count, 3)
+
+    @patch('cc3.cyclos.transactions._cyclos_transfer_to_transaction',
+           lambda transfer, user: transfer)
+    def test_count_reused(self):
+        """
+        Tests that the total count of a fetched page is reused.
+        """
+        self.assertEqual(self.transactions[10:20], range(10, 20))
+        self.assertEqual(self.transactions.count(), 25)
+        self.assertEqual(self.accounts.searchHistory.call_count, 1)
+
+    @patch('cc3.cyclos.transactions._cyclos_transfer_to_transaction',
+           lambda transfer, user: transfer)
+    def test_fetched_transactions_cached(self):
+        """
+        Tests that transactions are only fetched once.
+        """
+        self.transactions[0:10]
+        self.assertEqual(self.transactions[3], 3)
+        self.assertEqual(self.transactions[2:5], [2, 3, 4])
+        self.assertEqual(self.accounts.searchHistory.call_count, 1)
+
+    @patch('cc3.cyclos.transactions._cyclos_transfer_to_transaction',
+           lambda transfer, user: transfer)
+    def test_index_out_of_range(self):
+        """
+        Tests that an index past the last transaction raises ``IndexError``.
+        """
+        self.assertEqual(self.transactions[-1], 24)
+        self.assertRaises(IndexError, lambda: self.transactions[25])
+
+
+class DatabaseTransactionsTestCase(TestCase):
+    """
+    Test case for ``DatabaseTransactions`` read from the Cyclos database.
+    """
+    def setUp(self):
+        self.accounts = MagicMock()
+        self.transactions = DatabaseTransactions(
+            username='member', accounts=self.accounts)
+        self.transactions.page_size = 10
+        self.transactions._build_where = lambda: ([], [])
+        self.transactions._get_users = lambda rows: {}
+        self.rows = [{
+            'transfer_id': i,
+            'sender': 'member' if i % 2 else 'other',
+            'recipient': 'other' if i % 2 else 'member',
+            'date': datetime(2016, 1, 1) - timedelta(minutes=i),
+            'process_date': None,
+            'amount': Decimal(i),
+            'transfer_type_id': 31,
+            'description': u'Transfer {0}'.format(i),
+        } for i in range(1, 26)]
+
+    def _query(self, sql, where_clauses, args):
+        rows = self.rows
+        if where_clauses:
+            # Keyset: after the transfer id (the rows are in date order)
+            rows = [row for row in rows if row['transfer_id'] > args[-3]]
+        limit, offset = args[-2:]
+        return rows[offset:offset + limit]
+
+    def test_iterate_with_keyset(self):
+        """
+        Tests that iterating continues each page after the last transfer of
+        the previous page.
+        """
+        with patch.object(self.transactions, '_query',
+                          side_effect=self._query) as mock:
+            transactions = [t for t in self.transactions]
+
+        self.assertEqual(len(transactions), 25)
+        self.assertEqual(mock.call_count, 3)
+        self.assertEqual(len(mock.call_args_list[0][0][1]), 0)
+        self.assertEqual(len(mock.call_args_list[1][0][1]), 1)
+        self.assertFalse(self.accounts.searchHistory.called)
+
+    def test_amount_signed_for_user(self):
+        """
+        Tests that transfers sent by the user have a negative amount.
+        """
+        with patch.object(self.transactions, '_query',
+                          side_effect=self._query):
+            self.assertEqual(self.transactions[0].amount, Decimal(-1))
+            self.assertEqual(self.transactions[1].amount, Decimal(2))
+
+    def test_webservice_fallback(self):
+        """
+        Tests that the webservice is used when the database is unavailable.
+        """
+        self.accounts.searchHistory.return_value = AccountHistory(
+            accountStatus=None, currentPage=0, totalCount=0, transfers=[])
+
+        with patch.object(self.transactions, '_query',
+                          side_effect=DatabaseError('Unavailable')):
+            self.assertEqual(self.transactions[0:10], [])
+
+        self.assertTrue(self.transactions.use_webservice)
+        self.assertTrue(self.accounts.searchHistory.called)
+
+
+class CallMemoTestCase(TestCase):
+    """
+    Test case for sharing the responses of Cyclos calls within a request.
+    """
+    def setUp(self):
+        cache.clear()
+        self.backend = DummyCyclosBackend()
+        backends.set_backend(self.backend)
+        self.factory = RequestFactory()
+        self.middleware = CyclosCallMemoMiddleware()
+
+    def tearDown(self):
+        backends.stop_call_memo()
+
+    def test_duplicate_calls_shared(self):
+        """
+        Tests that duplicate calls within a request share one response, and
+        that the calls are counted.
+        """
+        request = self.factory.get('/')
+        self.middleware.process_request(request)
+        with patch.object(self.backend, 'get_group',
+                          wraps=self.backend.get_group) as mock:
+            self.assertEqual(backends.get_group('member@example.com'),
+                             backends.get_group('member@example.com'))
+            backends.get_group('other@example.com')
+        self.assertEqual(backends.search(username='member'),
+                         backends.search(username='member'))
+
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(request.cyclos_calls.calls, 3)
+        self.assertEqual(request.cyclos_calls.memoized, 2)
+
+        self.middleware.process_response(request, HttpResponse())
+        self.assertIsNone(backends.get_call_memo())
+
+    @patch('cc3.cyclos.backends.ACCOUNT_STATUS_CACHE_TIMEOUT', 0)
+    def test_forgotten_after_payment(self):
+        """
+        Tests that a payment within the request forgets the shared responses.
+        """
+        backends.start_call_memo()
+        with patch.object(self.backend, 'get_account_status',
+                          wraps=self.backend.get_account_status) as mock:
+            backends.get_account_status('sender')
+            backends.get_account_status('sender')
+            backends.user_payment('sender', 'receiver', 10, 'Test')
+            backends.get_account_status('sender')
+
+        self.assertEqual(mock.call_count, 2)
+
+    def test_not_shared_outside_request(self):
+        """
+        Tests that calls outside a request are not shared.
+        """
+        with patch.object(self.backend, 'get_group',
+                          wraps=self.backend.get_group) as mock:
+            backends.get_group('member@example.com')
+            backends.get_group('member@example.com')
+
+        self.assertEqual(mock.call_count, 2)
@@ -1,5 +1,6 @@
 from decimal import Decimal
 
+from django.template import Context, Template
 from django.test import TestCase
 from django.test.client import RequestFactory
 
@@ -23,6 +24,11 @@ class BalanceTestCase(TestCase):
         self.request = self.factory.get('/')
         self.request.user = self.profile.user
 
+    def _resolve(self, data):
+        # as a template resolving the variables would
+        return dict((key, value() if callable(value) else value)
+                    for key, value in data.items())
+
     @patch('cc3.cyclos.backends.get_account_status')
     def test_member_not_found(self, mock):
         """
@@ -33,12 +39,13 @@ class BalanceTestCase(TestCase):
         effect = MemberNotFoundException
         mock.side_effect = effect
 
-        data = balance(self.request)
+        data = self._resolve(balance(self.request))
         self.assertDictEqual(data, {
             'balance': None,
             'has_account': False,
             'upper_credit_limit': None,
-            'lower_credit_limit': None
+            'lower_credit_limit': None,
+            'balance_async': False,
         })
 
     @patch('cc3.cyclos.backends.get_account_status')
@@ -63,10 +70,41 @@ class BalanceTestCase(TestCase):
         )
         mock.return_value = account_status
 
-        data = balance(self.request)
+        data = self._resolve(balance(self.request))
         self.assertDictEqual(data, {
             'balance': Decimal('150.45'),
             'has_account': True,
             'upper_credit_limit': None,
-            'lower_credit_limit': 1000000
+            'lower_credit_limit': 1000000,
+            'balance_async': False,
         })
+        self.assertEqual(mock.call_count, 1)
+
+    @patch('cc3.cyclos.backends.get_account_status')
+    def test_balance_lazy(self, mock):
+        """
+        Tests that Cyclos is only asked for the balance when a template reads
+        it.
+        """
+        mock.side_effect = MemberNotFoundException
+
+        template = Template('{% if balance_async %}async{% endif %}')
+        self.assertEqual(
+            template.render(Context(balance(self.request))), u'')
+        self.assertFalse(mock.called)
+
+        template = Template('{{ balance }}/{{ lower_credit_limit }}')
+        self.assertEqual(
+            template.render(Context(balance(self.request))), u'None/None')
+        self.assertEqual(mock.call_count, 1)
+
+    @patch('cc3.cyclos.context_processors.BALANCE_ASYNC', True)
+    @patch('cc3.cyclos.backends.get_account_status')
+    def test_balance_async(self, mock):
+        """
+        Tests that Cyclos is not asked for the balance in async mode.
+        """
+        data = balance(self.request)
+        self.assertTrue(data['balance_async'])
+        self.assertIsNone(data['balance'])
+        self.assertFalse(mock.called)
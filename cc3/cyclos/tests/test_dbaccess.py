@@ -0,0 +1,90 @@
+import time
+
+from django.test import TestCase
+
+from mock import MagicMock, patch
+
+from cc3.cyclos import dbaccess
+from cc3.cyclos.dbaccess import (
+    ConnectionPool, DatabaseError, PoolExhaustedError)
+
+
+class ConnectionPoolTestCase(TestCase):
+    """
+    Test case for the ``ConnectionPool`` of Cyclos database connections.
+    """
+    def setUp(self):
+        self.pool = ConnectionPool({}, max_connections=2, checkout_timeout=0)
+        self.connections = []
+
+        def connect():
+            connection = MagicMock()
+            self.connections.append(connection)
+            return connection
+
+        self.pool.connect = connect
+
+    def test_connection_reused(self):
+        """
+        Tests that a returned connection is handed out again, after a health
+        check.
+        """
+        connection = self.pool.checkout()
+        self.pool.checkin(connection)
+
+        self.assertIs(self.pool.checkout(), connection)
+        self.assertEqual(len(self.connections), 1)
+        self.assertTrue(connection.rollback.called)
+        self.assertTrue(connection.ping.called)
+
+    def test_exhausted(self):
+        """
+        Tests that no more than ``max_connections`` are handed out.
+        """
+        self.pool.checkout()
+        self.pool.checkout()
+
+        self.assertRaises(PoolExhaustedError, self.pool.checkout)
+        stats = self.pool.stats()
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['exhausted'], 1)
+
+    def test_broken_connection_replaced(self):
+        """
+        Tests that a connection failing the health check is replaced.
+        """
+        connection = self.pool.checkout()
+        self.pool.checkin(connection)
+        connection.ping.side_effect = DatabaseError('Gone away')
+
+        self.assertIsNot(self.pool.checkout(), connection)
+        self.assertTrue(connection.close.called)
+        self.assertEqual(self.pool.stats()['size'], 1)
+
+    def test_idle_connection_closed(self):
+        """
+        Tests that a connection idle for too long is replaced.
+        """
+        connection = self.pool.checkout()
+        self.pool.checkin(connection)
+        self.pool.max_idle_time = 10
+
+        with patch('cc3.cyclos.dbaccess.time.time',
+                   return_value=time.time() + 20):
+            self.assertIsNot(self.pool.checkout(), connection)
+        self.assertTrue(connection.close.called)
+
+    def test_context_manager(self):
+        """
+        Tests that ``cyclos_connection`` returns the connection to the pool,
+        and discards it after a database error.
+        """
+        with patch.object(dbaccess, 'pool', self.pool):
+            with dbaccess.cyclos_connection():
+                self.assertEqual(self.pool.stats()['in_use'], 1)
+            self.assertEqual(self.pool.stats()['idle'], 1)
+
+            with self.assertRaises(DatabaseError):
+                with dbaccess.cyclos_connection():
+                    raise DatabaseError('Deadlock')
+            self.assertEqual(self.pool.stats()['size'], 0)
@@ -3,6 +3,7 @@ from unittest import skipIf
 
 from django.conf import settings
 from django.core import mail
+from django.core.cache import cache
 from django.db import IntegrityError
 from django.db.models.signals import post_save
 from django.test import TestCase
@@ -11,6 +12,7 @@ from django.test.utils import override_settings
 from mock import patch
 
 from cc3.core.utils.test_backend import DummyCyclosBackend
+from cc3.cyclos import backends
 from cc3.cyclos.backends import set_backend
 from cc3.mail.models import (
     MAIL_TYPE_LARGE_BALANCE_USER, MAIL_TYPE_LARGE_BALANCE_ADMINS,
@@ -20,6 +22,7 @@ from cc3.mail.models import (
 
 from ..models import CC3Profile, CyclosAccount
 from ..models.account import link_account, notify_community_admins, UserStatusChangeHistory
+from ..utils import reconcile_cyclos_groups
 from .test_factories import (
     CC3CommunityFactory, CC3ProfileFactory, CyclosAccountFactory,
     CyclosGroupFactory, CyclosGroupSetFactory, UserFactory,
@@ -200,6 +203,7 @@ class CyclosAccountTestCase(TestCase):
 
 class CC3ProfileTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.backend = DummyCyclosBackend()
         set_backend(self.backend)
 
@@ -751,6 +755,119 @@ class CC3ProfileTestCase(TestCase):
             username=test_profile.user.username, password='testing')
         self.assertEqual(test_profile.first_login, False)
 
+
+class CyclosGroupMembershipTestCase(TestCase):
+    """
+    Test case for the locally stored Cyclos group membership.
+    """
+    def setUp(self):
+        cache.clear()
+        self.backend = DummyCyclosBackend()
+        set_backend(self.backend)
+
+        self.initial_group = CyclosGroupFactory.create(initial=True)
+        self.full_group = CyclosGroupFactory.create(full=True)
+        cyclos_groupset = CyclosGroupSetFactory.create(
+            groups=[self.initial_group, self.full_group])
+        community = CC3CommunityFactory.create(groupsets=[cyclos_groupset])
+        self.profile = CC3ProfileFactory.create(community=community)
+
+    def _get_profile(self):
+        return CC3Profile.objects.get(pk=self.profile.pk)
+
+    @patch('cc3.cyclos.backends.get_group')
+    def test_stored_group(self, mock):
+        """
+        Tests that the stored group is used without asking Cyclos.
+        """
+        CyclosAccountFactory.create(
+            cc3_profile=self.profile, cyclos_group=self.full_group.id)
+
+        profile = self._get_profile()
+        self.assertEqual(profile.get_cyclos_group_id(), self.full_group.id)
+        self.assertEqual(profile.get_cyclos_group(), self.full_group)
+        self.assertTrue(profile.has_full_account())
+        self.assertFalse(mock.called)
+
+    @patch('cc3.cyclos.backends.get_group')
+    def test_group_stored_when_unknown(self, mock):
+        """
+        Tests that Cyclos is asked once for a group which is not stored yet.
+        """
+        mock.return_value = self.initial_group.id
+        account = CyclosAccountFactory.create(cc3_profile=self.profile)
+
+        self.assertFalse(self._get_profile().has_full_account())
+        self.assertFalse(self._get_profile().has_full_account())
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(CyclosAccount.objects.get(
+            pk=account.pk).cyclos_group, self.initial_group.id)
+
+    @patch('cc3.cyclos.backends.get_group')
+    def test_group_cached_without_account(self, mock):
+        """
+        Tests that the group of a profile without Cyclos account is cached.
+        """
+        mock.return_value = self.full_group.id
+
+        self.assertEqual(self._get_profile().get_cyclos_group_id(),
+                         self.full_group.id)
+        self.assertEqual(self._get_profile().get_cyclos_group_id(),
+                         self.full_group.id)
+        self.assertEqual(mock.call_count, 1)
+
+    def test_update_group_stores_group(self):
+        """
+        Tests that changing the group in Cyclos stores the new group.
+        """
+        account = CyclosAccountFactory.create(
+            cc3_profile=self.profile, cyclos_group=self.initial_group.id)
+
+        backends.update_group(account.cyclos_id, self.full_group.id, 'Test')
+
+        self.assertEqual(self._get_profile().get_cyclos_group_id(),
+                         self.full_group.id)
+
+    @patch('cc3.cyclos.backends.search')
+    def test_existing_account_without_group(self, mock):
+        """
+        Tests that an account already in Cyclos, without a group id, is
+        assigned without storing a group.
+        """
+        mock.return_value = [(42, '', '', self.profile.user.username, '')]
+
+        account = CyclosAccount(cc3_profile=self.profile)
+        account.save()
+
+        account = CyclosAccount.objects.get(pk=account.pk)
+        self.assertEqual(account.cyclos_id, 42)
+        self.assertIsNone(account.cyclos_group)
+
+    @patch('cc3.cyclos.backends.search')
+    def test_reconcile_cyclos_groups(self, mock):
+        """
+        Tests that the groups of all Cyclos members are stored, a page of
+        members at a time, also when Cyclos returns smaller pages than asked
+        for.
+        """
+        accounts = [CyclosAccountFactory.create(
+            cyclos_group=self.initial_group.id) for i in range(3)]
+        pages = [
+            [(accounts[0].cyclos_id, '', '', '', str(self.full_group.id))],
+            [(accounts[1].cyclos_id, '', '', '', str(self.initial_group.id))],
+            [(accounts[2].cyclos_id, '', '', '', str(self.full_group.id))],
+        ]
+        mock.side_effect = lambda currentPage, pageSize: (
+            pages[currentPage] if currentPage < len(pages) else [])
+
+        self.assertEqual(reconcile_cyclos_groups(page_size=2), 2)
+        self.assertEqual(mock.call_count, 4)
+        self.assertEqual(
+            [CyclosAccount.objects.get(pk=account.pk).cyclos_group
+             for account in accounts],
+            [self.full_group.id, self.initial_group.id, self.full_group.id])
+
+
 '''
 class UserStatusChangeHistoryTestCase(TestCase):
     def setUp(self):
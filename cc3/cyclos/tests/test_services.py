@@ -0,0 +1,170 @@
+import errno
+import httplib
+import socket
+import threading
+
+from django.test import TestCase
+
+from mock import MagicMock, patch
+
+from cc3.cyclos.services import Accounts, Members, SoapClientPool
+from cc3.cyclos.transport import KeepAliveTransport
+
+
+class SoapClientPoolTestCase(TestCase):
+    """
+    Test case for the ``SoapClientPool`` of Cyclos SOAP clients.
+    """
+    def setUp(self):
+        self.pool = SoapClientPool()
+        self.accounts = Accounts('http://cyclos', pool=self.pool)
+        self.members = Members('http://cyclos', pool=self.pool)
+
+    @patch('cc3.cyclos.services.BaseService.build_client')
+    def test_client_reused(self, mock):
+        """
+        Tests that a second call for the same service reuses the client.
+        """
+        mock.side_effect = lambda: object()
+
+        client = self.accounts.get_client()
+        self.assertIs(self.accounts.get_client(), client)
+        self.assertEqual(mock.call_count, 1)
+        self.assertDictEqual(
+            self.pool.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    @patch('cc3.cyclos.services.BaseService.build_client')
+    def test_client_per_service(self, mock):
+        """
+        Tests that different services get different clients.
+        """
+        mock.side_effect = lambda: object()
+
+        self.assertIsNot(
+            self.accounts.get_client(), self.members.get_client())
+        self.assertEqual(self.pool.stats()['size'], 2)
+
+    @patch('cc3.cyclos.services.BaseService.build_client')
+    def test_client_per_thread(self, mock):
+        """
+        Tests that clients are not shared between threads.
+        """
+        mock.side_effect = lambda: object()
+        clients = []
+
+        client = self.accounts.get_client()
+        thread = threading.Thread(
+            target=lambda: clients.append(self.accounts.get_client()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(clients[0], client)
+        self.assertEqual(self.pool.stats()['misses'], 2)
+
+    @patch('cc3.cyclos.services.BaseService.build_client')
+    def test_clear(self, mock):
+        """
+        Tests that clearing the pool makes threads build new clients.
+        """
+        mock.side_effect = lambda: object()
+
+        client = self.accounts.get_client()
+        self.pool.clear()
+        self.assertIsNot(self.accounts.get_client(), client)
+        self.assertEqual(self.pool.stats()['size'], 1)
+
+    @patch('cc3.cyclos.services.BaseService.build_client')
+    def test_pooling_disabled(self, mock):
+        """
+        Tests that a service without pool builds a new client every call.
+        """
+        mock.side_effect = lambda: object()
+        accounts = Accounts('http://cyclos', pool=None)
+
+        self.assertIsNot(accounts.get_client(), accounts.get_client())
+        self.assertEqual(mock.call_count, 2)
+
+
+class KeepAliveTransportTestCase(TestCase):
+    """
+    Test case for the ``KeepAliveTransport`` HTTP connection pool.
+    """
+    url = 'http://cyclos:8080/cyclos/services/account'
+
+    def setUp(self):
+        self.transport = KeepAliveTransport()
+        self.connections = []
+
+        def new_connection(host, port, timeout=None):
+            connection = MagicMock()
+            connection.getresponse.return_value.status = 200
+            connection.getresponse.return_value.will_close = False
+            connection.getresponse.return_value.getheaders.return_value = []
+            connection.getresponse.return_value.read.return_value = '<xml/>'
+            self.connections.append(connection)
+            return connection
+
+        self.transport.connection_classes = {'http': new_connection}
+
+    def test_connection_reused(self):
+        """
+        Tests that consecutive requests share one connection.
+        """
+        for i in range(3):
+            response, content = self.transport.request(
+                self.url, 'POST', body='<xml/>')
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, '<xml/>')
+        self.assertEqual(len(self.connections), 1)
+        self.connections[0].request.assert_called_with(
+            'POST', '/cyclos/services/account', '<xml/>', {})
+
+    def test_stale_connection_retried(self):
+        """
+        Tests that a request which can not be sent on a connection closed by
+        the server is retried on a new connection.
+        """
+        self.transport.request(self.url, 'POST', body='<xml/>')
+        self.connections[0].request.side_effect = socket.error(
+            errno.EPIPE, 'Broken pipe')
+
+        response, content = self.transport.request(
+            self.url, 'POST', body='<xml/>')
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(self.connections), 2)
+        self.assertTrue(self.connections[0].close.called)
+
+    def test_sent_request_not_retried(self):
+        """
+        Tests that a request is not sent again when the response fails after
+        it was sent on a reused connection, since the server may have acted
+        on it.
+        """
+        self.transport.request(self.url, 'POST', body='<xml/>')
+        self.connections[0].getresponse.side_effect = httplib.BadStatusLine(
+            '')
+
+        self.assertRaises(httplib.BadStatusLine, self.transport.request,
+                          self.url, 'POST', body='<xml/>')
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].request.call_count, 2)
+        self.assertTrue(self.connections[0].close.called)
+
+    def test_new_connection_not_retried(self):
+        """
+        Tests that a failure on a new connection is not retried.
+        """
+        self.transport.request(self.url, 'POST', body='<xml/>')
+        self.transport.close()
+
+        def fail(*args, **kwargs):
+            raise httplib.BadStatusLine('')
+
+        self.transport.connection_classes = {
+            'http': lambda *args, **kwargs: MagicMock(
+                getresponse=MagicMock(side_effect=fail))}
+
+        self.assertRaises(httplib.BadStatusLine, self.transport.request,
+                          self.url, 'POST', body='<xml/>')
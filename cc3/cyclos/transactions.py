@@ -1,5 +1,7 @@
+import datetime
 import logging
 import random
+from decimal import Decimal
 from uuid import uuid4
 
 from django.contrib.auth.models import User
@@ -8,10 +10,18 @@ from django.core.exceptions import ObjectDoesNotExist
 
 from pysimplesoap.client import SoapFault
 
+from . import dbaccess
 from .services import (
     Access, AccountNotFoundException, Accounts, Members,
-    MemberNotFoundException, Payment, Payments)
+    MemberNotFoundException, Payment, Payments, client_pool)
+from .transfer_types import TransferTypeRegistry
+from .transport import KeepAliveTransport
 from .common import AccountException, Transaction, TransactionException
+from .sql.transfer import (
+    TRANSFERS_HISTORY_SELECT, TRANSFERS_HISTORY_TOTALS,
+    TRANSFERS_WHERE_ACCOUNT_TYPE_ID, TRANSFERS_WHERE_AFTER_KEY,
+    TRANSFERS_WHERE_BEFORE_DATETIME, TRANSFERS_WHERE_CURRENCY,
+    TRANSFERS_WHERE_FROM_DATETIME, TRANSFERS_WHERE_SENDER_OR_RECIPIENT)
 
 
 LOG = logging.getLogger(__name__)
@@ -24,6 +34,24 @@ BASIC_AUTH_PASS = getattr(settings, 'CYCLOS_BASIC_AUTH_PASS', None)
 
 WEBSERVICE_TRACE = getattr(settings, 'CYCLOS_WEBSERVICE_TRACE', False)
 WEBSERVICE_USE_CACHE = getattr(settings, 'CYCLOS_WEBSERVICE_WSDL_CACHE', False)
+WEBSERVICE_CLIENT_POOL = getattr(
+    settings, 'CYCLOS_WEBSERVICE_CLIENT_POOL', True)
+
+# Persistent HTTP connections to Cyclos (see ``transport.KeepAliveTransport``)
+HTTP_KEEPALIVE = getattr(settings, 'CYCLOS_HTTP_KEEPALIVE', True)
+HTTP_MAX_CONNECTIONS_PER_HOST = getattr(
+    settings, 'CYCLOS_HTTP_MAX_CONNECTIONS_PER_HOST', 10)
+HTTP_CONNECT_TIMEOUT = getattr(settings, 'CYCLOS_HTTP_CONNECT_TIMEOUT', 10)
+HTTP_READ_TIMEOUT = getattr(settings, 'CYCLOS_HTTP_READ_TIMEOUT', 60)
+HTTP_RETRIES = getattr(settings, 'CYCLOS_HTTP_RETRIES', 1)
+
+# Number of transactions fetched per call when iterating over transactions
+TRANSACTIONS_PAGE_SIZE = getattr(settings, 'CYCLOS_TRANSACTIONS_PAGE_SIZE', 100)
+
+# Where the transaction history is read from: 'webservice' (searchHistory)
+# or 'database' (directly from the Cyclos database, see dbaccess)
+TRANSACTIONS_SOURCE = getattr(
+    settings, 'CYCLOS_TRANSACTIONS_SOURCE', 'webservice')
 
 CYCLOS_REQUIRED_MEMBER_CREDENTIAL_FIELD = getattr(
     settings, 'CYCLOS_REQUIRED_MEMBER_CREDENTIAL_FIELD', 'login_password')
@@ -51,20 +79,34 @@ class CyclosBackend(object):
             service_settings['trace'] = True
         if WEBSERVICE_USE_CACHE:
             service_settings['cache'] = True
+        # Reuse parsed SOAP clients between calls (one per thread)
+        self.client_pool = client_pool if WEBSERVICE_CLIENT_POOL else None
+        service_settings['pool'] = self.client_pool
+        # Share one pool of keep-alive connections between all services
+        self.transport = None
+        if HTTP_KEEPALIVE:
+            self.transport = KeepAliveTransport(
+                max_connections_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                connect_timeout=HTTP_CONNECT_TIMEOUT,
+                read_timeout=HTTP_READ_TIMEOUT,
+                retries=HTTP_RETRIES)
+        service_settings['transport'] = self.transport
         self.members = Members(**service_settings)
         self.payments = Payments(**service_settings)
         self.accounts = Accounts(**service_settings)
         self.access = Access(**service_settings)
 
-        self.member_transaction = None
         self.member_to_charity_transaction = None
 
+        # Transfer types by id and name, kept in the cache and refreshed in
+        # the background (no Cyclos call on initialisation)
+        self.transfer_types = TransferTypeRegistry(self.accounts)
+
         # ID of group for new members
         # also used in accounts/views to check if user has a trial account
         # TODO remove this, in favour of CyclosGroups and Groupsets
         self.member_group_id = None
 
-        self._init_transaction_types()
 #        self._init_member_groups()
 
 #    def _init_member_groups(self):
@@ -76,16 +118,29 @@ class CyclosBackend(object):
 #                return
 #        raise ValueError(u'Cyclos group for members {0} not found'.format(MEMBER_GROUP))
 
-    def _init_transaction_types(self):
-        # only reason for this method is to set the self.member_transaction
-        # for the backend, so once set, no need to call cyclos
-        if self.member_transaction:
-            pass
+    @property
+    def member_transaction(self):
+        # payments need it, so wait for the registry if it isn't loaded
+        return self.transfer_types.get_by_name(
+            MEMBER_TRANSACTION_NAME, wait=True)
 
-        available_transfer_types = self.accounts.search_transfer_types()
-        for transfer_type in available_transfer_types:
-            if transfer_type.name == MEMBER_TRANSACTION_NAME:
-                self.member_transaction = transfer_type
+    def get_transfer_type(self, transfer_type_id=None, name=None):
+        """
+        Return the ``TransferType`` with the given id or name, or ``None`` if
+        it is unknown (or not loaded yet).
+        """
+        if transfer_type_id is not None:
+            return self.transfer_types.get_by_id(transfer_type_id)
+        return self.transfer_types.get_by_name(name)
+
+    def client_pool_stats(self):
+        """
+        Return size and hit/miss counters of the SOAP client pool, or ``None``
+        if pooling is disabled.
+        """
+        if self.client_pool is None:
+            return None
+        return self.client_pool.stats()
 
     def new(self, username, name, email, business_name, initial_group_id,
             community_code=None, extra_fields=None):
@@ -185,7 +240,7 @@ class CyclosBackend(object):
 
     def get_group(self, email):
         values = self.search(email=email)
-        if values:
+        if values and values[0][4]:
             return int(values[0][4])
 
     def user_payment(self, sender, receiver, amount, description,
@@ -195,8 +250,22 @@ class CyclosBackend(object):
 
     def _do_payment(self, sender, receiver, amount, description,
                     transfer_type_id=None, custom_fields=None):
-        if self.member_transaction is not None and transfer_type_id is None:
-            transfer_type_id = self.member_transaction.id
+        if transfer_type_id is None:
+            try:
+                member_transaction = self.member_transaction
+            except Exception as e:
+                LOG.error(u'Unable to load the Cyclos transfer types: '
+                          u'{0}'.format(e))
+                member_transaction = None
+            if member_transaction is not None:
+                transfer_type_id = member_transaction.id
+            elif not self.transfer_types.loaded:
+                # don't let Cyclos pick the transfer type because the
+                # configured one couldn't be looked up
+                raise TransactionException(
+                    u"Unable to load the Cyclos transfer types")
+            # otherwise Cyclos has no transfer type by that name, and uses its
+            # default transfer type
 
         fields = []
         # custom_fields is a dict, with key,value for each custom field
@@ -313,7 +382,13 @@ class CyclosBackend(object):
             # alternativ which works in TQ1.1 - very odd
             # custom_fields.append({u'internalName': u'community', u'value': community})
 
-        return PageableTransactions(
+        kwargs = {}
+        transactions_class = PageableTransactions
+        if TRANSACTIONS_SOURCE == 'database':
+            transactions_class = DatabaseTransactions
+            kwargs['community'] = community
+
+        return transactions_class(
             username=username,
             accounts=self.accounts,
             description=description,
@@ -323,7 +398,8 @@ class CyclosBackend(object):
             direction=direction,
             currency=currency,
             account_type_id=account_type_id,
-            custom_fields=custom_fields
+            custom_fields=custom_fields,
+            **kwargs
         )
 
     def user_fund_donation(self, sender, amount, description):
@@ -585,6 +661,19 @@ def _get_account(user):
 
 
 class PageableTransactions(object):
+    """
+    Lazy sequence of the transactions of a user (or of a group of users) in
+    Cyclos.
+
+    Transactions are fetched from the Cyclos ``searchHistory`` webservice a
+    page at a time and kept, so each transaction is requested once. Slices
+    (as taken by the Django paginator) fetch just the slice, iteration and
+    integer indexing fetch pages of ``page_size`` transactions. The total
+    count is taken from any response, so it only costs a separate call if
+    nothing was fetched yet.
+    """
+    page_size = TRANSACTIONS_PAGE_SIZE
+
     def __init__(self, username=None, accounts=None, description=None,
                  from_to=None, from_date=None, to_date=None, direction='desc',
                  currency=None, account_type_id=None, custom_fields=None):
@@ -600,124 +689,317 @@ class PageableTransactions(object):
         self.currency = currency
         self.account_type_id = account_type_id
         self.custom_fields = custom_fields
+        # fetched transactions, by index
+        self._transactions = {}
 
     def __len__(self):
         return self.count()
 
+    def __iter__(self):
+        index = 0
+        while self.total_count is None or index < self.total_count:
+            if index not in self._transactions:
+                try:
+                    self._fetch(index // self.page_size, self.page_size)
+                except (AccountNotFoundException, MemberNotFoundException):
+                    return
+                if index not in self._transactions:
+                    # Nothing more in Cyclos (end of the list)
+                    return
+            yield self._transactions[index]
+            index += 1
+
     def __getitem__(self, k):
         # handle django template engine
         if k == u'count':
             return self.count()
 
         if isinstance(k, slice):
-            start = k.start if k.start else 0
-            stop = k.stop
-            # convert to webservice 'paging' params
-            page_size = stop - start
-            if page_size > 0:
-                current_page = start / page_size
-            else:
-                current_page = 0
             try:
-                if self.username:
-                    history = self.webservice.searchHistory(
-                        principal=self.username,
-                        pageSize=page_size,
-                        currentPage=current_page,
-                        beginDate=self.from_date,
-                        endDate=self.to_date,
-                        # Regular order is ascending (earliest first)
-                        reverseOrder=(self.direction == 'desc'),
-                        fields=self.custom_fields
-                    )
-                else:
-                    history = self.webservice.searchMultipleHistories(
-                        accountTypeId=self.account_type_id,
-                        currency=self.currency,
-                        pageSize=page_size,
-                        currentPage=current_page,
-                        beginDate=self.from_date,
-                        endDate=self.to_date,
-                        # Regular order is ascending (earliest first)
-                        reverseOrder=(self.direction == 'desc'),
-                        fields=self.custom_fields
-                    )
-                return [
-                    _cyclos_transfer_to_transaction(transfer, self.username)
-                    for transfer in history.transfers
-                ]
+                return self._get_slice(k)
+            except (AccountNotFoundException, MemberNotFoundException):
+                return None
 
+        if k < 0:
+            k += self.count()
+        if k not in self._transactions:
+            try:
+                self._fetch(k // self.page_size, self.page_size)
             except (AccountNotFoundException, MemberNotFoundException):
                 return None
-        else:
-            if self.username:
-                try:
-                    history = self.webservice.searchHistory(
-                        principal=self.username,
-                        pageSize=1,
-                        currentPage=k,
-                        beginDate=self.from_date,
-                        endDate=self.to_date,
-                        reverseOrder=(self.direction == 'desc'),
-                        fields=self.custom_fields
-                    )
-                    single_transfer = history.transfers[0]
-                    return _cyclos_transfer_to_transaction(
-                        single_transfer, self.username)
-                except (AccountNotFoundException, MemberNotFoundException):
-                    return None
+        try:
+            return self._transactions[k]
+        except KeyError:
+            raise IndexError('Transaction index out of range')
+
+    def _get_slice(self, k):
+        start, stop, step = k.start or 0, k.stop, k.step
+        if start < 0 or stop is None or stop < 0:
+            start, stop, step = k.indices(self.count())
+        if stop <= start:
+            return []
+
+        missing = [index for index in xrange(start, stop)
+                   if index not in self._transactions]
+        if missing:
+            size = stop - start
+            if start % size == 0:
+                # Paginator style slice: one webservice page
+                self._fetch(start // size, size)
             else:
-                # Not entirely sure this would ever be called.
-                # Possibly at system start (ie when very few transactions?)
-                history = self.webservice.searchMultipleHistories(
-                    accountTypeId=self.account_type_id,
-                    currency=self.currency,
-                    pageSize=1,
-                    currentPage=k,
-                    beginDate=self.from_date,
-                    endDate=self.to_date,
-                    reverseOrder=(self.direction == 'desc'),
-                    fields=self.custom_fields
-                )
-                single_transfer = history.transfers[0]
-
-                return _cyclos_transfer_to_transaction(
-                    single_transfer, self.username)
+                for page in xrange(missing[0] // self.page_size,
+                                   (missing[-1] // self.page_size) + 1):
+                    self._fetch(page, self.page_size)
+
+        transactions = [self._transactions[index]
+                        for index in xrange(start, stop)
+                        if index in self._transactions]
+        return transactions[::step] if step else transactions
+
+    def _search(self, page_size, current_page):
+        if self.username:
+            return self.webservice.searchHistory(
+                principal=self.username,
+                pageSize=page_size,
+                currentPage=current_page,
+                beginDate=self.from_date,
+                endDate=self.to_date,
+                # Regular order is ascending (earliest first)
+                reverseOrder=(self.direction == 'desc'),
+                fields=self.custom_fields
+            )
+        return self.webservice.searchMultipleHistories(
+            accountTypeId=self.account_type_id,
+            currency=self.currency,
+            pageSize=page_size,
+            currentPage=current_page,
+            beginDate=self.from_date,
+            endDate=self.to_date,
+            # Regular order is ascending (earliest first)
+            reverseOrder=(self.direction == 'desc'),
+            fields=self.custom_fields
+        )
+
+    def _fetch(self, current_page, page_size):
+        """
+        Fetch one webservice page of transactions and store them by index.
+        Returns the number of transactions fetched.
+        """
+        history = self._search(page_size, current_page)
+        if history.totalCount is not None:
+            self.total_count = int(history.totalCount)
+
+        offset = current_page * page_size
+        for i, transfer in enumerate(history.transfers):
+            self._transactions[offset + i] = _cyclos_transfer_to_transaction(
+                transfer, self.username)
+        return len(history.transfers)
 
     def count(self):
-        # NB this is never called - as the __getitem__ definition above is
-        # called instead. (SDW: Not sure this is true - why do __len__ and
-        # the __getitem__ called count()? )
-        # If it is true, then is _resolve_count ever called ?
-        if not self.total_count:
+        if self.total_count is None:
             self.total_count = self._resolve_count()
         return self.total_count
 
     def _resolve_count(self):
-
-        # TODO: check for already resolved transaction list?
+        # Only called if no page has been fetched yet (pages carry the
+        # total count as well)
+        return int(self._search(0, 0).totalCount or 0)
+
+
+class DatabaseTransactions(PageableTransactions):
+    """
+    ``PageableTransactions`` read straight from the Cyclos database instead
+    of the ``searchHistory`` webservice.
+
+    Pages are fetched with keyset pagination (continuing after the date and
+    id of the last fetched transfer) when iterating, and with an offset for
+    random access. Should the database be unavailable, the transactions are
+    fetched from the webservice instead.
+    """
+    def __init__(self, community=None, **kwargs):
+        super(DatabaseTransactions, self).__init__(**kwargs)
+        self.community = community
+        self.use_webservice = False
+        # (date, id) of fetched transfers, by index
+        self._keys = {}
+        self._where = None
+
+    @property
+    def order(self):
+        # Like the webservice: only reversed (latest first) for 'desc'
+        return 'DESC' if self.direction == 'desc' else 'ASC'
+
+    def _get_where(self):
+        """
+        Return (copies of) the where clauses and their args for the search
+        filters, or ``None`` if no transfer can match.
+        """
+        if self._where is None:
+            self._where = self._build_where()
+        if not self._where:
+            return None
+        where_clauses, args = self._where
+        return list(where_clauses), list(args)
+
+    def _build_where(self):
+        from cc3.cyclos.models import CC3Profile
+
+        where_clauses = []
+        args = []
         if self.username:
-            account_history = self.webservice.searchHistory(
-                principal=self.username,
-                principalType='USER',
-                currentPage=0,
-                pageSize=0,
-                beginDate=self.from_date,
-                endDate=self.to_date,
-                reverseOrder=(self.direction == 'asc'),
-                fields=self.custom_fields)
+            involving = [self.username]
+        elif self.community:
+            involving = list(CC3Profile.objects.filter(
+                community__code=self.community).values_list(
+                'user__username', flat=True))
+            if not involving:
+                return ()
         else:
-            account_history = self.webservice.searchMultipleHistories(
-                accountTypeId=self.account_type_id,
-                currency=self.currency,
-                pageSize=0,
-                currentPage=0,
-                beginDate=self.from_date,
-                endDate=self.to_date,
-                reverseOrder=(self.direction == 'asc'),
-                fields=self.custom_fields)
+            involving = None
+
+        if involving is not None:
+            where_clauses.append(TRANSFERS_WHERE_SENDER_OR_RECIPIENT)
+            args.extend([involving, involving])
+        if self.account_type_id is not None:
+            where_clauses.append(TRANSFERS_WHERE_ACCOUNT_TYPE_ID)
+            args.extend([self.account_type_id, self.account_type_id])
+        if self.currency is not None:
+            where_clauses.append(TRANSFERS_WHERE_CURRENCY)
+            args.append(self.currency)
+        if self.from_date is not None:
+            where_clauses.append(TRANSFERS_WHERE_FROM_DATETIME)
+            args.append(_start_of_day(self.from_date))
+        if self.to_date is not None:
+            where_clauses.append(TRANSFERS_WHERE_BEFORE_DATETIME)
+            args.append(
+                _start_of_day(self.to_date) + datetime.timedelta(days=1))
+        return where_clauses, args
+
+    def _query(self, sql, where_clauses, args):
+        where_sql = ''
+        if where_clauses:
+            where_sql = 'WHERE {0}'.format(' AND '.join(where_clauses))
+        sql = sql.format(where_sql=where_sql, direction=self.order)
+
+        with dbaccess.cyclos_connection() as connection:
+            return list(dbaccess.cyclos_query_results(connection, sql, args))
+
+    def _fetch(self, current_page, page_size):
+        if not self.use_webservice:
+            try:
+                return self._fetch_from_database(current_page, page_size)
+            except dbaccess.DatabaseError as e:
+                LOG.error(u'Unable to read transactions from the Cyclos '
+                          u'database, using the webservice: {0}'.format(e))
+                self.use_webservice = True
+        return super(DatabaseTransactions, self)._fetch(
+            current_page, page_size)
+
+    def _fetch_from_database(self, current_page, page_size):
+        where = self._get_where()
+        if where is None:
+            self.total_count = 0
+            return 0
+        where_clauses, args = where
+
+        offset = current_page * page_size
+        previous_key = self._keys.get(offset - 1)
+        if previous_key is not None:
+            # Continue after the previous transfer, instead of making MySQL
+            # skip ``offset`` rows
+            where_clauses.append(TRANSFERS_WHERE_AFTER_KEY[self.order])
+            args.extend([previous_key[0], previous_key[0], previous_key[1]])
+            args.extend([page_size, 0])
+        else:
+            args.extend([page_size, offset])
+
+        rows = self._query(TRANSFERS_HISTORY_SELECT, where_clauses, args)
+        if len(rows) < page_size:
+            self.total_count = offset + len(rows)
+
+        users = self._get_users(rows)
+        for i, row in enumerate(rows):
+            self._keys[offset + i] = (row['date'], row['transfer_id'])
+            self._transactions[offset + i] = self._row_to_transaction(
+                row, users)
+        return len(rows)
+
+    def _get_users(self, rows):
+        """
+        Return the users of the transfer parties, by username, using one
+        query for all rows.
+        """
+        from cc3.cyclos.models import CC3Profile
+
+        usernames = set()
+        for row in rows:
+            usernames.add(row['sender'])
+            usernames.add(row['recipient'])
+        usernames.discard(self.username)
+        if not usernames:
+            return {}
+        profiles = CC3Profile.viewable.filter(
+            user__username__in=usernames).select_related('user')
+        return dict((profile.user.username, profile.user)
+                    for profile in profiles)
+
+    def _row_to_transaction(self, row, users):
+        # Same conventions as the webservice transfers: for the history of
+        # a user the amount is negative if the user paid.
+        sender = users.get(row['sender'], row['sender'])
+        recipient = users.get(row['recipient'], row['recipient'])
+        amount = row['amount']
+        if self.username:
+            if row['sender'] == self.username:
+                sender = self.username
+                amount = -amount
+            else:
+                recipient = self.username
+
+        return Transaction(
+            sender=sender, recipient=recipient, amount=amount,
+            created=row['process_date'] or row['date'],
+            description=row['description'],
+            transfer_id=row['transfer_id'],
+            transfer_type_id=row['transfer_type_id'])
 
-        return account_history.totalCount
+    def _resolve_count(self):
+        if not self.use_webservice:
+            try:
+                return self.totals()['count']
+            except dbaccess.DatabaseError as e:
+                LOG.error(u'Unable to count transactions in the Cyclos '
+                          u'database, using the webservice: {0}'.format(e))
+                self.use_webservice = True
+        return super(DatabaseTransactions, self)._resolve_count()
+
+    def totals(self):
+        """
+        Return the number of transactions and their total amount, and the
+        total amounts sent and received by ``username`` (0 if there's no
+        username), as a dict.
+        """
+        where = self._get_where()
+        if where is None:
+            totals = {}
+        else:
+            where_clauses, args = where
+            args = [self.username, self.username] + args
+            totals = self._query(
+                TRANSFERS_HISTORY_TOTALS, where_clauses, args)[0]
+
+        return {
+            'count': totals.get('total_count') or 0,
+            'amount': totals.get('total_amount') or Decimal('0'),
+            'sent': totals.get('total_sent') or Decimal('0'),
+            'received': totals.get('total_received') or Decimal('0'),
+        }
+
+
+def _start_of_day(date):
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return datetime.datetime.combine(date, datetime.time())
 
 
 #def _get_description(transfer):
@@ -0,0 +1,148 @@
+"""Registry of the Cyclos transfer types
+
+Looking up a transfer type by name takes a ``searchTransferTypes`` SOAP call,
+which is too slow (and too fragile) to do on backend initialisation or on the
+request path. The registry keeps the transfer types indexed by id and by name,
+persisted in the Django cache so all processes share them, and refreshes them
+from Cyclos in a background thread once they are older than
+``CYCLOS_TRANSFER_TYPES_REFRESH_INTERVAL`` seconds.
+
+Lookups which can't do without a transfer type (the member transaction type
+of a payment) pass ``wait=True``, so a cold registry is loaded synchronously
+instead. Use the ``refresh_transfer_types`` management command to load the
+registry when deploying.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+LOG = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = getattr(
+    settings, 'CYCLOS_TRANSFER_TYPES_REFRESH_INTERVAL', 3600)
+CACHE_KEY = 'cyclos_transfer_types'
+# Seconds to wait before trying again after a failed refresh
+RETRY_INTERVAL = 60
+
+
+class TransferTypeRegistry(object):
+    """
+    Lookup of ``TransferType`` namedtuples by id and by name.
+
+    Lookups don't call Cyclos: if the registry isn't loaded yet, or is out
+    of date, a background refresh is started and the lookup is answered from
+    what is known (``None`` if nothing is). With ``wait=True`` a registry
+    which isn't loaded at all is loaded synchronously first.
+    """
+    def __init__(self, accounts, refresh_interval=REFRESH_INTERVAL):
+        self.accounts = accounts
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._failed = None
+        self._by_id = {}
+        self._by_name = {}
+        self._updated = None
+
+    def get_by_id(self, transfer_type_id, wait=False):
+        self._check(wait)
+        return self._by_id.get(int(transfer_type_id))
+
+    def get_by_name(self, name, wait=False):
+        self._check(wait)
+        return self._by_name.get(name)
+
+    def all(self):
+        self._check()
+        return self._by_id.values()
+
+    @property
+    def loaded(self):
+        """True once the transfer types were loaded (from Cyclos or cache)"""
+        return self._updated is not None
+
+    def _set(self, transfer_types, updated):
+        self._by_id = dict((int(transfer_type.id), transfer_type)
+                           for transfer_type in transfer_types)
+        self._by_name = dict((transfer_type.name, transfer_type)
+                             for transfer_type in transfer_types)
+        self._updated = updated
+
+    def _is_stale(self):
+        return self._updated is None or \
+            time.time() - self._updated > self.refresh_interval
+
+    def _check(self, wait=False):
+        """
+        Load the registry from the cache, starting a background refresh if it
+        is missing or out of date. With ``wait``, a registry which isn't in
+        the cache either is loaded from Cyclos before returning.
+        """
+        if not self._is_stale():
+            return
+
+        cached = cache.get(CACHE_KEY)
+        if cached is not None and (
+                self._updated is None or cached['updated'] > self._updated):
+            self._set(cached['transfer_types'], cached['updated'])
+
+        if self._updated is None and wait:
+            self.load()
+        elif self._is_stale():
+            self.refresh_in_background()
+
+    def load(self):
+        """
+        Load the transfer types from Cyclos, unless they are loaded already
+        (by another thread waiting for them too).
+        """
+        with self._load_lock:
+            if self._updated is None:
+                self.refresh()
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or (
+                    self._failed is not None and
+                    time.time() - self._failed < RETRY_INTERVAL):
+                return
+            self._refreshing = True
+
+        thread = threading.Thread(target=self._background_refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+            self._failed = None
+        except Exception as e:
+            # Keep serving the transfer types we have, try again later
+            self._failed = time.time()
+            LOG.error(u'Unable to refresh Cyclos transfer types: '
+                      u'{0}'.format(e))
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh(self):
+        """
+        Load the transfer types from Cyclos (synchronously) and store them in
+        the cache. Returns the number of transfer types.
+        """
+        transfer_types = self.accounts.search_transfer_types()
+        updated = time.time()
+        cache.set(CACHE_KEY, {
+            'transfer_types': transfer_types,
+            'updated': updated,
+        }, None)
+        self._set(transfer_types, updated)
+        LOG.info(u'Loaded {0} Cyclos transfer types'.format(
+            len(transfer_types)))
+        return len(transfer_types)
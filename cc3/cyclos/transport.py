@@ -0,0 +1,150 @@
+"""Persistent (keep-alive) HTTP transport for the Cyclos SOAP clients
+
+The default pysimplesoap HTTP wrapper lives as long as its ``SoapClient``, so
+every short-lived client pays for a new TCP (and TLS) handshake. A
+``KeepAliveTransport`` is shared by all clients of a backend and keeps a pool
+of open connections per host.
+
+The transport implements the same ``request(url, method, body, headers)``
+interface as the pysimplesoap transports, returning a ``(response, content)``
+tuple.
+"""
+import httplib
+import logging
+import socket
+import threading
+import urlparse
+from collections import deque
+
+
+LOG = logging.getLogger(__name__)
+
+
+class TransportResponse(dict):
+    """
+    Response headers (lowercased) with the HTTP status, mimicking the
+    ``httplib2`` response used by pysimplesoap.
+    """
+    def __init__(self, response):
+        super(TransportResponse, self).__init__(
+            (key.lower(), value) for key, value in response.getheaders())
+        self.status = response.status
+        self.reason = response.reason
+        self['status'] = str(response.status)
+
+
+class KeepAliveTransport(object):
+    """
+    Thread-safe pool of persistent HTTP(S) connections, per host.
+
+    ``max_connections_per_host`` bounds the number of connections (in use or
+    idle) to a single host; further requests wait for a free connection.
+    ``connect_timeout`` and ``read_timeout`` are in seconds. A request which
+    can not be sent on a reused connection, because the server closed it, is
+    retried on a fresh connection (at most ``retries`` times). Failures after
+    the request was sent are never retried.
+    """
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection,
+    }
+
+    def __init__(self, max_connections_per_host=10, connect_timeout=10,
+                 read_timeout=60, retries=1):
+        self.max_connections_per_host = max_connections_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    def _get_slots(self, key):
+        with self._lock:
+            slots = self._slots.get(key)
+            if slots is None:
+                slots = self._slots[key] = threading.BoundedSemaphore(
+                    self.max_connections_per_host)
+            return slots
+
+    def _checkout(self, key, reuse=True):
+        """
+        Return an idle connection for ``key`` if there is one (and ``reuse``
+        is set), otherwise a new one. The second item of the returned tuple
+        tells if the connection was reused.
+        """
+        if reuse:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop(), True
+
+        scheme, host, port = key
+        connection = self.connection_classes[scheme](
+            host, port, timeout=self.connect_timeout)
+        connection.connect()
+        # The connect timeout was applied, from now on wait for responses
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            self._idle.setdefault(key, deque()).append(connection)
+
+    def request(self, url, method='GET', body=None, headers=None):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in self.connection_classes:
+            raise ValueError(u'Unsupported URL scheme: {0}'.format(url))
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = '{0}?{1}'.format(path, parts.query)
+
+        slots = self._get_slots(key)
+        slots.acquire()
+        try:
+            attempt = 0
+            while True:
+                connection, reused = self._checkout(key, reuse=not attempt)
+                try:
+                    connection.request(method, path, body, headers or {})
+                except socket.timeout:
+                    connection.close()
+                    raise
+                except (httplib.CannotSendRequest, socket.error):
+                    connection.close()
+                    # A stale keep-alive connection fails while sending, so
+                    # the server did not get the request and it is safe to
+                    # send it again.
+                    if reused and attempt < self.retries:
+                        attempt += 1
+                        LOG.info(u'Retrying {0} on a new connection (stale '
+                                 u'keep-alive connection)'.format(url))
+                        continue
+                    raise
+
+                try:
+                    response = connection.getresponse()
+                    content = response.read()
+                except Exception:
+                    # The request was sent, and the server may have acted on
+                    # it (e.g. a payment), so never send it again.
+                    connection.close()
+                    raise
+
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._checkin(key, connection)
+                return TransportResponse(response), content
+        finally:
+            slots.release()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
@@ -6,6 +6,7 @@ from django.db.models import Q
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
+from cc3.core.utils import chunks
 from cc3.cyclos import backends
 from cc3.cyclos import dbaccess
 from cc3.mail.models import MailMessage
@@ -13,7 +14,8 @@ from cc3.mail.models import MailMessage
 from .sql.transfer import (
     TRANSFERS_SELECT,
     TRANSFERS_TOTALS_BY_SENDER, TRANSFERS_TOTALS_BY_RECIPIENT,
-    TRANSFERS_WHERE_SENDER,
+    TRANSFERS_TOTALS_BY_SENDER_AND_RECIPIENT,
+    TRANSFERS_WHERE_DESCRIPTION_EXCLUDES, TRANSFERS_WHERE_SENDER,
     TRANSFERS_WHERE_RECIPIENT, TRANSFERS_WHERE_SENDER_OR_RECIPIENT,
     TRANSFERS_WHERE_TYPE_ID, TRANSFERS_WHERE_FROM_DATE,
     TRANSFERS_WHERE_TO_DATE)
@@ -107,6 +109,10 @@ def close_cyclos_connection(conn):
     return dbaccess.close_cyclos_connection(conn)
 
 
+def cyclos_connection():
+    return dbaccess.cyclos_connection()
+
+
 def get_cyclos_transfers(conn, senders=None, recipients=None, involving=None,
                          transfer_type_ids=None, from_date=None, to_date=None):
     """Get filtered cyclos transfers from the cyclos database
@@ -201,6 +207,47 @@ def get_cyclos_transfer_totals(
     return totals
 
 
+def get_cyclos_transfer_pair_totals(
+        conn, senders=None, recipients=None, transfer_type_ids=None,
+        from_date=None, to_date=None, exclude_description=None):
+    """Get count and total amount of filtered transfers per sender/recipient
+
+    Transfers are filtered as for ``get_cyclos_transfers``, and those with
+    ``exclude_description`` in their description are left out. Yields dicts
+    with sender, recipient, total_count and total_amount.
+    """
+    where_sql = ''
+    where_clauses = []
+    args = []
+    if senders is not None:
+        where_clauses.append(TRANSFERS_WHERE_SENDER)
+        args.append(senders)
+    if recipients is not None:
+        where_clauses.append(TRANSFERS_WHERE_RECIPIENT)
+        args.append(recipients)
+    if transfer_type_ids is not None:
+        where_clauses.append(TRANSFERS_WHERE_TYPE_ID)
+        args.append(transfer_type_ids)
+    if from_date is not None:
+        where_clauses.append(TRANSFERS_WHERE_FROM_DATE)
+        args.append(from_date)
+    if to_date is not None:
+        where_clauses.append(TRANSFERS_WHERE_TO_DATE)
+        args.append(to_date)
+    if exclude_description:
+        where_clauses.append(TRANSFERS_WHERE_DESCRIPTION_EXCLUDES)
+        args.append(exclude_description)
+
+    if where_clauses:
+        where_sql = " WHERE {0}".format(" AND ".join(where_clauses))
+
+    sql = TRANSFERS_TOTALS_BY_SENDER_AND_RECIPIENT.format(
+        where_sql=where_sql) + ';'
+
+    for row in dbaccess.cyclos_query_results(conn, sql, args):
+        yield row
+
+
 def is_consumer_member(user):
     if hasattr(user, 'cc3_profile') and user.cc3_profile is not None:
         return user.cc3_profile.cyclos_group.name in getattr(
@@ -208,3 +255,39 @@ def is_consumer_member(user):
     else:
         return False
 
+
+
+def reconcile_cyclos_groups(page_size=500):
+    """
+    Stores the current Cyclos group of every Cyclos member as the group
+    membership of its ``CyclosAccount``, reading the members a page at a
+    time until an empty page.
+
+    Returns the number of accounts whose group changed.
+    """
+    from .models import CyclosAccount
+
+    members_by_group = {}
+    seen = set()
+    page = 0
+    while True:
+        # Cyclos may return fewer members per page than asked for, so read
+        # pages until there are no more (or no new) members
+        members = backends.search(currentPage=page, pageSize=page_size)
+        new_members = [member for member in members if member[0] not in seen]
+        if not new_members:
+            break
+        for member_id, name, email, username, group_id in new_members:
+            seen.add(member_id)
+            if group_id:
+                members_by_group.setdefault(int(group_id), []).append(
+                    member_id)
+        page += 1
+
+    updated = 0
+    for group_id, member_ids in members_by_group.items():
+        for chunk in chunks(member_ids, page_size):
+            updated += CyclosAccount.objects.filter(
+                cyclos_id__in=chunk).exclude(
+                    cyclos_group=group_id).update(cyclos_group=group_id)
+    return updated
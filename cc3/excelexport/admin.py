@@ -1,13 +1,145 @@
 import operator
-import os
 import tempfile
 import xlwt
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import FileResponse
 from django.template.defaultfilters import slugify
 
-from .utils import get_object_from_name, get_fully_qualified_classname
+from .utils import (
+    EXPORT_CHUNK_SIZE, get_object_from_name, get_fully_qualified_classname,
+    iter_queryset)
+
+
+class ExportPlan(object):
+    """
+    The columns of the XLS export of a model, compiled once from the
+    ADMIN_ACTION_EXPORT_XLS_FIELDS setting: their names, accessors, and the
+    relations to fetch along with the rows.
+
+    Filters, styles and unicode settings depend on the type of the value, so
+    they are resolved the first time a type is seen in a column and cached.
+    """
+    def __init__(self, model):
+        conf = getattr(settings, 'ADMIN_ACTION_EXPORT_XLS_FIELDS', {})
+        # For global field conf (by type). Global conf takes precedence on
+        # field specific conf.
+        self.global_fmt = conf.get('global', {})
+        field_conf = conf.get(get_fully_qualified_classname(model), {})
+        self.fields = field_conf.get('fields', {})
+        positions = dict((self.fields[f]['position'], f) for f in self.fields
+                         if 'position' in self.fields[f])
+
+        self.col_width = None
+        if 'col_width' in field_conf:
+            self.col_width = int(field_conf['col_width'])
+        # If no model specific column width, use global setting
+        elif 'col_width' in self.global_fmt:
+            self.col_width = int(self.global_fmt['col_width'])
+
+        self.model = model
+        self.select_related = set()
+        self.prefetch_related = set()
+
+        # (name, accessor) per column, with the fields from settings inserted
+        # at their positions among the model fields
+        self.columns = []
+        for f in model._meta.fields:
+            while len(self.columns) in positions:
+                self.add_setting_column(positions[len(self.columns)])
+            self.columns.append((f.name, operator.attrgetter(f.name)))
+            if f.is_relation:
+                self.select_related.add(f.name)
+        # Fields whose position comes after the end of the model fields
+        while len(self.columns) in positions:
+            self.add_setting_column(positions[len(self.columns)])
+
+        self.styles = {'none_style': xlwt.easyxf('')}
+        self.global_styles = {}
+        self.global_filters = {}
+        self.filters = {}
+        self.formats = {}
+
+    def add_setting_column(self, field_name):
+        attr = self.fields[field_name].get('attr')
+        if attr:
+            # Uses dot notation, thus the use of operator.attrgetter
+            accessor = operator.attrgetter(attr)
+            self.add_relations(attr)
+        else:
+            accessor = None
+        self.columns.append((field_name, accessor))
+
+    def add_relations(self, attr):
+        """
+        Adds the relations followed by the dotted attr path to those to
+        select or prefetch along with the rows.
+        """
+        model = self.model
+        path = []
+        for name in attr.split('.'):
+            relations = dict(
+                (f.get_accessor_name() if f.auto_created and not f.concrete
+                 else f.name, f)
+                for f in model._meta.get_fields()
+                if f.is_relation and f.related_model)
+            if name not in relations:
+                # a plain field or attribute
+                return
+            field = relations[name]
+            path.append(name)
+            if field.many_to_many or field.one_to_many:
+                self.prefetch_related.add('__'.join(path))
+                return
+            self.select_related.add('__'.join(path))
+            model = field.related_model
+
+    def prepare_queryset(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+    def get_format(self, field_name, value):
+        """
+        Returns the filter, style and unicode setting for a value in the
+        column of field_name.
+        """
+        key = (field_name, type(value))
+        if key not in self.formats:
+            fqn = get_fully_qualified_classname(type(value))
+            global_field_cfg = get_global_field_config(self.global_fmt, fqn)
+            self.formats[key] = (
+                get_filter_obj(field_name, fqn, self.global_filters,
+                               global_field_cfg, self.filters, self.fields),
+                get_style(field_name, fqn, self.global_styles,
+                          global_field_cfg, self.styles, self.fields),
+                is_field_unicode(field_name, global_field_cfg, self.fields),
+            )
+        return self.formats[key]
+
+    def write_header(self, ws):
+        for index, (field_name, accessor) in enumerate(self.columns):
+            ws.write(0, index, field_name)
+
+    def write_row(self, ws, rowx, row):
+        for index, (field_name, accessor) in enumerate(self.columns):
+            if accessor is None:
+                continue
+            value = accessor(row)
+            filter_obj, style, is_unicode = self.get_format(field_name, value)
+            if filter_obj:
+                value = filter_obj.apply(value)
+            if is_unicode:
+                ws.write(rowx, index, unicode(value), style)
+            else:
+                ws.write(rowx, index, value, style)
+
+    def set_column_widths(self, ws):
+        if self.col_width:
+            for index in range(len(self.columns)):
+                ws.col(index).width = int(self.col_width * 260)
 
 
 # Function to generate an XLS file based on a queryset
@@ -20,48 +152,7 @@ def admin_action_export_xls(modeladmin, request, queryset):
     """
     Add as an action for ModelAdmin classes to export the queryset to XLS.
     """
-    # Initialize some variables specific to handling fields specified via
-    # settings
-    positions = {}
-    styles = {'none_style': xlwt.easyxf('')}
-    # For global field conf (by type). Global conf takes precedence on field
-    # specific conf.
-    global_fmt = {}
-    global_styles = {}
-    global_filters = {}
-    fields = {}
-    filters = {}
-    col_width = None
-
-    # Get global field configuration
-    if hasattr(settings, 'ADMIN_ACTION_EXPORT_XLS_FIELDS') and \
-            'global' in settings.ADMIN_ACTION_EXPORT_XLS_FIELDS:
-        global_fmt = settings.ADMIN_ACTION_EXPORT_XLS_FIELDS['global']
-
-    model_fqn = get_fully_qualified_classname(queryset.model)
-
-    # Check for the presence of a specification for the model in the app settings
-    if hasattr(settings, 'ADMIN_ACTION_EXPORT_XLS_FIELDS') and \
-            model_fqn in settings.ADMIN_ACTION_EXPORT_XLS_FIELDS:
-        # Get the field conf. corresponding to the model from the settings
-        field_conf = settings.ADMIN_ACTION_EXPORT_XLS_FIELDS[model_fqn]
-
-        if 'fields' in field_conf:
-            # Get the fields configuration
-            fields = field_conf['fields']
-
-        if fields:
-            # Note that positions specified in
-            positions = {fields[f]['position']: f for f in fields if 'position' in fields[f]}
-
-        if 'col_width' in field_conf:
-            # Get the column width
-            col_width = int(field_conf['col_width'])
-
-    # If no queryset model specific column width, use global setting
-    if not col_width and global_fmt:
-        if 'col_width' in global_fmt:
-            col_width = int(global_fmt['col_width'])
+    plan = ExportPlan(queryset.model)
 
     # Get the model meta data
     model_meta = queryset.model._meta
@@ -70,148 +161,20 @@ def admin_action_export_xls(modeladmin, request, queryset):
     wb = xlwt.Workbook()
     ws = wb.add_sheet(unicode(model_meta.verbose_name_plural[:31]))
 
-    # For loop counter used to add extra fields
-    index = 0
-    for i, f in enumerate(model_meta.fields):
-        # Handle field insertion from settings file
-        while index in positions:
-            ws.write(0, index, positions[index])
-            index += 1
-
-        ws.write(0, index, f.name)
-        index += 1
-
-    # Handle any field whose position comes after after the end
-    # of the model_meta.fields collection
-    while index in positions:
-        ws.write(0, index, positions[index])
-        index += 1
-
-    # Write the actual field values
-    # For each row in the queryset
-    for ri, row in enumerate(queryset):
-        index = 0
-
-        # For each field
-        for ci, f in enumerate(model_meta.fields):
-            # Handle field insertion from settings file
-            while index in positions:
-                # Get the field name
-                field_name = positions[index]
-
-                try:
-                    # Get the attribute specified in the settings.
-                    # Uses dot notation, thus the use of operator.attrgetter
-                    value = operator.attrgetter(fields[field_name]['attr'])(row)
-                except KeyError:
-                    continue
-
-                # Blank global config for current field
-                global_field_cfg = None
-
-                # First check global config
-                # Get the field type
-                fqn = get_fully_qualified_classname(type(value))
-
-                # The global field config for the field fqn
-                global_field_cfg = get_global_field_config(global_fmt, fqn)
-
-                # Get the filter object from the appropriate source
-                filter_obj = get_filter_obj(field_name, fqn, global_filters, global_field_cfg, filters, fields)
-
-                # If there is a filter for this field
-                if filter_obj:
-                    value = filter_obj.apply(value)
-
-                # Get the style for the field from the appropriate source
-                style = get_style(field_name, fqn, global_styles, global_field_cfg, styles, fields)
-
-                # Get unicode config for the fields
-                is_unicode = is_field_unicode(field_name, global_field_cfg, fields)
-
-                if is_unicode:
-                    # Write the field value to the file using the relevant style information
-                    ws.write(ri + 1, index, unicode(value), style)
-                else:
-                    ws.write(ri + 1, index, value, style)
-
-                # Tackle the next field
-                index += 1
-
-            # Get the field value
-            value = getattr(row, f.name)
-
-            # First check global config
-            # Get the field type
-            fqn = get_fully_qualified_classname(type(value))
-
-            # The global field config for the field fqn
-            global_field_cfg = get_global_field_config(global_fmt, fqn)
-
-            # Get the filter object from the appropriate source
-            filter_obj = get_filter_obj(f.name, fqn, global_filters, global_field_cfg, filters, fields)
-
-            if filter_obj:
-                value = filter_obj.apply(value)
+    plan.write_header(ws)
+    queryset = plan.prepare_queryset(queryset)
+    for ri, row in enumerate(iter_queryset(queryset)):
+        # Serialise the rows written so far, to keep memory use flat
+        if ri and ri % EXPORT_CHUNK_SIZE == 0:
+            ws.flush_row_data()
+        plan.write_row(ws, ri + 1, row)
 
-            # Get the style for the field from the appropriate source
-            style = get_style(f.name, fqn, global_styles, global_field_cfg, styles, fields)
-
-            is_unicode = is_field_unicode(f.name, global_field_cfg, fields)
-
-            if is_unicode:
-                ws.write(ri + 1, index, unicode(value), style)
-            else:
-                ws.write(ri + 1, index, value, style)
-            index += 1
+    plan.set_column_widths(ws)
 
-        # Handle any field whose position comes after after the end
-        # of the model_meta.fields collection
-        while index in positions:
-            # Get the current field name
-            field_name = positions[index]
-
-            # Get the field value
-            value = operator.attrgetter(fields[field_name]['attr'])
-
-            # First check global config
-            # Get the field type
-            fqn = get_fully_qualified_classname(type(value))
-
-            # The global field config for the field fqn
-            global_field_cfg = get_global_field_config(global_fmt, fqn)
-
-            # Initialize the filter object
-            filter_obj = None
-
-            # Get the filter object from the appropriate source
-            filter_obj = get_filter_obj(field_name, fqn, global_filters, global_field_cfg, filters, fields)
-
-            # Get the attribute specified in the settings.
-            # Uses dot notation, thus the use of operator.attrgetter
-            is_unicode = is_field_unicode(field_name, global_field_cfg, fields)
-
-            try:
-                if is_unicode:
-                    ws.write(ri+1, index, unicode(operator.attrgetter(fields[field_name]['attr'])(row)))
-                else:
-                    ws.write(ri + 1, index, operator.attrgetter(fields[field_name]['attr'])(row))
-            except (KeyError, TypeError):
-                pass
-            index += 1
-
-    # set the column width
-    if col_width:
-        for i in range(index):
-            ws.col(i).width = int(col_width * 260)
-
-    fd, fn = tempfile.mkstemp()
-    os.close(fd)
-    wb.save(fn)
-    fh = open(fn, 'rb')
-    resp = fh.read()
-    fh.close()
-    response = HttpResponse(resp, content_type='application/ms-excel')
+    output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    response = FileResponse(output, content_type='application/ms-excel')
     response['Content-Disposition'] = 'attachment; filename=%s.xls' % \
         (unicode(slugify(model_meta.verbose_name_plural)),)
     return response
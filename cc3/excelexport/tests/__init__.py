@@ -0,0 +1,3 @@
+from .test_admin import ExportPlanTestCase
+from .test_utils import IterQuerysetTestCase
+from .test_views import StreamingResponseTestCase
@@ -0,0 +1,122 @@
+import datetime
+
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mock import patch
+
+from ..admin import ExportPlan, get_filter_obj
+
+EXPORT_FIELDS = {
+    'global': {
+        'fields': {
+            'datetime.date': {'num_format': 'dd-mm-yyyy', 'unicode': False},
+        },
+    },
+    'django.contrib.auth.models.Permission': {
+        'fields': {
+            'app_label': {'position': 1, 'attr': 'content_type.app_label'},
+            'empty': {'position': 5},
+        },
+    },
+    'django.contrib.auth.models.Group': {
+        'fields': {
+            'permissions': {'position': 0, 'attr': 'permissions.count'},
+        },
+    },
+    'django.contrib.contenttypes.models.ContentType': {
+        'fields': {
+            'permissions': {'position': 3, 'attr': 'permission_set.count'},
+        },
+    },
+}
+
+
+class Worksheet(object):
+    def __init__(self):
+        self.cells = {}
+
+    def write(self, rowx, colx, value, style=None):
+        self.cells[rowx, colx] = value
+
+
+@override_settings(ADMIN_ACTION_EXPORT_XLS_FIELDS=EXPORT_FIELDS)
+class ExportPlanTestCase(TestCase):
+    """
+    Test case for the columns of the XLS export of a model.
+    """
+    def test_columns(self):
+        """
+        Tests that the columns from settings are inserted at their positions
+        among the model fields, also after the last one.
+        """
+        plan = ExportPlan(Permission)
+
+        self.assertEqual(
+            [name for name, accessor in plan.columns],
+            ['id', 'app_label', 'name', 'content_type', 'codename', 'empty'])
+        self.assertIsNone(dict(plan.columns)['empty'])
+
+    def test_dotted_attribute(self):
+        """
+        Tests that dotted attribute paths are followed, and their relations
+        selected along with the rows.
+        """
+        plan = ExportPlan(Permission)
+        self.assertEqual(plan.select_related, set(['content_type']))
+        self.assertEqual(plan.prefetch_related, set())
+
+        queryset = plan.prepare_queryset(Permission.objects.order_by('pk'))
+        worksheet = Worksheet()
+        with self.assertNumQueries(1):
+            for rowx, permission in enumerate(queryset):
+                plan.write_row(worksheet, rowx, permission)
+
+        permission = Permission.objects.order_by('pk')[0]
+        self.assertEqual(worksheet.cells[0, 1],
+                         permission.content_type.app_label)
+
+    def test_related_managers(self):
+        """
+        Tests that paths through many to many and reverse relations are
+        prefetched along with the rows.
+        """
+        plan = ExportPlan(Group)
+        self.assertEqual(plan.prefetch_related, set(['permissions']))
+        self.assertEqual(plan.select_related, set())
+
+        plan = ExportPlan(ContentType)
+        self.assertEqual(plan.prefetch_related, set(['permission_set']))
+
+        group = Group.objects.create(name='Exporters')
+        group.permissions.add(*Permission.objects.all()[:2])
+        queryset = ExportPlan(Group).prepare_queryset(Group.objects.all())
+        with self.assertNumQueries(2):
+            groups = list(queryset)
+            self.assertEqual(len(groups[0].permissions.all()), 2)
+
+    def test_format_cache(self):
+        """
+        Tests that the format of a column is resolved once per type of value.
+        """
+        plan = ExportPlan(Permission)
+
+        with patch('cc3.excelexport.admin.get_filter_obj',
+                   side_effect=get_filter_obj) as filter_mock:
+            text_format = plan.get_format('name', u'Can add')
+            self.assertIs(plan.get_format('name', u'Can change'), text_format)
+            date_format = plan.get_format('name', datetime.date(2016, 3, 1))
+            self.assertIs(plan.get_format('name', datetime.date(2016, 4, 1)),
+                          date_format)
+
+        self.assertEqual(filter_mock.call_count, 2)
+        filter_obj, style, is_unicode = text_format
+        self.assertTrue(is_unicode)
+        filter_obj, style, is_unicode = date_format
+        self.assertFalse(is_unicode)
+        self.assertEqual(style.num_format_str, 'dd-mm-yyyy')
+        # shared by all columns of the type
+        self.assertIs(plan.get_format('codename', datetime.date.today())[1],
+                      style)
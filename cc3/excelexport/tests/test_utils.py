@@ -0,0 +1,68 @@
+from django.contrib.auth.models import Permission
+from django.db.models import Count
+from django.test import TestCase
+
+from ..utils import iter_queryset
+
+
+class IterQuerysetTestCase(TestCase):
+    """
+    Test case for iterating over querysets in chunks.
+    """
+    def test_instances(self):
+        """
+        Tests that all instances are yielded, in the queryset order.
+        """
+        queryset = Permission.objects.order_by('-codename')
+
+        self.assertEqual(list(iter_queryset(queryset, chunk_size=3)),
+                         list(queryset))
+
+    def test_values_list(self):
+        """
+        Tests that values and values_list querysets yield their own rows.
+        """
+        queryset = Permission.objects.order_by('codename')
+
+        self.assertEqual(
+            list(iter_queryset(queryset.values('codename'), chunk_size=3)),
+            list(queryset.values('codename')))
+        self.assertEqual(
+            list(iter_queryset(
+                queryset.values_list('codename', flat=True), chunk_size=3)),
+            list(queryset.values_list('codename', flat=True)))
+
+    def test_sliced(self):
+        """
+        Tests that a sliced queryset yields the rows of the slice.
+        """
+        queryset = Permission.objects.order_by('codename')[2:5]
+
+        self.assertEqual(list(iter_queryset(queryset, chunk_size=2)),
+                         list(queryset))
+
+    def test_annotated(self):
+        """
+        Tests that a grouped and annotated values queryset yields its groups.
+        """
+        queryset = Permission.objects.values('content_type').annotate(
+            permissions=Count('pk')).order_by('content_type')
+
+        rows = list(iter_queryset(queryset, chunk_size=2))
+
+        self.assertEqual(rows, list(queryset))
+        self.assertEqual(sum(row['permissions'] for row in rows),
+                         Permission.objects.count())
+
+    def test_distinct(self):
+        """
+        Tests that a distinct queryset yields each row once.
+        """
+        queryset = Permission.objects.values_list(
+            'content_type__app_label', flat=True).order_by(
+                'content_type__app_label').distinct()
+
+        rows = list(iter_queryset(queryset, chunk_size=2))
+
+        self.assertEqual(rows, list(queryset))
+        self.assertEqual(len(rows), len(set(rows)))
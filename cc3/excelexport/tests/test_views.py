@@ -0,0 +1,100 @@
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+
+from mock import patch
+
+from ..utils import XLSIncompatible
+from ..views import (
+    InvalidData, SpreadsheetResponseMixin, StreamingCSVResponse,
+    StreamingExcelResponse)
+
+
+class StreamingResponseTestCase(TestCase):
+    """
+    Test case for the streaming CSV and Excel responses.
+    """
+    def setUp(self):
+        self.queryset = Permission.objects.order_by('codename')
+
+    def test_iter_clean_values(self):
+        """
+        Tests that values querysets are cleaned to a header and the values
+        of each row in the header order.
+        """
+        rows = list(SpreadsheetResponseMixin().iter_clean(
+            self.queryset.values('codename', 'name'), ['name', 'codename']))
+
+        self.assertEqual(rows[0], ['name', 'codename'])
+        self.assertEqual(
+            rows[1:],
+            [[name, codename] for codename, name in
+             self.queryset.values_list('codename', 'name')])
+
+    def test_iter_clean_header_override(self):
+        """
+        Tests that the header can be overridden, and that querysets of
+        instances are cleaned as their values.
+        """
+        rows = list(SpreadsheetResponseMixin().iter_clean(
+            self.queryset, ['codename'], header_override=['Code']))
+
+        self.assertEqual(rows[0], ['Code'])
+        self.assertEqual(
+            rows[1:],
+            [[codename] for codename in
+             self.queryset.values_list('codename', flat=True)])
+
+    def test_iter_clean_sequences(self):
+        """
+        Tests that sequences of sequences are passed as they are, and that
+        anything else is refused.
+        """
+        mixin = SpreadsheetResponseMixin()
+
+        self.assertEqual(
+            list(mixin.iter_clean(iter([['a', 1], ['b', 2]]), None)),
+            [['a', 1], ['b', 2]])
+        self.assertRaises(InvalidData, mixin.iter_clean, [], None)
+        self.assertRaises(InvalidData, mixin.iter_clean, [1, 2], None)
+
+    def test_streaming_csv(self):
+        """
+        Tests that the CSV file is streamed with a line per row.
+        """
+        response = StreamingCSVResponse(
+            self.queryset.values('codename'), output_name='permissions',
+            headers=['codename'])
+
+        lines = ''.join(response.streaming_content).splitlines()
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment;filename="permissions.csv"')
+        self.assertEqual(lines[0], 'codename')
+        self.assertEqual(
+            lines[1:], list(self.queryset.values_list('codename', flat=True)))
+
+    def test_streaming_excel(self):
+        """
+        Tests that the Excel file is streamed.
+        """
+        response = StreamingExcelResponse(
+            [['codename']] + list(self.queryset.values_list('codename')),
+            output_name='permissions')
+
+        content = ''.join(response.streaming_content)
+
+        self.assertEqual(response['Content-Type'], 'application/vnd.ms-excel')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment;filename="permissions.xls"')
+        # an OLE2 compound document
+        self.assertTrue(content.startswith('\xd0\xcf\x11\xe0'))
+
+    @patch('cc3.excelexport.utils.MAX_XLS_ROWS', 2)
+    def test_streaming_excel_too_many_rows(self):
+        """
+        Tests that more rows than Excel allows are refused.
+        """
+        self.assertRaises(
+            XLSIncompatible, StreamingExcelResponse,
+            [['codename'], ['a'], ['b']])
@@ -21,7 +21,16 @@ IS_POPUP_VAR = 'pop'
 ERROR_FLAG = 'e'
 # END from django.contrib.admin.views.main:
 
+MAX_XLS_ROWS = 65536
+
 CSV_SEPARATOR = getattr(settings, "CSV_SEPARATOR", ",")
+# Number of rows fetched from the database, and written to a sheet before
+# flushing, at a time when exporting
+EXPORT_CHUNK_SIZE = getattr(settings, "EXCELEXPORT_CHUNK_SIZE", 1000)
+
+
+class XLSIncompatible(Exception):
+    pass
 
 
 def get_lookup_params(request):
@@ -67,28 +76,53 @@ def filter_queryset(qs, request):
     return qs
 
 
+def csv_row(row, encoding):
+    """Returns the values of row as encoded strings for the csv writer"""
+    out_row = []
+    for value in row:
+        if not isinstance(value, basestring):
+            value = unicode(value)
+        # Strip out carriage returns and replace newlines with
+        # spaces.
+        value = value.replace("\r", "").replace("\n", " ")
+        value = value.encode(encoding)
+        out_row.append(value)
+    return out_row
+
+
 def generate_csv(data, headers, encoding):
     output = StringIO.StringIO()
     csv_writer = csv.writer(output, delimiter=CSV_SEPARATOR)
     for row in data:
-        out_row = []
-        for value in row:
-            if not isinstance(value, basestring):
-                value = unicode(value)
-            # Strip out carriage returns and replace newlines with
-            # spaces.
-            value = value.replace("\r", "").replace("\n", " ")
-            value = value.encode(encoding)
-            out_row.append(value)
-        csv_writer.writerow(out_row)
+        csv_writer.writerow(csv_row(row, encoding))
 
     return output
 
 
-def generate_xls(data, headers, encoding):
-    output = StringIO.StringIO()
+class Echo(object):
+    """File-like object which returns what is written to it, so the csv
+    writer can be used to produce lines one at a time"""
+    def write(self, value):
+        return value
+
+
+def iter_csv(data, encoding):
+    """Yields the rows of data as lines of CSV"""
+    csv_writer = csv.writer(Echo(), delimiter=CSV_SEPARATOR)
+    for row in data:
+        yield csv_writer.writerow(csv_row(row, encoding))
+
+
+def write_xls(data, encoding, output, sheet_name='Sheet 1'):
+    """
+    Writes the rows of data as an Excel sheet to output (a file name or
+    file-like object).
+
+    Rows are serialised as they are written, so only the compact sheet data
+    is held in memory.
+    """
     book = xlwt.Workbook(encoding=encoding)
-    sheet = book.add_sheet('Sheet 1')
+    sheet = book.add_sheet(sheet_name)
     styles = {
         'datetime': xlwt.easyxf(num_format_str='yyyy-mm-dd hh:mm:ss'),
         'date': xlwt.easyxf(num_format_str='yyyy-mm-dd'),
@@ -96,6 +130,8 @@ def generate_xls(data, headers, encoding):
         'default': xlwt.Style.default_style,
     }
     for rowx, row in enumerate(data):
+        if rowx >= MAX_XLS_ROWS:
+            raise XLSIncompatible("Too many rows for Excel.")
         for colx, value in enumerate(row):
             if isinstance(value, datetime.datetime):
                 cell_style = styles['datetime']
@@ -106,10 +142,43 @@ def generate_xls(data, headers, encoding):
             else:
                 cell_style = styles['default']
             sheet.write(rowx, colx, value, style=cell_style)
+        if rowx % EXPORT_CHUNK_SIZE == EXPORT_CHUNK_SIZE - 1:
+            sheet.flush_row_data()
 
     book.save(output)
+
+
+def generate_xls(data, headers, encoding):
+    output = StringIO.StringIO()
+    write_xls(data, encoding, output)
     return output
 
+
+def iter_queryset(queryset, chunk_size=None):
+    """
+    Yields the results of queryset (of any kind: instances, values or
+    values_list) in its own order, fetching chunk_size rows at a time so
+    they are never all in memory.
+
+    Grouped, distinct and annotated querysets can't be chunked by primary
+    key (their rows aren't model rows), so those are iterated in one query.
+    """
+    query = queryset.query
+    if (not query.can_filter() or query.group_by is not None or
+            query.distinct or query.annotations):
+        # sliced already (so small enough to fetch in one go), or not
+        # chunkable
+        for row in queryset.iterator():
+            yield row
+        return
+
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    pks = list(queryset.values_list('pk', flat=True))
+    for start in xrange(0, len(pks), chunk_size):
+        for row in queryset.filter(pk__in=pks[start:start + chunk_size]):
+            yield row
+
+
 # Given a class (as returned by type(...)), return the fully qualified name string
 def get_fully_qualified_classname(obj_class):
     return obj_class.__module__ + '.' + obj_class.__name__
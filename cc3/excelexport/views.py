@@ -1,64 +1,49 @@
-import os
 import tempfile
-import xlwt
+from itertools import chain
 
 from django.conf import ImproperlyConfigured
 from django.contrib.contenttypes.models import ContentType
 from django.db.models.query import QuerySet, ValuesQuerySet
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.template.defaultfilters import slugify
 
-from .utils import filter_queryset, generate_xls, generate_csv
-
-
-MAX_XLS_ROWS = 65536
+from .utils import (
+    MAX_XLS_ROWS, XLSIncompatible, filter_queryset, generate_xls,
+    generate_csv, iter_csv, iter_queryset, write_xls)
 
 
 class InvalidData(Exception):
     pass
 
 
-class XLSIncompatible(Exception):
-    pass
-
-
 def admin_export_xls(request, app, model):
     """
     Adds output of admin list views to any model which uses the excelexport/change_list.html
     as a base for its admin change_list
     """
     mc = ContentType.objects.get(app_label=app, model=model).model_class()
-    wb = xlwt.Workbook()
-    ws = wb.add_sheet(unicode(mc._meta.verbose_name_plural[:31]))
-    for i, f in enumerate(mc._meta.fields):
-        ws.write(0,i, f.name)
+    field_names = [f.name for f in mc._meta.fields]
     qs = mc.objects.all()
     qs = filter_queryset(qs, request)
-    for ri, row in enumerate(qs):
-        for ci, f in enumerate(mc._meta.fields):
-            ws.write(ri+1, ci, unicode(getattr(row, f.name)))
-    fd, fn = tempfile.mkstemp()
-    os.close(fd)
-    wb.save(fn)
-    fh = open(fn, 'rb')
-    resp = fh.read()
-    fh.close()
-    response = HttpResponse(resp, content_type='application/ms-excel')
+    rows = chain(
+        [field_names],
+        ([unicode(getattr(row, name)) for name in field_names]
+         for row in iter_queryset(qs)))
+    output = tempfile.TemporaryFile()
+    write_xls(rows, 'utf8', output,
+              sheet_name=unicode(mc._meta.verbose_name_plural[:31]))
+    output.seek(0)
+    response = FileResponse(output, content_type='application/ms-excel')
     response['Content-Disposition'] = 'attachment; filename=%s.xls' % \
           (unicode(slugify(mc._meta.verbose_name_plural)),)
     return response
 
 
-class BaseSpreadsheetResponse(HttpResponse):
+class SpreadsheetResponseMixin(object):
     content_type = None
     file_extension = None
 
-    def __init__(self, data, output_name='spreadsheet_data', headers=None,
-                 encoding='utf8', header_override=None, **kwargs):
-        content = self.generate_output(data, headers, encoding, header_override=header_override)
-        content.seek(0)
-        super(BaseSpreadsheetResponse, self).__init__(
-            content=content.getvalue(), content_type=self.get_content_type())
+    def set_output_name(self, output_name):
         self['Content-Disposition'] = 'attachment;filename="%s.%s"' % \
             (output_name.replace('"', '\"'), self.get_file_extention())
 
@@ -86,10 +71,25 @@ class BaseSpreadsheetResponse(HttpResponse):
             raise InvalidData("Sequence of sequences required.")
         return data
 
-    def generate_output(self, data, headers, encoding, header_override=None, *args, **kwargs):
-        # Make sure you call `clean()` when implementing. E.g.:
-        # data = self.clean(data, headers)
-        raise NotImplementedError
+    def iter_clean(self, data, headers, header_override=None):
+        # Like `clean()`, but returns an iterator over the rows. QuerySets
+        # are fetched in chunks, so they are never all in memory.
+        if isinstance(data, ValuesQuerySet):
+            data = iter_queryset(data)
+        elif isinstance(data, QuerySet):
+            data = iter_queryset(data.values())
+        data = iter(data)
+        first = next(data, None)
+        if first is None or not hasattr(first, '__getitem__'):
+            raise InvalidData("Sequence of sequences required.")
+        data = chain([first], data)
+        if isinstance(first, dict):
+            if headers is None:
+                headers = first.keys()
+            data = chain(
+                [header_override if header_override is not None else headers],
+                ([row[col] for col in headers] for row in data))
+        return data
 
     def get_content_type(self):
         # Use self.mimetype if no content_type supplied
@@ -106,6 +106,43 @@ class BaseSpreadsheetResponse(HttpResponse):
         return self.file_extension
 
 
+class BaseSpreadsheetResponse(SpreadsheetResponseMixin, HttpResponse):
+
+    def __init__(self, data, output_name='spreadsheet_data', headers=None,
+                 encoding='utf8', header_override=None, **kwargs):
+        content = self.generate_output(data, headers, encoding, header_override=header_override)
+        content.seek(0)
+        super(BaseSpreadsheetResponse, self).__init__(
+            content=content.getvalue(), content_type=self.get_content_type())
+        self.set_output_name(output_name)
+
+    def generate_output(self, data, headers, encoding, header_override=None, *args, **kwargs):
+        # Make sure you call `clean()` when implementing. E.g.:
+        # data = self.clean(data, headers)
+        raise NotImplementedError
+
+
+class BaseStreamingSpreadsheetResponse(SpreadsheetResponseMixin,
+                                       StreamingHttpResponse):
+    """
+    Streaming version of ``BaseSpreadsheetResponse``, for exports too big to
+    hold in memory. Takes the same arguments, but ``data`` may be any
+    iterable of rows.
+    """
+    def __init__(self, data, output_name='spreadsheet_data', headers=None,
+                 encoding='utf8', header_override=None, **kwargs):
+        data = self.iter_clean(data, headers, header_override)
+        super(BaseStreamingSpreadsheetResponse, self).__init__(
+            self.generate_output(data, encoding),
+            content_type=self.get_content_type())
+        self.set_output_name(output_name)
+
+    def generate_output(self, data, encoding):
+        # Return an iterable or file-like object with the output, from the
+        # cleaned rows in data
+        raise NotImplementedError
+
+
 class CSVResponse(BaseSpreadsheetResponse):
     """
     Response that offers a CSV file for download.
@@ -165,3 +202,36 @@ class SpreadsheetResponse(ExcelResponse):
             output_func = generate_csv
 
         return output_func(data, headers, encoding)
+
+
+class StreamingCSVResponse(BaseStreamingSpreadsheetResponse):
+    """
+    Response that streams a CSV file for download, one row at a time.
+    """
+    content_type = CSVResponse.content_type
+    file_extension = CSVResponse.file_extension
+
+    def generate_output(self, data, encoding):
+        return iter_csv(data, encoding)
+
+
+class StreamingExcelResponse(BaseStreamingSpreadsheetResponse, FileResponse):
+    """
+    Response that offers an Excel spreadsheet for download.
+
+    The spreadsheet is written to a temporary file, flushing rows as it goes,
+    and streamed from there. Raises ``XLSIncompatible`` if there are too many
+    rows for Excel.
+    """
+    content_type = ExcelResponse.content_type
+    file_extension = ExcelResponse.file_extension
+
+    def generate_output(self, data, encoding):
+        output = tempfile.TemporaryFile()
+        try:
+            write_xls(data, encoding, output)
+        except:
+            output.close()
+            raise
+        output.seek(0)
+        return output
@@ -15,7 +15,9 @@ class FormatAdmin(admin.ModelAdmin):
 
 class UploadAdmin(admin.ModelAdmin):
     actions = [admin_action_export_xls]
-    list_display = ('file', 'file_type', 'date_created', 'user_created', 'status')
+    list_display = ('file', 'file_type', 'date_created', 'user_created', 'status',
+                    'rows_processed', 'rows_per_second')
+    readonly_fields = ('rows_processed', 'processing_time')
 
 
 class UploadInstanceAdmin(admin.ModelAdmin):
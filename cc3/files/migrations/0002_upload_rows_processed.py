@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='processing_time',
+            field=models.FloatField(help_text='Seconds taken to process the rows of the file', null=True, verbose_name='Processing time', blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='rows_processed',
+            field=models.PositiveIntegerField(default=0, verbose_name='Rows processed', editable=False),
+        ),
+    ]
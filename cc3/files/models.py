@@ -1,8 +1,9 @@
 import datetime
 import json
 import logging
+from collections import OrderedDict
 
-from cc3.core.utils import UploadTo
+from cc3.core.utils import UploadTo, chunks
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import fields
 from django.db import models
@@ -121,10 +122,21 @@ class Upload(models.Model):
         choices=UPLOAD_STATUS_CHOICES,
         default=UPLOAD_STATUS_CHOICES[0][0]  # 'Uploaded'
     )
+    rows_processed = models.PositiveIntegerField(
+        _(u'Rows processed'), default=0, editable=False)
+    processing_time = models.FloatField(
+        _(u'Processing time'), null=True, blank=True, editable=False,
+        help_text=_(u'Seconds taken to process the rows of the file'))
 
     def __unicode__(self):
         return u"%s (%s - %s)" % (self.file, self.file_type, self.date_created)
 
+    @property
+    def rows_per_second(self):
+        if self.processing_time:
+            return self.rows_processed / self.processing_time
+        return None
+
 
 class UploadInstance(models.Model):
     upload = models.ForeignKey(Upload, editable=False)
@@ -202,10 +214,10 @@ class FileTypeSet(models.Model):
 
         # need pairs (for now) of instances for each entry in the temp tables
         file_types = FileType.objects.filter(filetypeset=self)
-        upload_ids = []
-        upload_instance_ids = []
-        instances = {}
-        rule_results = []
+        upload_ids = set()
+        # ids of the upload instances of each entry in instances
+        upload_instance_ids = OrderedDict()
+        instances = OrderedDict()
 
         # TODO we really need pairs (or sets) of instances, this provides a way but with the true instances
         # TODO may be better to have ids and content types and get instances when processing?
@@ -213,46 +225,44 @@ class FileTypeSet(models.Model):
             instance_identifier = file_type.instance_identifier
 
             # get unprocessed rows for file_type process_model
-            upload_instances = UploadInstance.objects.filter(
+            upload_instances = list(UploadInstance.objects.filter(
                 upload__file_type=file_type,
                 status=UPLOAD_STATUS_CHOICES[0][0]
-            )
+            ))
+            content_objects = get_content_objects(upload_instances)
 
             for upload_instance in upload_instances:
-                upload_id = upload_instance.upload.id
-                if not upload_id in upload_ids:
-                    upload_ids.append(upload_id)
-                upload_instance_ids.append(upload_instance.id)
-                instance = upload_instance.content_object
+                upload_ids.add(upload_instance.upload_id)
+                instance = content_objects.get(
+                    (upload_instance.content_type_id, upload_instance.object_id))
                 if hasattr(instance, instance_identifier):
                     _id = getattr(instance, instance_identifier)
                     # create a list for the key if it doesn't exist
                     if not _id in instances:
                         instances[_id] = []
+                        upload_instance_ids[_id] = []
                     instances[_id].append(instance)
+                    upload_instance_ids[_id].append(upload_instance.id)
+
+        upload_instance_ids = upload_instance_ids.values()
+
+        def mark_processed(index):
+            # mark the upload instances of an entry as processed as soon as
+            # its rules have run, so a failing action later on doesn't make
+            # the next run perform its actions again
+            UploadInstance.objects.filter(
+                pk__in=upload_instance_ids[index]).update(
+                    status=UPLOAD_STATUS_CHOICES[1][0])
+
+        # each value is a row containing content_object values linked by
+        # the instance identifier (key)
+        # RUN THE RULES for the ruleset
+        rule_results = self.ruleset.run_batch(
+            instances.values(), processed=mark_processed)
 
-        for key, value in instances.iteritems():
-            # each value is a row containing content_object values linked by
-            # the instance identifier (key)
-            # RUN THE RULES for the ruleset
-            rule_results.append(self.ruleset.run(value))
-
-            # mark upload instances as processed
-            for val in value:
-                upload_instances = UploadInstance.objects.filter(
-                    upload__id__in=upload_ids,
-                    content_type=ContentType.objects.get_for_model(val),
-                    object_id=val.id
-                )
-                for upload_instance in upload_instances:
-                    upload_instance.status = UPLOAD_STATUS_CHOICES[1][0]
-                    upload_instance.save()
-
-        # mark uploads instances as processed
-        for upload_id in upload_ids:
-            upload = Upload.objects.get(pk=upload_id)
-            upload.status = UPLOAD_STATUS_CHOICES[1][0]
-            upload.save()
+        # mark uploads as processed
+        Upload.objects.filter(pk__in=upload_ids).update(
+            status=UPLOAD_STATUS_CHOICES[1][0])
 
         # store results, so project specific signal can send a report as
         # necessary
@@ -262,6 +272,27 @@ class FileTypeSet(models.Model):
         )
 
 
+def get_content_objects(upload_instances):
+    """
+    Returns the content objects of the upload instances, in a dict by
+    content type id and object id, with one query per content type.
+    """
+    object_ids = {}
+    for upload_instance in upload_instances:
+        object_ids.setdefault(upload_instance.content_type_id, []).append(
+            upload_instance.object_id)
+
+    content_objects = {}
+    for content_type_id, ids in object_ids.items():
+        model_class = ContentType.objects.get_for_id(
+            content_type_id).model_class()
+        for ids_chunk in chunks(ids, 500):
+            objects = model_class._default_manager.in_bulk(ids_chunk)
+            for object_id, content_object in objects.items():
+                content_objects[(content_type_id, object_id)] = content_object
+    return content_objects
+
+
 class FileTypeSetRun(models.Model):
     filetypeset = models.ForeignKey('FileTypeSet')
     rule_results = models.TextField()
@@ -2,3 +2,4 @@ from .test_api import (
     FileServiceUserLoginTests,
     UploadTest
 )
+from .test_utils import CSVImportTestCase
@@ -0,0 +1,146 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from mock import patch
+
+from cc3.cyclos.tests.test_factories import UserFactory
+
+from ..models import FileTypeSet, FileTypeSetRun, Upload, UploadInstance
+from ..utils import CSVImport, BulkInsertMismatch, can_bulk_save
+from .test_factories import FileTypeFactory, UploadFactory
+
+
+class CSVImportTestCase(TestCase):
+    """
+    Test case for importing the rows of CSV files into process models.
+    """
+    def setUp(self):
+        self.filetypeset = FileTypeSet.objects.create(name='Contracts')
+        self.file_type = FileTypeFactory.create(
+            description='Rule results',
+            process_model=ContentType.objects.get_for_model(FileTypeSetRun),
+            instance_identifier='rule_results',
+            allow_duplicates=False,
+            format__description=u'CSV file')
+
+    def _upload(self):
+        # without processing the (absent) file on save
+        with patch('cc3.files.models.process_csv_file'):
+            return UploadFactory.create(
+                file_type=self.file_type, user_created=UserFactory.create(),
+                file='runs.csv')
+
+    def _rows(self, *rule_results):
+        return [{'filetypeset': str(self.filetypeset.pk), 'rule_results': r}
+                for r in rule_results]
+
+    def test_can_bulk_save(self):
+        """
+        Tests that models with business logic in save() are saved one by one.
+        """
+        self.assertTrue(can_bulk_save(FileTypeSetRun))
+        self.assertFalse(can_bulk_save(Upload))
+
+    def test_save_new_and_existing(self):
+        """
+        Tests that rows update the existing instance with their identifier,
+        also if it was created earlier in the same file.
+        """
+        existing = FileTypeSetRun.objects.create(
+            filetypeset=self.filetypeset, rule_results='a')
+        csv_import = CSVImport(None, self.file_type)
+
+        forms, duplicates = csv_import.validate(
+            self._rows('a', 'b', 'c', 'b'))
+        instances = csv_import.save(forms)
+
+        self.assertEqual([i.rule_results for i in instances],
+                         ['a', 'b', 'c', 'b'])
+        self.assertEqual(instances[0].pk, existing.pk)
+        self.assertEqual(instances[1].pk, instances[3].pk)
+        self.assertTrue(all(instance.pk for instance in instances))
+        self.assertEqual(FileTypeSetRun.objects.count(), 3)
+
+    def test_allow_duplicates(self):
+        """
+        Tests that every row is a new instance if duplicates are allowed.
+        """
+        self.file_type.allow_duplicates = True
+        csv_import = CSVImport(None, self.file_type)
+
+        forms, duplicates = csv_import.validate(self._rows('a', 'a'))
+        csv_import.save(forms)
+
+        self.assertEqual(
+            FileTypeSetRun.objects.filter(rule_results='a').count(), 2)
+
+    def test_handle_duplicates(self):
+        """
+        Tests that handle_duplicates is given only the instances which existed
+        before the chunk was saved.
+        """
+        existing = FileTypeSetRun.objects.create(
+            filetypeset=self.filetypeset, rule_results='a')
+        self.file_type.allow_duplicates = True
+        upload = self._upload()
+
+        with patch.object(FileTypeSetRun, 'handle_duplicates',
+                          create=True) as handle_duplicates:
+            csv_import = CSVImport(upload, self.file_type)
+            csv_import.process_chunk(self._rows('a', 'a', 'b'))
+
+        self.assertEqual(handle_duplicates.call_count, 2)
+        for args, kwargs in handle_duplicates.call_args_list:
+            self.assertEqual(list(args[0]), [existing])
+        self.assertEqual(FileTypeSetRun.objects.count(), 4)
+        self.assertEqual(UploadInstance.objects.count(), 3)
+
+    def test_bulk_insert_mismatch(self):
+        """
+        Tests that the rows are saved one by one if the ids of the bulk
+        inserted rows can't be read back.
+        """
+        csv_import = CSVImport(None, self.file_type)
+        forms, duplicates = csv_import.validate(self._rows('a', 'b'))
+
+        with patch.object(CSVImport, 'bulk_insert',
+                          side_effect=BulkInsertMismatch):
+            instances = csv_import.save(forms)
+
+        self.assertTrue(all(instance.pk for instance in instances))
+        self.assertEqual(
+            sorted(FileTypeSetRun.objects.values_list('pk', flat=True)),
+            sorted(instance.pk for instance in instances))
+
+    def test_failing_chunk(self):
+        """
+        Tests that a chunk which fails while saving leaves no rows and no
+        UploadInstance records behind.
+        """
+        FileTypeSetRun.objects.create(
+            filetypeset=self.filetypeset, rule_results='a')
+        upload = self._upload()
+        csv_import = CSVImport(upload, self.file_type)
+
+        with patch.object(UploadInstance.objects, 'bulk_create',
+                          side_effect=Exception('Disk full')):
+            self.assertRaises(Exception, csv_import.process_chunk,
+                              self._rows('a', 'b', 'c'))
+
+        self.assertEqual(
+            list(FileTypeSetRun.objects.values_list('rule_results', flat=True)),
+            ['a'])
+        self.assertEqual(UploadInstance.objects.count(), 0)
+
+    def test_invalid_row(self):
+        """
+        Tests that an invalid row fails the whole chunk before anything is
+        saved.
+        """
+        upload = self._upload()
+        csv_import = CSVImport(upload, self.file_type)
+        rows = self._rows('a') + [{'filetypeset': '', 'rule_results': 'b'}]
+
+        self.assertRaises(Exception, csv_import.process_chunk, rows)
+        self.assertEqual(FileTypeSetRun.objects.count(), 0)
+        self.assertEqual(UploadInstance.objects.count(), 0)
@@ -1,7 +1,14 @@
 import csv
 import codecs
 import logging
-
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models, transaction
+from django.db.models import Max
+from django.db.models.signals import post_save, pre_save
 from django.forms import modelform_factory
 from django.forms.fields import DecimalField, DateField
 from django.utils.translation import ugettext_lazy as _
@@ -11,6 +18,9 @@ from django.utils.translation import ugettext_lazy as _
 
 LOG = logging.getLogger('cc3.marketplace')
 
+# Number of CSV rows validated, and saved in one transaction, at a time
+IMPORT_CHUNK_SIZE = getattr(settings, 'FILES_IMPORT_CHUNK_SIZE', 500)
+
 
 def validate_csv_file(attrs):
     """
@@ -20,9 +30,286 @@ def validate_csv_file(attrs):
     return process_csv_file(attrs, validate_only=True)
 
 
+def get_process_model_form(process_model_class):
+    """
+    Returns a ModelForm class for rows of the process model, with localized
+    decimal fields.
+    """
+    model_fields = process_model_class._meta.get_all_field_names()
+    if 'children' in model_fields:
+        model_fields.remove('children')
+    if 'parent_id' in model_fields:
+        model_fields.remove('parent_id')
+    model_form = modelform_factory(process_model_class, fields=model_fields)
+
+    for field in model_form.base_fields.values():
+        # using type rather than isinstance as exact class match needed
+        if type(field) == DecimalField:
+            field.localize = True
+    return model_form
+
+
+def can_bulk_save(process_model_class):
+    """
+    Returns True if rows of the process model can be written with
+    bulk_create, ie. if there is no business logic in its save() method or
+    save signals, and ids can be read back after inserting.
+    """
+    opts = process_model_class._meta
+    return (
+        process_model_class.save.__func__ is models.Model.save.__func__ and
+        not pre_save.has_listeners(process_model_class) and
+        not post_save.has_listeners(process_model_class) and
+        not opts.parents and not opts.many_to_many and
+        isinstance(opts.pk, models.AutoField))
+
+
+class BulkInsertMismatch(Exception):
+    """The ids of bulk inserted rows could not be read back reliably"""
+
+
+class CSVImport(object):
+    """
+    Validates and saves the rows of a CSV file as instances of the process
+    model of its file type, IMPORT_CHUNK_SIZE rows at a time.
+
+    For each chunk the existing instances are looked up in one query, all
+    rows are validated, and then written in one transaction, in bulk if the
+    process model allows (see ``can_bulk_save``).
+    """
+    def __init__(self, upload, file_type, validate_only=False):
+        self.upload = upload
+        self.process_model = file_type.process_model
+        self.process_model_class = self.process_model.model_class()
+        self.file_type = file_type
+        self.allow_duplicates = file_type.allow_duplicates
+        self.instance_identifier = file_type.instance_identifier
+        self.validate_only = validate_only
+
+        self.model_form = get_process_model_form(self.process_model_class)
+        self.bulk = not validate_only and can_bulk_save(
+            self.process_model_class)
+        self.handle_duplicates = (
+            self.allow_duplicates and self.instance_identifier and
+            hasattr(self.process_model_class, 'handle_duplicates'))
+        if self.allow_duplicates and not hasattr(
+                self.process_model_class, 'handle_duplicates'):
+            LOG.warn(
+                _(u"No handle_duplicate method on process model"
+                  u" class for file upload {0}".format(file_type)))
+
+        try:
+            field = self.process_model_class._meta.get_field(
+                self.instance_identifier)
+            self.identifier_attname = field.attname
+            self.identifier_to_python = field.to_python
+        except FieldDoesNotExist:
+            self.identifier_attname = self.instance_identifier
+            self.identifier_to_python = lambda value: value
+
+    def get_key(self, row):
+        """Returns the instance identifier value of a row, or None"""
+        try:
+            return self.identifier_to_python(row[self.instance_identifier])
+        except (KeyError, ValidationError):
+            return None
+
+    def get_existing_instances(self, keys):
+        """
+        Returns a dict with the first existing instance for each of the
+        instance identifier values in keys.
+        """
+        keys = set(key for key in keys if key is not None)
+        existing_instances = {}
+        if keys:
+            for existing_instance in self.process_model_class.objects.filter(
+                    **{'{0}__in'.format(self.instance_identifier): keys}):
+                existing_instances.setdefault(
+                    getattr(existing_instance, self.identifier_attname),
+                    existing_instance)
+        return existing_instances
+
+    def get_duplicates(self, keys):
+        """
+        Returns a dict with the ids of all existing instances for each of the
+        instance identifier values in keys, for ``handle_duplicates``.
+        """
+        keys = set(key for key in keys if key is not None)
+        duplicates = {}
+        if keys:
+            for pk, key in self.process_model_class.objects.filter(
+                    **{'{0}__in'.format(self.instance_identifier): keys}
+            ).values_list('pk', self.identifier_attname):
+                duplicates.setdefault(key, []).append(pk)
+        return duplicates
+
+    def validate(self, rows):
+        """
+        Returns a bound and valid form for each row, and the ids of the
+        instances which existed before the rows were written, by instance
+        identifier (if duplicates are handled). Rows which identify the same
+        instance share it, unless duplicates are allowed.
+        """
+        keys = [self.get_key(row) for row in rows]
+        existing_instances = {}
+        duplicates = {}
+        if not self.allow_duplicates:
+            existing_instances = self.get_existing_instances(keys)
+        elif self.handle_duplicates:
+            duplicates = self.get_duplicates(keys)
+
+        forms = []
+        for row, key in zip(rows, keys):
+            process_model_instance = existing_instances.get(key)
+            model_form_instance = self.model_form(
+                instance=process_model_instance, data=row)
+            if not model_form_instance.is_valid():
+                raise Exception(model_form_instance.errors)
+            if not self.allow_duplicates and key is not None:
+                # later rows in the file update the same instance
+                existing_instances[key] = model_form_instance.instance
+            forms.append(model_form_instance)
+        return forms, duplicates
+
+    def save(self, forms):
+        """Saves the forms, returns the instance of each"""
+        if not self.bulk:
+            return [model_form_instance.save() for model_form_instance in forms]
+
+        new_instances = []
+        updated_instances = []
+        seen = set()
+        for model_form_instance in forms:
+            new_instance = model_form_instance.save(commit=False)
+            if id(new_instance) in seen:
+                continue
+            seen.add(id(new_instance))
+            if new_instance.pk:
+                updated_instances.append(new_instance)
+            else:
+                new_instances.append(new_instance)
+
+        # Django has no bulk update, so existing instances are saved one by
+        # one (still in the transaction of the chunk)
+        for updated_instance in updated_instances:
+            updated_instance.save()
+
+        if new_instances:
+            try:
+                with transaction.atomic():
+                    self.bulk_insert(new_instances)
+            except BulkInsertMismatch, e:
+                # rolled back to before the insert
+                LOG.warn(u"Saving rows one by one: {0}".format(e))
+                for new_instance in new_instances:
+                    new_instance.pk = None
+                    new_instance.save()
+
+        return [model_form_instance.instance for model_form_instance in forms]
+
+    def bulk_insert(self, new_instances):
+        """
+        Inserts the new instances with bulk_create, and sets their ids.
+
+        bulk_create doesn't set the ids (on MySQL), so they are read back:
+        the rows inserted after the highest id so far, matched to the new
+        instances by instance identifier, in order. Other imports into the
+        process model wait for the transaction (they lock the same content
+        type row); raises ``BulkInsertMismatch`` if other rows were inserted
+        meanwhile anyway.
+        """
+        # importing here, to avoid circular import
+        from django.contrib.contenttypes.models import ContentType
+
+        list(ContentType.objects.select_for_update().filter(
+            pk=self.process_model.pk))
+
+        objects = self.process_model_class.objects
+        max_pk = objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        objects.bulk_create(new_instances)
+        if new_instances[0].pk is not None:
+            return
+
+        def get_key(instance):
+            if not self.instance_identifier:
+                return None
+            return getattr(instance, self.identifier_attname)
+
+        new_instances_by_key = {}
+        for new_instance in new_instances:
+            new_instances_by_key.setdefault(
+                get_key(new_instance), []).append(new_instance)
+
+        inserted = objects.filter(pk__gt=max_pk).order_by('pk')
+        if self.instance_identifier:
+            inserted = inserted.filter(**{'{0}__in'.format(
+                self.instance_identifier): new_instances_by_key.keys()})
+            pks_by_key = {}
+            for pk, key in inserted.values_list('pk', self.identifier_attname):
+                pks_by_key.setdefault(key, []).append(pk)
+        else:
+            pks_by_key = {None: list(inserted.values_list('pk', flat=True))}
+
+        for key, instances in new_instances_by_key.items():
+            pks = pks_by_key.get(key, [])
+            if len(pks) != len(instances):
+                raise BulkInsertMismatch(
+                    u"{0} rows inserted for {1}, {2} expected".format(
+                        len(pks), key, len(instances)))
+            for new_instance, pk in zip(instances, pks):
+                new_instance.pk = pk
+
+    def process_chunk(self, rows):
+        """Validates and (unless validating only) saves a chunk of rows"""
+        # importing here, to avoid circular import
+        from .models import UploadInstance
+
+        forms, duplicates = self.validate(rows)
+        if self.validate_only:
+            return
+
+        with transaction.atomic():
+            new_instances = [
+                new_instance for new_instance in self.save(forms)
+                # if a new_instance has saved (depending on overrides of
+                # model save() methods with business logic)
+                if new_instance.id]
+
+            if self.handle_duplicates:
+                for new_instance in new_instances:
+                    # the instances which existed before this chunk
+                    duplicate_pks = duplicates.get(
+                        getattr(new_instance, self.identifier_attname))
+                    if duplicate_pks:
+                        try:
+                            new_instance.handle_duplicates(
+                                self.process_model_class.objects.filter(
+                                    pk__in=duplicate_pks))
+                        except Exception, e:
+                            LOG.warn(u"handle_duplicates failed for {0}: "
+                                     u"{1}".format(new_instance, e))
+
+            UploadInstance.objects.bulk_create([
+                UploadInstance(
+                    upload=self.upload,
+                    content_type=self.process_model,
+                    object_id=new_instance.id
+                ) for new_instance in new_instances])
+
+    def run(self, csv_reader):
+        """Processes all rows of csv_reader, returns the number of rows"""
+        rows_processed = 0
+        while True:
+            rows = list(islice(csv_reader, IMPORT_CHUNK_SIZE))
+            if not rows:
+                return rows_processed
+            self.process_chunk(rows)
+            rows_processed += len(rows)
+
+
 def process_csv_file(instance, validate_only=False):
     # importing here, to avoid circular import
-    from .models import UploadInstance
+    from .models import Upload
 
     # instance can be a dict (from serializer) or model instance
     if hasattr(instance, 'file'):
@@ -45,80 +332,25 @@ def process_csv_file(instance, validate_only=False):
     process_model = file_type.process_model
 
     if process_model:
-
-        # dynamically make a ModelForm for the file_type process_model
-        process_model_class = process_model.model_class()
+        started = time.time()
 
         if file_type.clear_before_process:
             # clear
-            process_model_class.objects.all().delete()
-
-        allow_duplicates = file_type.allow_duplicates
-        instance_identifier = file_type.instance_identifier
-
-        for row in csv_reader:
-            # process row of csv file
-            process_model_instance = existing_model_instances = None
-            model_fields = process_model_class._meta.get_all_field_names()
-            if 'children' in model_fields:
-                model_fields.remove('children')
-            if 'parent_id' in model_fields:
-                model_fields.remove('parent_id')
-            model_form = modelform_factory(
-                process_model_class, fields=model_fields)
-
-            # try and identify existing instance
-            try:
-                kwargs = {instance_identifier: row[instance_identifier]}
-                LOG.debug(u"Looking for {0}: {1}".format(
-                    instance_identifier, kwargs[instance_identifier]))
-                existing_model_instances = \
-                    process_model.model_class().objects.filter(**kwargs)
-            except Exception, e:
-                LOG.debug(u"No existing_model_instance for {0} [{1}]".format(
-                    kwargs, e))
-                pass
-
-            if not allow_duplicates and existing_model_instances.count() > 0:
-                # in theory should only ever been zero / one existing instance
-                # if no duplicates allowed!
-                process_model_instance = existing_model_instances[0]
-
-            model_form_instance = model_form(
-                instance=process_model_instance, data=row)
-
-            for _field in model_form_instance.fields:
-                # using type rather than isinstance as exact class match needed
-                if type(model_form_instance.fields[_field]) == DecimalField:
-                    localized_field = model_form_instance.fields[_field]
-                    localized_field.localize = True
-                    model_form_instance.field = localized_field
-            if model_form_instance.is_valid() and not validate_only:
-                new_instance = model_form_instance.save()
-
-                # if a new_instance has saved (depending on overrides of model
-                # save() methods with business logic)
-                if new_instance.id:
-                    if allow_duplicates and \
-                                    existing_model_instances.count() > 0:
-                        try:
-                            new_instance.handle_duplicates(
-                                existing_model_instances)
-                        except Exception:
-                            LOG.warn(
-                                _(u"No handle_duplicate method on process model"
-                                  u" class for file upload {0}".format(
-                                    file_type)))
-                            pass
-
-                    UploadInstance.objects.create(
-                        upload=instance,
-                        content_type=process_model,
-                        object_id=new_instance.id
-                    )
-            else:
-                if model_form_instance.errors:
-                    raise Exception(model_form_instance.errors)
+            process_model.model_class().objects.all().delete()
+
+        rows_processed = CSVImport(
+            instance, file_type, validate_only=validate_only).run(csv_reader)
+
+        if not validate_only and isinstance(instance, Upload):
+            instance.rows_processed = rows_processed
+            instance.processing_time = time.time() - started
+            # update rather than save, this runs from the post_save signal
+            Upload.objects.filter(pk=instance.pk).update(
+                rows_processed=instance.rows_processed,
+                processing_time=instance.processing_time)
+            LOG.info(u"Processed {0} rows of file upload {1} ({2:.1f} "
+                     u"rows/s)".format(rows_processed, file_type,
+                                       instance.rows_per_second or 0))
     else:
         LOG.info(_(u"No process model class for file upload {0}".format(
             file_type)))
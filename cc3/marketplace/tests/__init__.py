@@ -3,3 +3,4 @@ from .test_translations import (
     CategoryTranslationTestCase, AdPricingOptionTranslationTestCase)
 from .test_pricing import AdDetailTestCase, AdPricingTestCase
 from .test_views import MarketplaceAdUpdateViewTestCase
+from .test_utils import BusinessListTestCase
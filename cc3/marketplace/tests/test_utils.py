@@ -0,0 +1,51 @@
+from django.test import TestCase
+
+from mock import MagicMock
+
+from ..utils import BusinessList
+
+
+class BusinessListTestCase(TestCase):
+    """
+    Test case for the lazy ``BusinessList`` of the marketplace businesses tab.
+    """
+    def setUp(self):
+        self.cc3_profiles = [
+            MagicMock(business_name='Business {0}'.format(i), offers=i,
+                      wants=0, cyclos_group=None)
+            for i in range(30)]
+        self.queryset = MagicMock()
+        self.queryset.count.return_value = len(self.cc3_profiles)
+        self.queryset.__getitem__.side_effect = self.cc3_profiles.__getitem__
+        self.queryset.__iter__.side_effect = lambda: iter(self.cc3_profiles)
+        self.businesses = BusinessList(self.queryset)
+
+    def test_count_once(self):
+        """
+        Tests that the count is queried once, and reused for ``len`` and
+        truth testing.
+        """
+        self.assertTrue(self.businesses)
+        self.assertEqual(len(self.businesses), 30)
+        self.assertEqual(self.businesses.count(), 30)
+        self.assertEqual(self.queryset.count.call_count, 1)
+
+    def test_slice(self):
+        """
+        Tests that a slice only converts the requested businesses.
+        """
+        businesses = self.businesses[12:24]
+
+        self.assertEqual(len(businesses), 12)
+        self.assertEqual(businesses[0]['business_name'], 'Business 12')
+        self.assertEqual(businesses[0]['offers'], 12)
+        self.assertEqual(businesses[0]['group_name'], '')
+        self.assertIs(businesses[0]['cc3_profile'], self.cc3_profiles[12])
+        self.queryset.__getitem__.assert_called_once_with(slice(12, 24, None))
+
+    def test_iterate(self):
+        """
+        Tests that iterating yields all businesses.
+        """
+        self.assertEqual(
+            [business['offers'] for business in self.businesses], range(30))
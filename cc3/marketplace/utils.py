@@ -68,6 +68,51 @@ class QuerySetChain(object):
             res.extend(qs.values_list(*args, **kwargs))
         return res
 
+
+class BusinessList(object):
+    """
+    Lazy list of business dictionaries for a queryset of CC3Profiles with
+    ``offers`` and ``wants`` counts, as shown on the businesses tab of the
+    marketplace. Supports the methods needed for use with
+    django.core.paginator, so only the requested page is fetched.
+    """
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.queryset.count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __nonzero__(self):
+        return self.count() > 0
+
+    def _as_business(self, cc3_profile):
+        return {
+            'business_name': cc3_profile.business_name,
+            'offers': cc3_profile.offers,
+            'wants': cc3_profile.wants,
+            'cc3_profile': cc3_profile,
+            'group_name':
+                cc3_profile.cyclos_group and
+                cc3_profile.cyclos_group.name or ''
+        }
+
+    def __iter__(self):
+        return (self._as_business(cc3_profile)
+                for cc3_profile in self.queryset)
+
+    def __getitem__(self, ndx):
+        if type(ndx) is slice:
+            return [self._as_business(cc3_profile)
+                    for cc3_profile in self.queryset[ndx]]
+        return self._as_business(self.queryset[ndx])
+
+
 def user_can_own_campaigns(user):
     owner_groups = getattr(settings, 'CYCLOS_CAMPAIGN_OWNER_GROUPS', ())
     cc3_profile = user.get_cc3_profile()
@@ -5,6 +5,7 @@ import logging
 import operator
 import re
 import string
+from collections import OrderedDict
 from functools import reduce
 
 from django.contrib import messages
@@ -47,7 +48,8 @@ from .models import (
     CAMPAIGN_STATUS_HIDDEN
     )
 from .utils import (
-    QuerySetChain, user_can_join_campaigns, user_can_own_campaigns)
+    BusinessList, QuerySetChain, user_can_join_campaigns,
+    user_can_own_campaigns)
 
 from cc3.cyclos.utils import is_consumer_member
 
@@ -55,6 +57,14 @@ tokenize_regex = re.compile(r'[%s\s]+' % re.escape(string.punctuation))
 
 LOG = logging.getLogger(__name__)
 
+# Number of ads of a business with the given status and adtype code
+ACTIVE_ADS_COUNT_SQL = u"""SELECT COUNT(*) FROM {ad}
+    INNER JOIN {adtype} ON {ad}.adtype_id = {adtype}.id
+    WHERE {ad}.created_by_id = {cc3_profile}.id
+    AND {ad}.status = %s AND UPPER({adtype}.code) = %s""".format(
+    ad=Ad._meta.db_table, adtype=AdType._meta.db_table,
+    cc3_profile=CC3Profile._meta.db_table)
+
 
 class MarketplaceAdCreateView(CreateView):
     form_class = AdForm
@@ -457,19 +467,15 @@ class BusinessView(CommunityNoFilterMixin, ListView):
         Given a queryset of businesses, apply the selected categories,
         community and adtype filters from the marketplace-filter form.
 
-        Returns a tuple of sorted business dictionaries, containing the
-        business name, number of offers, number of wants and a reference
-        to the CC3Profile for the business.
+        Returns a lazy ``BusinessList`` of business dictionaries, sorted by
+        name, containing the business name, number of offers, number of
+        wants and a reference to the CC3Profile for the business. Counting,
+        sorting and filtering is done in the database, so only the
+        requested page of businesses is fetched.
 
         Note that the sorting of the businesses depends on
         settings.MARKETPLACE_SORT_MY_COMMUNITY_FIRST
         """
-        from operator import itemgetter
-
-        unsorted_my_community_businesses = []
-        unsorted_businesses = []
-        users_checked = []
-
         # get users profile and community early on (if authenticated),
         # rather than in loop that looks at every business (see later in view)
         my_cc3_profile = my_cc3_profile_community = None
@@ -534,58 +540,44 @@ class BusinessView(CommunityNoFilterMixin, ListView):
                 CC3Community.MEMBERS_FIRST:
             my_community_first = True
 
-        # collect info on a businesses adverts, and arrange by community
-        # (if community_view setting makes this necessary)
-        for cc3_profile in businesses:
-            if cc3_profile and cc3_profile.id and cc3_profile.id not in \
-                    users_checked:
-                if cc3_profile.business_name != '' and cc3_profile.slug != '':
-                    business = {
-                        'business_name': cc3_profile.business_name,
-                        'offers': Ad.objects.filter(
-                            created_by=cc3_profile,
-                            adtype__code__iexact='o',
-                            status=AD_STATUS_ACTIVE).count(),
-                        'wants': Ad.objects.filter(
-                            created_by=cc3_profile,
-                            adtype__code__iexact='w',
-                            status=AD_STATUS_ACTIVE).count(),
-                        'cc3_profile': cc3_profile,
-                        'group_name':
-                            cc3_profile.cyclos_group and
-                            cc3_profile.cyclos_group.name or ''
-                    }
-
-                    if my_community_first and my_cc3_profile and \
-                            my_cc3_profile_community == cc3_profile.community:
-                        unsorted_my_community_businesses.append(business)
-                    else:
-                        unsorted_businesses.append(business)
-                if cc3_profile:
-                    users_checked.append(cc3_profile.id)
-
-        # recombine lists and sort by business name
-        businesses = (
-            sorted(unsorted_my_community_businesses,
-                   key=itemgetter('business_name')) +
-            sorted(unsorted_businesses, key=itemgetter('business_name'))
-        )
+        businesses = businesses.exclude(business_name='').exclude(slug='')
 
         if getattr(
                 settings, "MARKETPLACE_INDIVIDUALS_HIDE_IF_NO_ADVERTS", False):
-
+            # only show individuals with active offers or wants
             customer_member_groups = getattr(
                         settings, 'CYCLOS_CUSTOMER_MEMBER_GROUPS', [])
-            reduced_businesses = []
-            for business in businesses:
-                if business['group_name'] in customer_member_groups:
-                    if business['offers'] != 0 or business['wants'] != 0:
-                        reduced_businesses.append(business)
-                else:
-                    reduced_businesses.append(business)
-            businesses = reduced_businesses
-
-        return businesses
+            advertisers = Ad.objects.filter(
+                models.Q(adtype__code__iexact='o') |
+                models.Q(adtype__code__iexact='w'),
+                status=AD_STATUS_ACTIVE).values('created_by')
+            businesses = businesses.filter(
+                models.Q(cyclos_group__isnull=True) |
+                ~models.Q(cyclos_group__name__in=customer_member_groups) |
+                models.Q(pk__in=advertisers))
+
+        # count the active offers and wants of each business in subqueries
+        select = OrderedDict((
+            ('offers', ACTIVE_ADS_COUNT_SQL),
+            ('wants', ACTIVE_ADS_COUNT_SQL),
+        ))
+        select_params = [AD_STATUS_ACTIVE, 'O', AD_STATUS_ACTIVE, 'W']
+        order_by = ['business_name']
+
+        # arrange by community (if community_view setting makes this
+        # necessary)
+        if my_community_first and my_cc3_profile:
+            select['in_my_community'] = u'{0}.community_id = %s'.format(
+                CC3Profile._meta.db_table)
+            select_params.append(my_cc3_profile_community.pk)
+            order_by.insert(0, '-in_my_community')
+
+        businesses = businesses.select_related(
+            'cyclos_group', 'community').extra(
+                select=select, select_params=select_params).order_by(
+                    *order_by)
+
+        return BusinessList(businesses)
 
     def get(self, request, *args, **kwargs):
         search_form = MarketplaceSearchForm(request.GET)
@@ -65,13 +65,11 @@ class Command(BaseCommand):
                     tickets_purchased = buy_tickets(data, purchaser, draw)
 
                     # record the purchases
-                    for ticket in tickets_purchased:
-                        repeat_ticket_purchase = \
-                            RepeatPurchaseTicket.objects.create(
-                                recurring_purchase=repeat_purchase,
-                                ticket=ticket
-                            )
-                        repeat_ticket_purchase.save()
+                    RepeatPurchaseTicket.objects.bulk_create([
+                        RepeatPurchaseTicket(
+                            recurring_purchase=repeat_purchase,
+                            ticket=ticket)
+                        for ticket in tickets_purchased])
 
             except Exception, e:
                 logger.error(u"Repeat Purchase failed {0}".format(e))
@@ -3,7 +3,7 @@ import logging
 from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
-from django.db import models, IntegrityError
+from django.db import models, transaction, IntegrityError
 from django.db.models import Max, Min
 from django.utils import timezone
 from django.utils.translation import ugettext, ugettext_lazy as _, get_language
@@ -24,6 +24,8 @@ DRAW_STATUS_COMPLETE = ugettext('Ended, winners paid')
 
 MAX_TICKETS_PER_DRAW = 1000000
 MAX_DRAW_NUMBER = 99
+# Number of times a purchase tries to allocate a free range of ticket numbers
+TICKET_ALLOCATION_ATTEMPTS = 5
 
 
 class Draw(models.Model):
@@ -191,11 +193,11 @@ class Draw(models.Model):
         return self.max_tickets_per_person - existing_tickets
 
     def get_next_ticket_number(self):
-        try:
-            return self.tickets.order_by(
-                '-serial_number')[0].serial_number + 1
-        except IndexError:
+        max_serial_number = self.tickets.aggregate(
+            Max('serial_number'))['serial_number__max']
+        if max_serial_number is None:
             return 0
+        return max_serial_number + 1
 
     def get_new_ticket(self, user, transfer_id, when_purchased=None,
                        bulk_purchase_override=False):
@@ -205,40 +207,85 @@ class Draw(models.Model):
 
         Raises TicketException if unable to create ticket
         """
+        return self.get_new_tickets(
+            user, transfer_id, 1, when_purchased=when_purchased,
+            bulk_purchase_override=bulk_purchase_override)[0]
+
+    def get_new_tickets(self, user, transfer_id, num_tickets,
+                        when_purchased=None, bulk_purchase_override=False):
+        """Create num_tickets new tickets and assign them to user
+
+        The serial numbers are allocated as one range, while the draw row is
+        locked, so concurrent purchases wait for each other instead of
+        trying serial numbers until one is free. Either all tickets are
+        created, or none.
+
+        when_purchased defaults to 'now'
+
+        Raises TicketException if unable to create the tickets
+        """
         if not self.status == DRAW_STATUS_IN_PROGRESS:
             msg = ugettext(
                 u"Tickets are not on currently sale for this draw")
             raise TicketException(msg)
+        if num_tickets <= 0:
+            return []
+
+        if not when_purchased:
+            when_purchased = timezone.now()
+        for attempt in xrange(TICKET_ALLOCATION_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return self._allocate_tickets(
+                        user, transfer_id, num_tickets, when_purchased,
+                        bulk_purchase_override)
+            except IntegrityError:
+                # only where the database can't lock the draw row
+                LOG.warning(u"Prize draw ticket numbers taken, retrying")
+        msg = ugettext(u"Unable to allocate tickets for this draw")
+        raise TicketException(msg)
+
+    def _allocate_tickets(self, user, transfer_id, num_tickets,
+                          when_purchased, bulk_purchase_override):
+        # serializes the allocations of this draw
+        list(Draw.objects.select_for_update().filter(
+            pk=self.pk).values_list('pk', flat=True))
 
         if bulk_purchase_override:
             # do not validate max number of tickets per person for bulk
             # 2433 Django Admin: override ticket limit for businesses
             pass
         else:
-            if (self.tickets.filter(
-                    purchased_by=user).count() >= self.max_tickets_per_person):
+            if (self.tickets.filter(purchased_by=user).count() + num_tickets >
+                    self.max_tickets_per_person):
                 msg = ugettext(u"You have already bought the maximum allowed "
                                u"number of tickets")
                 raise TicketException(msg)
-        if not when_purchased:
-            when_purchased = timezone.now()
-        while True:
-            serial_number = self.get_next_ticket_number()
-            if serial_number >= MAX_TICKETS_PER_DRAW:
-                msg = ugettext(u"No more tickets are available for this draw")
-                raise TicketException(msg)
-            try:
-                ticket = Ticket.objects.create(
-                    draw=self,
-                    serial_number=serial_number,
-                    purchased_by=user,
-                    purchase_transfer_id=transfer_id,
-                    when_purchased=when_purchased)
-                LOG.info(u"Assigned prize draw ticket {0} to user {1}".format(
-                         ticket, user))
-                return ticket
-            except IntegrityError:
-                continue
+
+        first_serial_number = self.get_next_ticket_number()
+        end_serial_number = first_serial_number + num_tickets
+        if end_serial_number > MAX_TICKETS_PER_DRAW:
+            msg = ugettext(u"No more tickets are available for this draw")
+            raise TicketException(msg)
+
+        Ticket.objects.bulk_create([
+            Ticket(
+                draw=self,
+                serial_number=serial_number,
+                purchased_by=user,
+                purchase_transfer_id=transfer_id,
+                when_purchased=when_purchased)
+            for serial_number in xrange(
+                first_serial_number, end_serial_number)])
+        # bulk_create doesn't set the ids (on MySQL), so read them back
+        tickets = list(self.tickets.filter(
+            serial_number__gte=first_serial_number,
+            serial_number__lt=end_serial_number).order_by('serial_number'))
+        for ticket in tickets:
+            ticket.draw = self
+        LOG.info(u"Assigned prize draw tickets {0} to {1} to user {2}".format(
+            tickets[0], tickets[-1], user))
+        return tickets
 
     def active_days(self):
         """ Return the number of days remaining before the draw """
@@ -509,12 +556,9 @@ class BulkPurchase(models.Model):
         if tickets_purchased:
 
             # record the purchases
-            for ticket in tickets_purchased:
-                bulk_ticket_purchase = BulkPurchaseTicket.objects.create(
-                    bulk_purchase=self,
-                    ticket=ticket
-                )
-                bulk_ticket_purchase.save()
+            BulkPurchaseTicket.objects.bulk_create([
+                BulkPurchaseTicket(bulk_purchase=self, ticket=ticket)
+                for ticket in tickets_purchased])
 
             # notify the business
             try:
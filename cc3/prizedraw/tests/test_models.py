@@ -133,6 +133,31 @@ class DrawTestCase(TestCase):
         t = d.get_new_ticket(user=self.punter, transfer_id=997)
         self.assertEqual(d.max_tickets_user_can_buy(self.punter), 7)
 
+    def test_get_new_tickets(self):
+        d = self._get_in_progress_draw()
+        d.get_new_ticket(user=self.admin, transfer_id=999)
+        tickets = d.get_new_tickets(
+            user=self.punter, transfer_id=998, num_tickets=5)
+        self.assertEqual([t.serial_number for t in tickets], [1, 2, 3, 4, 5])
+        self.assertTrue(all(t.pk for t in tickets))
+        self.assertEqual(d.tickets_sold, 6)
+
+    def test_get_new_tickets_over_max_per_person(self):
+        d = self._get_in_progress_draw()
+        d.get_new_tickets(user=self.punter, transfer_id=999, num_tickets=8)
+        self.assertRaisesMessage(
+            TicketException,
+            _(u'You have already bought the maximum allowed number of '
+              u'tickets'),
+            d.get_new_tickets,
+            user=self.punter, transfer_id=998, num_tickets=3)
+        # none of them allocated
+        self.assertEqual(d.tickets_sold, 8)
+        tickets = d.get_new_tickets(
+            user=self.punter, transfer_id=997, num_tickets=3,
+            bulk_purchase_override=True)
+        self.assertEqual(len(tickets), 3)
+
     def test_prizes_awarded_true(self):
         d = self._get_in_progress_draw()
         p = Prize.objects.create(draw=d, name='Test', absolute_amount=100)
@@ -218,34 +218,32 @@ def buy_tickets(data, sender, draw, request=None, bulk_purchase_override=False):
                             message, fail_silently=True)
 
     if payment_made:
-        tickets_purchased = []
         # create and allocate tickets for user
-        for i in range(0, num_tickets):
-            try:
-                tickets_purchased.append(draw.get_new_ticket(
-                    user=sender,
-                    transfer_id=transaction.transfer_id,
-                    when_purchased=transaction.created,
-                    bulk_purchase_override=bulk_purchase_override
-                ))
-            except Exception, e:
-                # Mail admins because payment taken but not
-                # all tickets allocated
-                admin_message = \
-                    u'Direct payment made for draw ticket(s) but failed ' \
-                    u'to allocate Ticket(s). The reason was:\n\n'  \
-                    '"{1}"\n\n'  \
-                    'Amount paid: {2}\n' \
-                    'Number of tickets allocated: {3} of {4}\n' \
-                    'Transfer id: {0}'.format(
-                        transaction.transfer_id, e, amount, i, num_tickets)
-                mail_admins(u'Failed to allocate draw ticket(s)',
-                            admin_message, fail_silently=True)
-
-                error_message = _("Failed to buy ticket: {0}".format(e))
-                if request:
-                    messages.error(request, error_message)
-                return
+        try:
+            tickets_purchased = draw.get_new_tickets(
+                user=sender,
+                transfer_id=transaction.transfer_id,
+                num_tickets=num_tickets,
+                when_purchased=transaction.created,
+                bulk_purchase_override=bulk_purchase_override
+            )
+        except Exception, e:
+            # Mail admins because payment taken but no tickets allocated
+            admin_message = \
+                u'Direct payment made for draw ticket(s) but failed ' \
+                u'to allocate Ticket(s). The reason was:\n\n'  \
+                '"{1}"\n\n'  \
+                'Amount paid: {2}\n' \
+                'Number of tickets allocated: 0 of {3}\n' \
+                'Transfer id: {0}'.format(
+                    transaction.transfer_id, e, amount, num_tickets)
+            mail_admins(u'Failed to allocate draw ticket(s)',
+                        admin_message, fail_silently=True)
+
+            error_message = _("Failed to buy ticket: {0}".format(e))
+            if request:
+                messages.error(request, error_message)
+            return
         if request:
             messages.success(request, _(
                 u"{0} tickets bought ".format(num_tickets)))
@@ -263,12 +261,10 @@ def setup_repeat_purchase(data, tickets_purchased, user, request=None):
     )
     repeat_purchase.save()
     if tickets_purchased:
-        for ticket in tickets_purchased:
-            repeat_ticket_purchase = RepeatPurchaseTicket.objects.create(
-                recurring_purchase=repeat_purchase,
-                ticket=ticket
-            )
-            repeat_ticket_purchase.save()
+        RepeatPurchaseTicket.objects.bulk_create([
+            RepeatPurchaseTicket(recurring_purchase=repeat_purchase,
+                                 ticket=ticket)
+            for ticket in tickets_purchased])
 
     if request:
         messages.add_message(
@@ -86,31 +86,30 @@ class CardPrizeDrawPaymentView(CardTransactionView):
         transaction = data['transaction']
 
         # create and allocate tickets for user
-        for i in range(0, num_tickets):
-            try:
-                self.draw.get_new_ticket(
-                    user=transaction.sender,
-                    transfer_id=transaction.transfer_id,
-                    when_purchased=transaction.date_created
-                )
-            except Exception, e:
-                # Mail admins because payment taken but not
-                # all tickets allocated
-                admin_message = u'Direct payment made for draw ticket(s) but ' \
-                                u'failed to allocate Ticket(s). The reason ' \
-                                u'was:\n\n' \
-                                u'"{1}"\n\n' \
-                                u'Amount paid: {2}\n' \
-                                u'Number of tickets allocated: {3} of {4}\n' \
-                                u'Transfer id: {0}'.format(
-                                    transaction.transfer_id, e,
-                                    transaction.amount, i, num_tickets)
-                mail_admins(u'Failed to allocate draw ticket(s)',
-                            admin_message, fail_silently=True)
-
-                error_message = _("Failed to buy ticket: {0}".format(e))
-                return Response({'detail': error_message},
-                                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            self.draw.get_new_tickets(
+                user=transaction.sender,
+                transfer_id=transaction.transfer_id,
+                num_tickets=num_tickets,
+                when_purchased=transaction.date_created
+            )
+        except Exception, e:
+            # Mail admins because payment taken but no tickets allocated
+            admin_message = u'Direct payment made for draw ticket(s) but ' \
+                            u'failed to allocate Ticket(s). The reason ' \
+                            u'was:\n\n' \
+                            u'"{1}"\n\n' \
+                            u'Amount paid: {2}\n' \
+                            u'Number of tickets allocated: 0 of {3}\n' \
+                            u'Transfer id: {0}'.format(
+                                transaction.transfer_id, e,
+                                transaction.amount, num_tickets)
+            mail_admins(u'Failed to allocate draw ticket(s)',
+                        admin_message, fail_silently=True)
+
+            error_message = _("Failed to buy ticket: {0}".format(e))
+            return Response({'detail': error_message},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         return transaction
 
@@ -8,7 +8,8 @@ from django.utils.translation import ugettext_lazy as _
 from cc3.cyclos.models import CyclosGroup, User
 
 from .forms import BusinessCauseSettingsModelForm
-from .models import BusinessCauseSettings, UserCause, DefaultGoodCause
+from .models import (BusinessCauseSettings, UserCause, DefaultGoodCause,
+                     RewardPayoutJob, RewardPayoutRow)
 
 LOG = logging.getLogger(__name__)
 
@@ -172,6 +173,27 @@ class DefaultGoodCauseAdmin(admin.ModelAdmin):
             db_field, request, **kwargs)
 
 
+class RewardPayoutJobAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'sender', 'status', 'created', 'started',
+                    'finished')
+    list_filter = ('status',)
+    raw_id_fields = ('sender',)
+    readonly_fields = ('status', 'created', 'started', 'finished',
+                       'heartbeat')
+
+
+class RewardPayoutRowAdmin(admin.ModelAdmin):
+    list_display = ('job', 'row_number', 'payee', 'amount', 'status',
+                    'transfer_id', 'processed')
+    list_filter = ('status',)
+    search_fields = ('payee__email', 'idempotency_key')
+    raw_id_fields = ('job', 'payee')
+    readonly_fields = ('idempotency_key', 'transfer_id',
+                       'donation_transfer_id', 'error', 'processed')
+
+
 admin.site.register(BusinessCauseSettings, BusinessCauseSettingsAdmin)
 admin.site.register(UserCause, UserCauseAdmin)
 admin.site.register(DefaultGoodCause, DefaultGoodCauseAdmin)
+admin.site.register(RewardPayoutJob, RewardPayoutJobAdmin)
+admin.site.register(RewardPayoutRow, RewardPayoutRowAdmin)
@@ -0,0 +1,51 @@
+import logging
+import sys
+
+from django.core.management.base import BaseCommand
+
+from cc3.rewards.models import (
+    RewardPayoutJob, PAYOUT_JOB_PENDING, PAYOUT_JOB_RUNNING)
+from cc3.rewards.payouts import run_payout_job
+
+LOG = logging.getLogger('management_commands')
+
+
+class Command(BaseCommand):
+
+    """Pay the rewards of pending and stopped reward payout jobs"""
+
+    help = ('Run the reward payout jobs which did not start, or stopped '
+            'before they were done. Schedule this to run regularly (e.g. '
+            'every few minutes).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--job', type=int, dest='job',
+            help='Only run this payout job (id)')
+        parser.add_argument(
+            '--workers', type=int, dest='workers',
+            help='Number of concurrent payments (default: the '
+                 'REWARDS_PAYOUT_WORKERS setting)')
+
+    def handle(self, *args, **options):
+        jobs = RewardPayoutJob.objects.filter(
+            status__in=(PAYOUT_JOB_PENDING, PAYOUT_JOB_RUNNING)).order_by(
+                'created')
+        if options['job']:
+            jobs = jobs.filter(pk=options['job'])
+
+        run = 0
+        for job in jobs:
+            try:
+                processed = run_payout_job(job, workers=options['workers'])
+            except Exception:
+                LOG.error(u"Reward payout job {0} stopped".format(job.pk),
+                          exc_info=sys.exc_info())
+                continue
+            # None if the job is running elsewhere
+            if processed is not None:
+                run += 1
+                self.stdout.write(u'Payout job {0}: {1} rows processed'.format(
+                    job.pk, processed))
+
+        self.stdout.write(u'Ran {0} reward payout jobs'.format(run))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cyclos', '0003_auto_20160609_1610'),
+        ('rewards', '0004_auto_20161026_1347'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardPayoutJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('filename', models.CharField(max_length=255, verbose_name='file name', blank=True)),
+                ('fixed_donation_percentage', models.IntegerField(null=True, verbose_name='good causes donation percentage', blank=True)),
+                ('status', models.CharField(default='pending', max_length=10, verbose_name='status', choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done')])),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('started', models.DateTimeField(null=True, verbose_name='started', blank=True)),
+                ('finished', models.DateTimeField(null=True, verbose_name='finished', blank=True)),
+                ('heartbeat', models.DateTimeField(null=True, verbose_name='heartbeat', blank=True)),
+                ('sender', models.ForeignKey(verbose_name='sender', to='cyclos.User')),
+            ],
+            options={
+                'ordering': ('-created',),
+                'verbose_name': 'Reward payout job',
+                'verbose_name_plural': 'Reward payout jobs',
+            },
+        ),
+        migrations.CreateModel(
+            name='RewardPayoutRow',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('row_number', models.PositiveIntegerField(verbose_name='row number')),
+                ('idempotency_key', models.CharField(unique=True, max_length=40)),
+                ('amount', models.IntegerField(verbose_name='amount')),
+                ('description', models.TextField(verbose_name='description')),
+                ('status', models.CharField(default='pending', max_length=10, verbose_name='status', choices=[('pending', 'Pending'), ('processing', 'Processing'), ('paid', 'Paid'), ('failed', 'Failed'), ('unknown', 'Interrupted, check payment')])),
+                ('transfer_id', models.IntegerField(null=True, verbose_name='transfer id', blank=True)),
+                ('donation_transfer_id', models.IntegerField(null=True, verbose_name='donation transfer id', blank=True)),
+                ('error', models.TextField(default='', verbose_name='error', blank=True)),
+                ('processed', models.DateTimeField(null=True, verbose_name='processed', blank=True)),
+                ('job', models.ForeignKey(related_name='rows', to='rewards.RewardPayoutJob')),
+                ('payee', models.ForeignKey(verbose_name='payee', to='cyclos.User')),
+            ],
+            options={
+                'ordering': ('job', 'row_number'),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='rewardpayoutrow',
+            index_together=set([('job', 'status')]),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models.signals import post_save
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from cc3.cyclos.models import CC3Community
@@ -109,4 +110,117 @@ class DefaultGoodCause(models.Model):
 
     @property
     def cause_name(self):
-        return self.cause.business_name
\ No newline at end of file
+        return self.cause.business_name
+
+PAYOUT_JOB_PENDING = 'pending'
+PAYOUT_JOB_RUNNING = 'running'
+PAYOUT_JOB_DONE = 'done'
+PAYOUT_JOB_STATUS_CHOICES = (
+    (PAYOUT_JOB_PENDING, _(u"Pending")),
+    (PAYOUT_JOB_RUNNING, _(u"Running")),
+    (PAYOUT_JOB_DONE, _(u"Done")),
+)
+
+PAYOUT_ROW_PENDING = 'pending'
+PAYOUT_ROW_PROCESSING = 'processing'
+PAYOUT_ROW_PAID = 'paid'
+PAYOUT_ROW_FAILED = 'failed'
+PAYOUT_ROW_UNKNOWN = 'unknown'
+PAYOUT_ROW_STATUS_CHOICES = (
+    (PAYOUT_ROW_PENDING, _(u"Pending")),
+    (PAYOUT_ROW_PROCESSING, _(u"Processing")),
+    (PAYOUT_ROW_PAID, _(u"Paid")),
+    (PAYOUT_ROW_FAILED, _(u"Failed")),
+    # the job stopped or failed while paying the row: check in Cyclos
+    (PAYOUT_ROW_UNKNOWN, _(u"Interrupted, check payment")),
+)
+
+
+class RewardPayoutJob(models.Model):
+    """
+    The payments of a bulk rewards upload, made in the background (see
+    ``cc3.rewards.payouts``).
+    """
+    sender = models.ForeignKey('cyclos.User', verbose_name=_('sender'))
+    filename = models.CharField(_('file name'), max_length=255, blank=True)
+    fixed_donation_percentage = models.IntegerField(
+        _(u'good causes donation percentage'), null=True, blank=True)
+    status = models.CharField(
+        _('status'), max_length=10, choices=PAYOUT_JOB_STATUS_CHOICES,
+        default=PAYOUT_JOB_PENDING)
+    created = models.DateTimeField(_('created'), auto_now_add=True)
+    started = models.DateTimeField(_('started'), null=True, blank=True)
+    finished = models.DateTimeField(_('finished'), null=True, blank=True)
+    # updated while running, so jobs of crashed runs can be resumed
+    heartbeat = models.DateTimeField(_('heartbeat'), null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+        verbose_name = _('Reward payout job')
+        verbose_name_plural = _('Reward payout jobs')
+
+    def __unicode__(self):
+        return u"{0} ({1})".format(self.filename or self.pk, self.status)
+
+    def get_progress(self):
+        """
+        Returns a dict with the number of rows per status, the amount paid,
+        and the rows processed per second.
+        """
+        progress = dict((status, 0) for status, label
+                        in PAYOUT_ROW_STATUS_CHOICES)
+        for row in self.rows.order_by().values('status').annotate(
+                count=models.Count('pk')):
+            progress[row['status']] = row['count']
+        total = sum(progress.values())
+        processed = total - progress[PAYOUT_ROW_PENDING] - \
+            progress[PAYOUT_ROW_PROCESSING]
+
+        rows_per_second = None
+        if self.started:
+            elapsed = ((self.finished or timezone.now()) -
+                       self.started).total_seconds()
+            if elapsed > 0:
+                rows_per_second = processed / elapsed
+
+        progress.update({
+            'id': self.pk,
+            'status': self.status,
+            'total': total,
+            'processed': processed,
+            'amount_paid': self.rows.filter(
+                status=PAYOUT_ROW_PAID).aggregate(
+                    amount=models.Sum('amount'))['amount'] or 0,
+            'rows_per_second': rows_per_second,
+        })
+        return progress
+
+
+class RewardPayoutRow(models.Model):
+    """
+    A reward to pay in a payout job. The ``idempotency_key`` identifies the
+    row; its ``status`` makes sure the payment is made at most once, also
+    when the job is run again (see ``cc3.rewards.payouts``).
+    """
+    job = models.ForeignKey(RewardPayoutJob, related_name='rows')
+    row_number = models.PositiveIntegerField(_('row number'))
+    idempotency_key = models.CharField(max_length=40, unique=True)
+    payee = models.ForeignKey('cyclos.User', verbose_name=_('payee'))
+    amount = models.IntegerField(_('amount'))
+    description = models.TextField(_('description'))
+    status = models.CharField(
+        _('status'), max_length=10, choices=PAYOUT_ROW_STATUS_CHOICES,
+        default=PAYOUT_ROW_PENDING)
+    transfer_id = models.IntegerField(_('transfer id'), null=True, blank=True)
+    donation_transfer_id = models.IntegerField(
+        _('donation transfer id'), null=True, blank=True)
+    error = models.TextField(_('error'), blank=True, default='')
+    processed = models.DateTimeField(_('processed'), null=True, blank=True)
+
+    class Meta:
+        ordering = ('job', 'row_number')
+        index_together = (('job', 'status'),)
+
+    def __unicode__(self):
+        return u"{0} {1}: {2}".format(self.job_id, self.row_number,
+                                      self.status)
@@ -0,0 +1,257 @@
+"""
+Background payment of bulk reward uploads.
+
+``create_payout_job`` stores the rows of an uploaded rewards csv file as a
+``RewardPayoutJob``, ``run_payout_job`` pays them with a pool of worker
+threads, at most ``REWARDS_PAYOUT_WORKERS`` payments at a time.
+
+Every row is claimed (pending -> processing) in a single UPDATE before it is
+paid, and marked paid or failed afterwards, so a row is never paid twice.
+The reward transfer id is stored as soon as Cyclos has made the payment. A
+row is only marked failed when Cyclos refused the payment; after any other
+error the payment may have been made, so the row is marked for a manual
+check (unknown) instead.
+
+A job which stopped (e.g. the process was killed) can be run again, by the
+``run_reward_payouts`` command: its paid rows are skipped, and rows which
+were being paid are marked for a manual check instead of being paid again.
+
+The ``idempotency_key`` of a row only identifies it (a row can't be stored
+twice); it is not sent to Cyclos, which has no way to reject a repeated
+payment. Only the row status guards against paying a row again.
+"""
+import hashlib
+import itertools
+import logging
+import sys
+import threading
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from cc3.core.utils import chunks
+from cc3.cyclos.common import TransactionException
+
+from .models import (
+    RewardPayoutJob, RewardPayoutRow, PAYOUT_JOB_PENDING, PAYOUT_JOB_RUNNING,
+    PAYOUT_JOB_DONE, PAYOUT_ROW_PENDING, PAYOUT_ROW_PROCESSING,
+    PAYOUT_ROW_PAID, PAYOUT_ROW_FAILED, PAYOUT_ROW_UNKNOWN)
+from .utils import (
+    UserResolver, get_uid_cache_key, iter_reward_rows, pay_reward)
+
+LOG = logging.getLogger(__name__)
+
+# Maximum number of concurrent Cyclos payments of a job
+PAYOUT_WORKERS = getattr(settings, 'REWARDS_PAYOUT_WORKERS', 4)
+# Number of rows a worker pays before handing back to the job
+PAYOUT_CHUNK_SIZE = getattr(settings, 'REWARDS_PAYOUT_CHUNK_SIZE', 25)
+# Minutes without heartbeat after which a running job is taken to be stopped
+PAYOUT_STALE_MINUTES = getattr(settings, 'REWARDS_PAYOUT_STALE_MINUTES', 10)
+
+
+def get_idempotency_key(job, row_number, payee, amount):
+    return hashlib.sha1(u'{0}:{1}:{2}:{3}'.format(
+        job.pk, row_number, payee.pk, amount)).hexdigest()
+
+
+def create_payout_job(form_data, sender):
+    """
+    Creates a ``RewardPayoutJob`` with a row for each reward in the uploaded
+    csv file whose payee is known.
+    """
+    uid_type = form_data['uid_type']
+    default_description = _(u"Sum earned by user, business or institution")
+
+    with transaction.atomic():
+        job = RewardPayoutJob.objects.create(
+            sender=sender,
+            filename=getattr(form_data['csv_file'], 'name', '')[:255],
+            fixed_donation_percentage=form_data.get('donation_percent', None))
+
+        reward_rows = list(iter_reward_rows(form_data))
+        resolver = UserResolver(
+            uid_type, cache_key=get_uid_cache_key(form_data))
+        resolver.resolve(
+            uid for row_number, uid, amount, description in reward_rows)
+
+        rows = []
+        for row_number, uid, amount, description in reward_rows:
+            payee = resolver.get_user(uid)
+            if not payee:
+                continue
+            if isinstance(description, str):
+                description = description.decode('utf-8')
+            rows.append(RewardPayoutRow(
+                job=job,
+                row_number=row_number,
+                idempotency_key=get_idempotency_key(
+                    job, row_number, payee, amount),
+                payee=payee,
+                amount=amount,
+                description=description or default_description,
+            ))
+        RewardPayoutRow.objects.bulk_create(rows, batch_size=500)
+    # the upload is done with
+    resolver.forget()
+    return job
+
+
+def claim_payout_job(job):
+    """
+    Marks the job as running, if it is pending or its run stopped. Returns
+    False if it is done or running elsewhere.
+    """
+    now = timezone.now()
+    stale = now - timedelta(minutes=PAYOUT_STALE_MINUTES)
+    return RewardPayoutJob.objects.filter(
+        Q(status=PAYOUT_JOB_PENDING) |
+        Q(status=PAYOUT_JOB_RUNNING, heartbeat__lt=stale) |
+        Q(status=PAYOUT_JOB_RUNNING, heartbeat__isnull=True),
+        pk=job.pk).update(status=PAYOUT_JOB_RUNNING, heartbeat=now) == 1
+
+
+class PayoutRunner(object):
+    """
+    Pays the pending rows of a claimed job with a pool of worker threads
+    (or in the calling thread, with a single worker).
+    """
+    def __init__(self, job, workers=None, chunk_size=None):
+        self.job = job
+        self.workers = workers or PAYOUT_WORKERS
+        self.chunk_size = chunk_size or PAYOUT_CHUNK_SIZE
+
+    def pay_row(self, row):
+        """
+        Pays the row, unless another worker claimed it. Returns True if the
+        row was processed.
+        """
+        if not RewardPayoutRow.objects.filter(
+                pk=row.pk, status=PAYOUT_ROW_PENDING).update(
+                    status=PAYOUT_ROW_PROCESSING):
+            return False
+
+        paid = []
+
+        def reward_paid(reward):
+            # store it before anything else can go wrong
+            paid.append(reward)
+            RewardPayoutRow.objects.filter(pk=row.pk).update(
+                transfer_id=reward.transfer_id)
+
+        updates = {'processed': timezone.now()}
+        try:
+            reward, donation = pay_reward(
+                row.amount, self.job.sender, row.payee, row.description,
+                fixed_donation_percentage=self.job.fixed_donation_percentage,
+                reward_paid=reward_paid)
+        except TransactionException as e:
+            if paid:
+                LOG.error(u'Reward payment of row {0} made, but failed '
+                          u'afterwards'.format(row.pk),
+                          exc_info=sys.exc_info())
+                updates.update(status=PAYOUT_ROW_UNKNOWN, error=unicode(e))
+            else:
+                # refused by Cyclos
+                LOG.error(u'Unable to perform reward payment of {1} to {2} '
+                          u'transaction: {0}'.format(
+                              e, row.amount, row.payee.username))
+                updates.update(status=PAYOUT_ROW_FAILED, error=unicode(e))
+        except Exception, e:
+            # e.g. a timeout: the payment may have been made
+            LOG.error(u'Reward payment of row {0} failed'.format(row.pk),
+                      exc_info=sys.exc_info())
+            updates.update(status=PAYOUT_ROW_UNKNOWN, error=unicode(e))
+        else:
+            updates.update(
+                status=PAYOUT_ROW_PAID,
+                transfer_id=reward.transfer_id,
+                donation_transfer_id=donation and donation.transfer_id)
+        RewardPayoutRow.objects.filter(pk=row.pk).update(**updates)
+        return True
+
+    def pay_rows(self, row_ids):
+        """Pays a chunk of rows. Returns the number of rows processed."""
+        rows = RewardPayoutRow.objects.filter(
+            pk__in=row_ids, status=PAYOUT_ROW_PENDING).select_related(
+                'payee').order_by('row_number')
+        return sum(1 for row in rows if self.pay_row(row))
+
+    def pay_rows_in_worker(self, row_ids):
+        try:
+            return self.pay_rows(row_ids)
+        finally:
+            # every thread has its own database connection
+            connection.close()
+
+    def run(self):
+        """Pays the pending rows and marks the job done"""
+        job = self.job
+        # rows a stopped run was paying may or may not have been paid
+        job.rows.filter(status=PAYOUT_ROW_PROCESSING).update(
+            status=PAYOUT_ROW_UNKNOWN)
+        if not job.started:
+            job.started = timezone.now()
+            RewardPayoutJob.objects.filter(pk=job.pk).update(
+                started=job.started)
+
+        row_ids = list(job.rows.filter(status=PAYOUT_ROW_PENDING).order_by(
+            'row_number').values_list('pk', flat=True))
+        processed = 0
+        if self.workers == 1:
+            pool = None
+            counts = itertools.imap(
+                self.pay_rows, chunks(row_ids, self.chunk_size))
+        else:
+            pool = ThreadPool(self.workers)
+            counts = pool.imap_unordered(
+                self.pay_rows_in_worker, chunks(row_ids, self.chunk_size))
+        try:
+            for count in counts:
+                processed += count
+                RewardPayoutJob.objects.filter(pk=job.pk).update(
+                    heartbeat=timezone.now())
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        job.status = PAYOUT_JOB_DONE
+        job.finished = timezone.now()
+        RewardPayoutJob.objects.filter(pk=job.pk).update(
+            status=job.status, finished=job.finished)
+        LOG.info(u'Reward payout job {0}: processed {1} rows'.format(
+            job.pk, processed))
+        return processed
+
+
+def run_payout_job(job, workers=None):
+    """
+    Runs the job if it can be claimed. Returns the number of rows processed,
+    or None if the job is done or running elsewhere.
+    """
+    if not claim_payout_job(job):
+        return None
+    return PayoutRunner(job, workers=workers).run()
+
+
+def start_payout_job(job):
+    """Runs the job in a background thread"""
+    def run():
+        try:
+            run_payout_job(job)
+        except Exception:
+            LOG.error(u'Reward payout job {0} stopped'.format(job.pk),
+                      exc_info=sys.exc_info())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name='reward-payout-{0}'.format(
+        job.pk))
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -3,3 +3,5 @@ from .test_transactions import CauseRewardTestCase
 from .test_views import (
     CauseListViewTestCase, SearchCauseListViewTestCase,
     SelectCauseListViewTestCase, JoinCauseViewTestCase)
+from .test_payouts import PayoutJobTestCase
+from .test_utils import UserResolverTestCase
@@ -0,0 +1,208 @@
+import socket
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from mock import MagicMock, patch
+
+from cc3.core.models import Transaction
+from cc3.core.utils.test_backend import DummyCyclosBackend
+from cc3.cyclos.backends import set_backend
+from cc3.cyclos.common import TransactionException
+from cc3.cyclos.tests.test_factories import CC3ProfileFactory
+
+from ..common import UPLOAD_UID_USER_ID
+from ..models import (
+    RewardPayoutJob, RewardPayoutRow, PAYOUT_JOB_DONE, PAYOUT_JOB_RUNNING,
+    PAYOUT_ROW_FAILED, PAYOUT_ROW_PAID, PAYOUT_ROW_PENDING,
+    PAYOUT_ROW_PROCESSING, PAYOUT_ROW_UNKNOWN)
+from ..payouts import create_payout_job, run_payout_job
+from ..views import BulkRewardUploadWizard
+
+
+class PayoutJobTestCase(TestCase):
+    """
+    Test case for paying bulk rewards in a background job.
+    """
+    def setUp(self):
+        self.backend = DummyCyclosBackend()
+        set_backend(self.backend)
+
+        self.sender = CC3ProfileFactory.create().user
+        self.payees = [CC3ProfileFactory.create().user for i in range(3)]
+
+    def _upload_data(self):
+        csv_file = SimpleUploadedFile('rewards.csv', '\n'.join(
+            '{0},{1},Reward {2}'.format(payee.pk, 10 * (i + 1), i)
+            for i, payee in enumerate(self.payees)) + '\n999999,5,Unknown\n')
+        return {
+            'csv_file': csv_file,
+            'uid_type': UPLOAD_UID_USER_ID,
+            'uid_column': 0,
+            'amount_column': 1,
+            'description_column': 2,
+        }
+
+    def _create_job(self):
+        return create_payout_job(self._upload_data(), self.sender)
+
+    def test_create_payout_job(self):
+        """
+        Tests that a row with an idempotency key is stored for each reward
+        with a known payee.
+        """
+        job = self._create_job()
+
+        rows = list(job.rows.all())
+        self.assertEqual([row.payee for row in rows], self.payees)
+        self.assertEqual([row.amount for row in rows], [10, 20, 30])
+        self.assertEqual(rows[0].description, u'Reward 0')
+        self.assertEqual(len(set(row.idempotency_key for row in rows)), 3)
+        self.assertTrue(all(row.status == PAYOUT_ROW_PENDING for row in rows))
+
+    def test_run_payout_job(self):
+        """
+        Tests that all rows are paid and logged, and the job is done.
+        """
+        job = self._create_job()
+
+        self.assertEqual(run_payout_job(job, workers=1), 3)
+
+        job = RewardPayoutJob.objects.get(pk=job.pk)
+        self.assertEqual(job.status, PAYOUT_JOB_DONE)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(
+            job.rows.filter(status=PAYOUT_ROW_PAID).count(), 3)
+        self.assertEqual(len(self.backend.transactions_list), 3)
+        self.assertEqual(Transaction.objects.filter(
+            sender=self.sender).count(), 3)
+
+        progress = job.get_progress()
+        self.assertEqual(progress['total'], 3)
+        self.assertEqual(progress['processed'], 3)
+        self.assertEqual(progress['amount_paid'], 60)
+
+    def test_run_again_skips_paid_rows(self):
+        """
+        Tests that a job run again only pays the rows not paid before, and
+        does not pay rows a stopped run was paying.
+        """
+        job = self._create_job()
+        rows = list(job.rows.all())
+        RewardPayoutRow.objects.filter(pk=rows[0].pk).update(
+            status=PAYOUT_ROW_PAID)
+        RewardPayoutRow.objects.filter(pk=rows[1].pk).update(
+            status=PAYOUT_ROW_PROCESSING)
+        # the run which stopped
+        RewardPayoutJob.objects.filter(pk=job.pk).update(
+            status=PAYOUT_JOB_RUNNING, started=timezone.now())
+
+        self.assertEqual(run_payout_job(job, workers=1), 1)
+
+        self.assertEqual(len(self.backend.transactions_list), 1)
+        self.assertEqual(self.backend.transactions_list[0].amount, 30)
+        self.assertEqual(RewardPayoutRow.objects.get(pk=rows[1].pk).status,
+                         PAYOUT_ROW_UNKNOWN)
+
+    def test_running_job_is_not_run(self):
+        """
+        Tests that a job which is running elsewhere is left alone.
+        """
+        job = self._create_job()
+        RewardPayoutJob.objects.filter(pk=job.pk).update(
+            status=PAYOUT_JOB_RUNNING, heartbeat=timezone.now())
+
+        self.assertIsNone(run_payout_job(job, workers=1))
+        self.assertEqual(len(self.backend.transactions_list), 0)
+
+    @patch('cc3.cyclos.backends.user_payment')
+    def test_failed_payment(self, mock_user_payment):
+        """
+        Tests that a failed payment is recorded, and the other rows paid.
+        """
+        def user_payment(sender, receiver, amount, *args, **kwargs):
+            if receiver == self.payees[1].username:
+                raise TransactionException('Insufficient funds')
+            return self.backend.user_payment(
+                sender, receiver, amount, *args, **kwargs)
+        mock_user_payment.side_effect = user_payment
+
+        job = self._create_job()
+        run_payout_job(job, workers=1)
+
+        statuses = list(job.rows.values_list('status', 'error'))
+        self.assertEqual(statuses, [
+            (PAYOUT_ROW_PAID, u''),
+            (PAYOUT_ROW_FAILED, u'Insufficient funds'),
+            (PAYOUT_ROW_PAID, u''),
+        ])
+        self.assertEqual(job.get_progress()['amount_paid'], 40)
+
+    @patch('cc3.cyclos.backends.user_payment')
+    def test_ambiguous_payment_error(self, mock_user_payment):
+        """
+        Tests that a row is marked for a manual check, not failed, when the
+        reward payment ends in an error which doesn't tell if it was made.
+        """
+        def user_payment(sender, receiver, amount, *args, **kwargs):
+            if receiver == self.payees[1].username:
+                raise socket.timeout('timed out')
+            return self.backend.user_payment(
+                sender, receiver, amount, *args, **kwargs)
+        mock_user_payment.side_effect = user_payment
+
+        job = self._create_job()
+        run_payout_job(job, workers=1)
+
+        self.assertEqual(list(job.rows.values_list('status', flat=True)), [
+            PAYOUT_ROW_PAID, PAYOUT_ROW_UNKNOWN, PAYOUT_ROW_PAID])
+
+    @patch('cc3.rewards.utils.cause_reward')
+    def test_error_after_payment(self, mock_cause_reward):
+        """
+        Tests that the reward transfer id is kept, and the row marked for a
+        manual check, when the donation fails after the reward was paid.
+        """
+        mock_cause_reward.side_effect = ValueError('No good cause')
+
+        job = self._create_job()
+        run_payout_job(job, workers=1)
+
+        rows = list(job.rows.all())
+        self.assertEqual(len(self.backend.transactions_list), 3)
+        self.assertTrue(all(row.status == PAYOUT_ROW_UNKNOWN for row in rows))
+        self.assertEqual(
+            [row.transfer_id for row in rows],
+            [transaction.transfer_id
+             for transaction in self.backend.transactions_list])
+
+    @patch('cc3.rewards.views.start_payout_job')
+    @patch('cc3.rewards.views.messages')
+    def test_upload_links_progress(self, mock_messages, mock_start):
+        """
+        Tests that the message after uploading rewards links to the progress
+        of the payout job.
+        """
+        data = self._upload_data()
+        wizard = BulkRewardUploadWizard()
+        wizard.request = RequestFactory().post('/')
+        wizard.request.user = self.sender
+        wizard.file_storage = MagicMock()
+        upload_form = MagicMock(cleaned_data={'csv_file': data['csv_file']})
+
+        with patch.object(wizard, 'get_all_cleaned_data', return_value=data):
+            response = wizard.done([upload_form])
+
+        job = RewardPayoutJob.objects.get()
+        mock_start.assert_called_once_with(job)
+        self.assertEqual(response.status_code, 302)
+        args, kwargs = mock_messages.add_message.call_args
+        self.assertIn(
+            u'<a href="{0}">'.format(
+                reverse('rewards_payout_progress', args=[job.pk])),
+            args[2])
+        self.assertIn(u'Number of payments: 3', args[2])
+        self.assertEqual(kwargs['extra_tags'], 'safe')
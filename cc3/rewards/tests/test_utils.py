@@ -0,0 +1,73 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from cc3.cards.tests.test_factories import CardFactory
+from cc3.cyclos.tests.test_factories import UserFactory
+
+from ..common import UPLOAD_UID_CARD, UPLOAD_UID_EMAIL, UPLOAD_UID_USER_ID
+from ..utils import UserResolver
+
+
+class UserResolverTestCase(TestCase):
+    """
+    Test case for resolving the uids of a bulk rewards upload in bulk.
+    """
+    def setUp(self):
+        self.users = [UserFactory.create() for i in range(3)]
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_resolve_emails(self):
+        """
+        Tests that emails resolve in one query for the users and one to
+        load them.
+        """
+        resolver = UserResolver(UPLOAD_UID_EMAIL)
+        uids = [user.email for user in self.users] + [
+            'unknown@example.com', 'not an email']
+
+        with self.assertNumQueries(2):
+            resolver.resolve(uids)
+            users = [resolver.get_user(uid) for uid in uids]
+        self.assertEqual(users, self.users + [None, None])
+
+    def test_resolve_user_ids_and_cards(self):
+        """
+        Tests that user ids and card numbers resolve to their users.
+        """
+        resolver = UserResolver(UPLOAD_UID_USER_ID)
+        uids = [str(user.pk) for user in self.users] + ['999999', 'x']
+        resolver.resolve(uids)
+        self.assertEqual([resolver.get_user(uid) for uid in uids],
+                         self.users + [None, None])
+
+        card = CardFactory.create(owner=self.users[1])
+        resolver = UserResolver(UPLOAD_UID_CARD)
+        self.assertEqual(resolver.get_user(str(int(card.number.number))),
+                         self.users[1])
+
+    def test_ambiguous_email(self):
+        """
+        Tests that an email of more than one user does not resolve.
+        """
+        UserFactory.create(email=self.users[0].email)
+        resolver = UserResolver(UPLOAD_UID_EMAIL)
+        self.assertIsNone(resolver.get_user(self.users[0].email))
+
+    def test_cached_for_next_pass(self):
+        """
+        Tests that a second pass over the upload only loads the users, until
+        the upload is done with.
+        """
+        uids = [user.email for user in self.users]
+        UserResolver(UPLOAD_UID_EMAIL, cache_key='upload').resolve(uids)
+
+        resolver = UserResolver(UPLOAD_UID_EMAIL, cache_key='upload')
+        with self.assertNumQueries(1):
+            resolver.resolve(uids)
+        self.assertEqual([resolver.get_user(uid) for uid in uids],
+                         self.users)
+
+        resolver.forget()
+        self.assertIsNone(cache.get('upload'))
@@ -1,3 +1,4 @@
+from _mysql import OperationalError
 from decimal import Decimal
 from unittest.case import skip
 
@@ -11,6 +12,7 @@ from mock import patch, PropertyMock, MagicMock
 
 from cc3.core.utils.test_backend import DummyCyclosBackend
 from cc3.cyclos.backends import set_backend
+from cc3.cyclos.models import User
 from cc3.cyclos.tests.test_factories import CC3ProfileFactory, UserFactory
 
 from ..models import UserCause
@@ -62,15 +64,13 @@ class CauseListViewTestCase(TestCase):
     # skipping for now (hate to do this, but it's taking me infinitely longer
     # to figure out how to mock this stuff than it did to write the code.)
     # TODO; come back an fix this!
-    @patch('cc3.rewards.views.get_cyclos_connection')
-    @patch('cc3.rewards.views.close_cyclos_connection')
+    @patch('cc3.rewards.views.cyclos_connection')
     @patch('cc3.rewards.views.get_cyclos_transfer_totals')
     def test_get_context_data_results(self,
-            get_totals_mock, close_connection_mock, get_connection_mock):
+            get_totals_mock, connection_mock):
         """
         Tests ``get_context_data`` method returned dictionary.
         """
-        get_connection_mock.return_value = 'Dummy'
         get_totals_mock.side_effect = [
                         self.cyclos_transfer_totals_by_recipient,
                         self.cyclos_transfer_totals_by_recipient,
@@ -110,16 +110,14 @@ class CauseListViewTestCase(TestCase):
     # skipping for now (hate to do this, but it's taking me infinitely longer
     # to figure out how to mock this stuff than it did to write the code.)
     # TODO; come back an fix this!
-    @patch('cc3.rewards.views.get_cyclos_connection')
-    @patch('cc3.rewards.views.close_cyclos_connection')
+    @patch('cc3.rewards.views.cyclos_connection')
     @patch('cc3.rewards.views.get_cyclos_transfer_totals')
     def test_get_context_data_results_no_transactions(self,
-            get_totals_mock, close_connection_mock, get_connection_mock):
+            get_totals_mock, connection_mock):
         """
         Tests ``get_context_data`` method returned data when the user has not
         selected any good cause yet.
         """
-        get_connection_mock.return_value = 'Dummy'
         get_totals_mock.side_effect = [
                         self.cyclos_transfer_totals_by_recipient,
                         self.cyclos_transfer_totals_by_recipient,
@@ -134,6 +132,28 @@ class CauseListViewTestCase(TestCase):
         self.assertIn('cause_donations', context)
         self.assertIsNone(context['cause_donations'])
 
+    @patch('cc3.rewards.views.cyclos_connection')
+    @patch('cc3.rewards.views.get_cyclos_transfer_totals')
+    def test_get_context_data_database_error(self, get_totals_mock,
+                                             connection_mock):
+        """
+        Tests that the donations are left out when the Cyclos database can't
+        be read, and the connection is handed back with the error.
+        """
+        connection_mock.return_value.__exit__.return_value = False
+        get_totals_mock.side_effect = OperationalError(2006, 'gone away')
+        self.view.object_list = User.objects.filter(pk__in=[
+            self.user_cause_1.cause.pk, self.user_cause_2.cause.pk])
+
+        context = self.view.get_context_data(object_list=self.view.object_list)
+
+        self.assertIsNone(context['total_donations'])
+        self.assertIsNone(context['cause_donations'])
+        self.assertIsNone(context['donations_reference'])
+        self.assertIsInstance(
+            connection_mock.return_value.__exit__.call_args[0][1],
+            OperationalError)
+
 
 class SelectCauseListViewTestCase(TestCase):
     def setUp(self):
@@ -141,13 +161,11 @@ class SelectCauseListViewTestCase(TestCase):
         self.user_cause = UserCauseFactory.create(consumer=self.profile.user)
         self.url = reverse('causes_list')
 
-    @patch('cc3.rewards.views.get_cyclos_connection')
-    @patch('cc3.rewards.views.close_cyclos_connection')
+    @patch('cc3.rewards.views.cyclos_connection')
     @patch('cc3.rewards.views.get_cyclos_transfer_totals')
     def test_select_cause_login_required(self,
-            get_totals_mock, close_connection_mock, get_connection_mock):
+            get_totals_mock, connection_mock):
         """ Tests login required to access 'select cause' view """
-        get_connection_mock.return_value = 'Dummy'
         get_totals_mock.return_value = {}
 
         response = self.client.get(self.url)
@@ -168,13 +186,11 @@ class SearchCauseListViewTestCase(TestCase):
         self.profile = CC3ProfileFactory.create()
         self.user_cause = UserCauseFactory.create(consumer=self.profile.user)
 
-    @patch('cc3.rewards.views.get_cyclos_connection')
-    @patch('cc3.rewards.views.close_cyclos_connection')
+    @patch('cc3.rewards.views.cyclos_connection')
     @patch('cc3.rewards.views.get_cyclos_transfer_totals')
     def test_search_cause_login_required(self,
-            get_totals_mock, close_connection_mock, get_connection_mock):
+            get_totals_mock, connection_mock):
         """ Tests login required to access 'search cause' view """
-        get_connection_mock.return_value = 'Dummy'
         get_totals_mock.return_value = {}
 
         url = reverse('search_cause')
@@ -184,16 +200,14 @@ class SearchCauseListViewTestCase(TestCase):
         self.assertRedirects(
             response, '{0}?next={1}'.format(reverse('auth_login'), url))
 
-    @patch('cc3.rewards.views.get_cyclos_connection')
-    @patch('cc3.rewards.views.close_cyclos_connection')
+    @patch('cc3.rewards.views.cyclos_connection')
     @patch('cc3.rewards.views.get_cyclos_transfer_totals')
     def test_search_cause_no_query_redirection(self,
-            get_totals_mock, close_connection_mock, get_connection_mock):
+            get_totals_mock, connection_mock):
         """
         Tests that trying to access 'search cause' view without any query
         redirects to the main 'select cause' view.
         """
-        get_connection_mock.return_value = 'Dummy'
         get_totals_mock.return_value = {}
 
         url = reverse('search_cause')
@@ -236,12 +250,11 @@ class JoinCauseViewTestCase(TestCase):
 
         self.assertEqual(response.status_code, 404)
 
-    @patch('cc3.rewards.views.get_cyclos_connection')
-    @patch('cc3.rewards.views.close_cyclos_connection')
+    @patch('cc3.rewards.views.cyclos_connection')
     @patch('cc3.rewards.views.get_cyclos_transfer_totals')
     @patch('cc3.cyclos.models.CC3Profile.cyclos_group')
     def test_join_cause_success(self, mock,
-            get_totals_mock, close_connection_mock, get_connection_mock):
+            get_totals_mock, connection_mock):
         """
         Tests a successful request.
 
@@ -251,7 +264,6 @@ class JoinCauseViewTestCase(TestCase):
         """
         type(mock).name = PropertyMock(
             return_value=settings.CYCLOS_CHARITY_MEMBER_GROUP)
-        get_connection_mock.return_value = 'Dummy'
         get_totals_mock.return_value = {}
 
         self.client.login(username=self.user.user.username, password='testing')
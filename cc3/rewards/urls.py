@@ -2,7 +2,8 @@ from django.conf.urls import patterns, url
 from django.contrib.auth.decorators import login_required
 
 from .views import (bulk_reward_upload_wizard, UpdateDonationPercentageView,
-    JoinCauseView, SearchCauseListView, SelectCauseListView, admin_causes_list)
+    JoinCauseView, SearchCauseListView, SelectCauseListView, admin_causes_list,
+    payout_job_progress)
 
 
 urlpatterns = patterns(
@@ -19,5 +20,7 @@ urlpatterns = patterns(
         name='search_cause'),
     url(r'^rewards/bulk_upload/$', login_required(bulk_reward_upload_wizard),
         name='rewards_bulk_upload'),
+    url(r'^rewards/payouts/(?P<pk>\d+)/progress/$', payout_job_progress,
+        name='rewards_payout_progress'),
     url(r'^admin/causes_list/$', admin_causes_list, name='admin_causes_list'),
 )
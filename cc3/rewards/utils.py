@@ -1,10 +1,13 @@
+import hashlib
 import logging
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import mail_admins
 from django.utils.translation import ugettext as _
 
 from cc3.core.models import Transaction
+from cc3.core.utils import chunks
 from cc3.core.utils.files import uploaded_file_to_filename
 from cc3.cyclos import backends
 from cc3.cyclos.common import TransactionException
@@ -17,6 +20,12 @@ from .transactions import cause_reward
 
 LOG = logging.getLogger(__name__)
 
+# Number of uids per IN (...) query
+UID_QUERY_SIZE = 500
+# Seconds the resolved uids of an upload are cached, between the validation
+# and the payment pass
+UID_CACHE_TIMEOUT = getattr(settings, 'REWARDS_UID_CACHE_TIMEOUT', 3600)
+
 
 def get_user_from_uid(uid, uid_type):
     from cc3.cards.models import Card
@@ -42,6 +51,109 @@ def get_user_from_uid(uid, uid_type):
     return user
 
 
+def get_uid_cache_key(form_data):
+    """
+    Returns the cache key of the resolved uids of the uploaded file, see
+    ``UserResolver``.
+    """
+    csv_file = form_data['csv_file']
+    name = getattr(csv_file, 'name', None)
+    if not name:
+        return None
+    return 'rewards_uids_{0}'.format(hashlib.sha1(u'{0}:{1}:{2}'.format(
+        form_data['uid_type'], name,
+        getattr(csv_file, 'size', '')).encode('utf-8')).hexdigest())
+
+
+class UserResolver(object):
+    """
+    Resolves the uids of a bulk rewards upload to users, as
+    ``get_user_from_uid`` does, but with a few ``IN`` queries for all rows.
+
+    With a ``cache_key`` the uids resolved are kept in the cache, so the
+    validation and payment passes over the same upload resolve them once.
+    Uids which match more than one user don't resolve.
+    """
+    def __init__(self, uid_type, cache_key=None):
+        self.uid_type = uid_type
+        self.cache_key = cache_key
+        # user id (or None) by uid key
+        self.user_ids = {}
+        if cache_key:
+            self.user_ids = cache.get(cache_key) or {}
+        self.users = {}
+
+    def get_key(self, uid):
+        """Returns the uid as looked up, or None if it can't match a user"""
+        if self.uid_type == UPLOAD_UID_EMAIL:
+            return uid.strip().lower() or None
+        if self.uid_type in (UPLOAD_UID_USER_ID, UPLOAD_UID_CARD):
+            try:
+                return int(uid)
+            except (TypeError, ValueError):
+                return None
+        return None
+
+    def find_user_ids(self, uids):
+        """
+        Returns a list of (key, user id) for the users matching the uids.
+        """
+        from cc3.cards.models import Card
+
+        if self.uid_type == UPLOAD_UID_EMAIL:
+            return [(email.strip().lower(), user_id) for email, user_id in
+                    User.objects.filter(email__in=uids).values_list(
+                        'email', 'pk')]
+        keys = [self.get_key(uid) for uid in uids]
+        if self.uid_type == UPLOAD_UID_USER_ID:
+            return User.objects.filter(pk__in=keys).values_list('pk', 'pk')
+        if self.uid_type == UPLOAD_UID_CARD:
+            return Card.objects.filter(number__number__in=keys).values_list(
+                'number__number', 'owner')
+        return []
+
+    def resolve(self, uids):
+        """Looks up the users of all uids not resolved yet"""
+        uids_by_key = {}
+        for uid in uids:
+            key = self.get_key(uid)
+            if key is not None:
+                uids_by_key.setdefault(key, set()).add(uid.strip())
+
+        new_keys = [key for key in uids_by_key if key not in self.user_ids]
+        for keys_chunk in chunks(new_keys, UID_QUERY_SIZE):
+            found = {}
+            for key, user_id in self.find_user_ids(
+                    [uid for key in keys_chunk for uid in uids_by_key[key]]):
+                found.setdefault(key, set()).add(user_id)
+            for key in keys_chunk:
+                user_ids = found.get(key, ())
+                self.user_ids[key] = (
+                    list(user_ids)[0] if len(user_ids) == 1 else None)
+        if new_keys and self.cache_key:
+            cache.set(self.cache_key, self.user_ids, UID_CACHE_TIMEOUT)
+
+        user_ids = set(self.user_ids[key] for key in uids_by_key) - \
+            set(self.users) - set([None])
+        for user_ids_chunk in chunks(list(user_ids), UID_QUERY_SIZE):
+            self.users.update(User.objects.in_bulk(user_ids_chunk))
+
+    def get_user(self, uid):
+        """Returns the user of the uid, or None"""
+        key = self.get_key(uid)
+        if key is None:
+            return None
+        if key not in self.user_ids or (
+                self.user_ids[key] and self.user_ids[key] not in self.users):
+            self.resolve([uid])
+        return self.users.get(self.user_ids[key])
+
+    def forget(self):
+        """Drops the cached uids, once the upload is done"""
+        if self.cache_key:
+            cache.delete(self.cache_key)
+
+
 def pay_reward_with_cause_donation(amount, sender, payee, description,
                                    make_cause_donation=True):
     """Make the specified user payment, then (by default) make the
@@ -113,30 +225,86 @@ def pay_reward_with_cause_donation(amount, sender, payee, description,
     return amount_paid
 
 
-def process_csv(form_data, make_payments=False, sender=None):
+def log_reward_transaction(amount, sender, receiver, transfer_id, label):
     """
-    Process the csv file. Keep counts of valid and invalid rows, etc.
-    If make_payments is True, actually perform the transactions; otherwise
-    just return the stats as a dict
+    Logs a payment made in Cyclos in a ``Transaction``. Failures are reported
+    to ADMINS, but treated as success, because the payment was made.
     """
-    num_rows = 0
-    num_valid_rows = 0
-    unique_users = {}  # dict keyed by userID
-    invalid_user_rows = []  # list of row numbers
-    total_amount = 0
-    num_large_amounts = 0
-    amount_paid = 0
+    try:
+        Transaction.objects.create(
+            amount=amount,
+            sender=sender,
+            receiver=receiver,
+            transfer_id=transfer_id,
+        )
+    except Exception, e:
+        message = u'{0} made (transfer id={1}), but failed to create '  \
+            u'Transaction: {2}'.format(label, transfer_id, e)
+        LOG.error(message)
+
+        if not settings.DEBUG:
+            mail_admins(u'Failed to log payment',
+                        message, fail_silently=True)
+
+
+def pay_reward(amount, sender, payee, description,
+               fixed_donation_percentage=None, reward_paid=None):
+    """
+    Make the reward payment from sender to payee, then the good cause
+    donation of the payee, and log both.
+
+    Raises ``TransactionException`` if the reward payment fails.
+
+    :param amount: integer amount of the reward
+    :param sender: auth User paying the reward
+    :param payee: auth User
+    :param description: description of the reward payment
+    :param fixed_donation_percentage: if set, the percentage all payees
+    donate, see ``cause_reward``
+    :param reward_paid: if set, called with the reward transaction as soon as
+    it is paid, before it is logged and the donation is made
+    :return: the reward and the donation Cyclos transactions (the donation
+    is None if there was none)
+    """
+    if isinstance(description, str):
+        description = description.decode('utf-8')
+    transaction = backends.user_payment(
+        sender, payee.username, amount, description)
+    if reward_paid is not None:
+        reward_paid(transaction)
+    log_reward_transaction(amount, sender, payee, transaction.transfer_id,
+                           u'Reward payment')
+
+    if fixed_donation_percentage is None:
+        donation_description = None
+    else:
+        donation_description = _(
+            u"{0}% Cause donation (chosen by {1})").format(
+            fixed_donation_percentage, sender.cc3_profile.business_name)
+
+    donation = cause_reward(
+        amount, payee, transaction.transfer_id,
+        description=donation_description,
+        fixed_donation_percentage=fixed_donation_percentage)
+    # catches and logs errors if necessary
+    if donation:
+        log_reward_transaction(
+            donation.amount, donation.sender, donation.recipient,
+            donation.transfer_id, u'Good Cause donation')
+    return transaction, donation
 
+
+def iter_reward_rows(form_data):
+    """
+    Yields ``(row_number, uid, amount, description)`` for each row of the
+    uploaded rewards csv file, numbering the rows as a spreadsheet does.
+    """
     csv_filename = uploaded_file_to_filename(form_data['csv_file'])
     has_headers = form_data.get('has_headers', False)
-    uid_type = form_data['uid_type']
     uid_column = form_data['uid_column']
     amount_column = form_data['amount_column']
     description_column = form_data.get('description_column', None)
     #date_column = form_data.get('date_column', None)
-    threshold_amount = form_data.get('threshold_amount', None)
-    fixed_donation_percentage = form_data.get('donation_percent', None)
-
 
     if has_headers:
         skip_rows = 1
@@ -148,8 +316,6 @@ def process_csv(form_data, make_payments=False, sender=None):
     for i, row in enumerate(read_csv(csv_filename,
                         delimiters=UPLOAD_CSV_DELIMITERS,
                         skip_rows=skip_rows)):
-        num_rows +=1
-
         uid = row[uid_column]
         amount = int(row[amount_column])
         if description_column is not None:
@@ -160,10 +326,37 @@ def process_csv(form_data, make_payments=False, sender=None):
         #    txn_date = row[date_column]
         #else:
         #    txn_date = ''
+        yield i + row_number_adjust, uid, amount, description
+
 
-        payee = get_user_from_uid(uid, uid_type)
+def process_csv(form_data, make_payments=False, sender=None):
+    """
+    Process the csv file. Keep counts of valid and invalid rows, etc.
+    If make_payments is True, actually perform the transactions; otherwise
+    just return the stats as a dict
+    """
+    num_rows = 0
+    num_valid_rows = 0
+    unique_users = {}  # dict keyed by userID
+    invalid_user_rows = []  # list of row numbers
+    total_amount = 0
+    num_large_amounts = 0
+    amount_paid = 0
+
+    uid_type = form_data['uid_type']
+    threshold_amount = form_data.get('threshold_amount', None)
+    fixed_donation_percentage = form_data.get('donation_percent', None)
+
+    rows = list(iter_reward_rows(form_data))
+    resolver = UserResolver(uid_type, cache_key=get_uid_cache_key(form_data))
+    resolver.resolve(uid for row_number, uid, amount, description in rows)
+
+    for row_number, uid, amount, description in rows:
+        num_rows +=1
+
+        payee = resolver.get_user(uid)
         if not payee:
-            invalid_user_rows.append(i+row_number_adjust)
+            invalid_user_rows.append(row_number)
             continue
 
         # valid user, so in theory transaction can be made
@@ -175,75 +368,18 @@ def process_csv(form_data, make_payments=False, sender=None):
 
         if make_payments:
             # actually make the payment, and the cause_reward percentage payment
-            amount = int(amount)
             if not description:
                 description = _(u"Sum earned by user, business or institution")
 
-            transaction = None
             try:
-                transaction = backends.user_payment(
-                    sender, payee.username, amount, description.decode('utf-8'))
+                pay_reward(amount, sender, payee, description,
+                           fixed_donation_percentage=fixed_donation_percentage)
                 amount_paid += amount
             except TransactionException as e:
                 LOG.error(u'Unable to perform reward payment of {1} to {2} '
                           u'transaction: {0}'.format(e,
                                                      amount,
                                                      payee.username))
-            else:
-                try:
-                    # Log the payment
-                    Transaction.objects.create(
-                        amount=amount,
-                        sender=sender,
-                        receiver=payee,
-                        transfer_id=transaction.transfer_id,
-                    )
-                except Exception, e:
-                    # Report this to ADMINS, but treat as success
-                    # because the payment was made
-                    message = u'Reward payment made (transfer id={0}), but '  \
-                        u'failed to create Transaction: {1}'.format(
-                            transaction.transfer_id, e)
-                    LOG.error(message)
-
-                    if not settings.DEBUG:
-                        mail_admins(u'Failed to log payment',
-                                    message, fail_silently=True)
-
-            if fixed_donation_percentage is None:
-                description = None
-            else:
-                description = _(u"{0}% Cause donation (chosen by {1})").format(
-                    fixed_donation_percentage, sender.cc3_profile.business_name)
-
-            if transaction:
-                donation = cause_reward(
-                    amount, payee, transaction.transfer_id,
-                    description= description,
-                    fixed_donation_percentage=fixed_donation_percentage)
-                # catches and logs errors if necessary
-                if donation:
-                    try:
-                        # Log the payment
-                        Transaction.objects.create(
-                            amount=donation.amount,
-                            sender=donation.sender,
-                            receiver=donation.recipient,
-                            transfer_id=donation.transfer_id,
-                        )
-                    except Exception, e:
-                        # Report this to ADMINS, but treat as success
-                        # because the payment was made
-                        message = u'Good Cause donation made (transfer '  \
-                            u'id={0}), but failed to create '  \
-                            u'Transaction: {1}'.format(
-                            donation.transfer_id, e)
-                        LOG.error(message)
-
-                        if not settings.DEBUG:
-                            mail_admins(u'Failed to log payment',
-                                        message, fail_silently=True)
-
 
     summary = {
         'num_rows': num_rows,
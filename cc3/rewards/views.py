@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 from _mysql import OperationalError
@@ -12,6 +13,7 @@ from django.db.models import ObjectDoesNotExist, Q
 from django.http import Http404, HttpResponse, HttpResponseRedirect, \
     HttpResponseForbidden
 from django.shortcuts import get_object_or_404
+from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import ListView, View, UpdateView
 
@@ -19,15 +21,14 @@ from formtools.wizard.views import SessionWizardView
 
 #  from cc3.core.models import Transaction
 from cc3.cyclos.models import CyclosGroup, User
-from cc3.cyclos.utils import (get_cyclos_connection,
-                              close_cyclos_connection,
-                              get_cyclos_transfer_totals)
+from cc3.cyclos.utils import cyclos_connection, get_cyclos_transfer_totals
 
-from .models import UserCause
+from .models import RewardPayoutJob, UserCause
 from .forms import (BulkRewardUploadFileForm, BulkRewardUploadDetailsForm,
                     BulkRewardUploadConfirmationForm,
                     UserCausePercentageForm
     )
+from .payouts import create_payout_job, start_payout_job
 from .utils import process_csv
 from cc3.rewards.models import DefaultGoodCause
 
@@ -63,63 +64,63 @@ class CauseListView(ListView):
 
         this_user_username = self.request.user.username
 
-        try:
-            conn = get_cyclos_connection()
-
-            all_user_totals = get_cyclos_transfer_totals(
-                conn,
-                group_by='recipient',
-                recipients=recipients,
-                transfer_type_ids=(donation_type_id,))
-            LOG.debug("all_user_totals: {0}".format(all_user_totals))
-
-            # repeat the query, this time for just the current user
-            my_totals = get_cyclos_transfer_totals(
-                conn,
-                group_by='recipient',
-                senders=(this_user_username,),
-                recipients=recipients,
-                transfer_type_ids=(donation_type_id,))
-            LOG.debug("my_totals: {0}".format(my_totals))
-
-            context['total_donations'] = my_totals.get('_TOTAL_', 0)
-            context['total_donations_all_users'] = all_user_totals.get(
-                '_TOTAL_', 0)
-        except OperationalError:
-            context['total_donations'] = None
-            context['total_donations_all_users'] = None
-
         try:
             current_cause = self.request.user.usercause.cause.username
         except ObjectDoesNotExist:
             current_cause = None
-            context['cause_donations'] = None
-            context['cause_donations_all_users'] = None
-        if current_cause:
-            if current_cause in cause_usernames:
-                context['cause_donations'] = my_totals.get(current_cause, 0)
-                context['cause_donations_all_users'] = all_user_totals.get(
-                    current_cause, 0)
-            else:
-                # need to make another query
-                current_cause_totals = get_cyclos_transfer_totals(
+
+        context['total_donations'] = None
+        context['total_donations_all_users'] = None
+        context['cause_donations'] = None
+        context['cause_donations_all_users'] = None
+        context['donations_reference'] = None
+        context['donations_reference_all_users'] = None
+
+        try:
+            with cyclos_connection() as conn:
+                all_user_totals = get_cyclos_transfer_totals(
                     conn,
-                    group_by='sender',
-                    recipients=(current_cause,),
+                    group_by='recipient',
+                    recipients=recipients,
                     transfer_type_ids=(donation_type_id,))
-                LOG.debug("current_cause_totals: {0}".format(
-                    current_cause_totals))
-                context['cause_donations'] = current_cause_totals.get(
-                    this_user_username, 0)
-                context['cause_donations_all_users'] = current_cause_totals.get(
-                    '_TOTAL_', 0)
+                LOG.debug("all_user_totals: {0}".format(all_user_totals))
 
-        #
-
-        context['donations_reference'] = my_totals
-        context['donations_reference_all_users'] = all_user_totals
+                # repeat the query, this time for just the current user
+                my_totals = get_cyclos_transfer_totals(
+                    conn,
+                    group_by='recipient',
+                    senders=(this_user_username,),
+                    recipients=recipients,
+                    transfer_type_ids=(donation_type_id,))
+                LOG.debug("my_totals: {0}".format(my_totals))
 
-        close_cyclos_connection(conn)
+                context['total_donations'] = my_totals.get('_TOTAL_', 0)
+                context['total_donations_all_users'] = all_user_totals.get(
+                    '_TOTAL_', 0)
+                context['donations_reference'] = my_totals
+                context['donations_reference_all_users'] = all_user_totals
+
+                if current_cause:
+                    if current_cause in cause_usernames:
+                        context['cause_donations'] = my_totals.get(
+                            current_cause, 0)
+                        context['cause_donations_all_users'] = \
+                            all_user_totals.get(current_cause, 0)
+                    else:
+                        # need to make another query
+                        current_cause_totals = get_cyclos_transfer_totals(
+                            conn,
+                            group_by='sender',
+                            recipients=(current_cause,),
+                            transfer_type_ids=(donation_type_id,))
+                        LOG.debug("current_cause_totals: {0}".format(
+                            current_cause_totals))
+                        context['cause_donations'] = \
+                            current_cause_totals.get(this_user_username, 0)
+                        context['cause_donations_all_users'] = \
+                            current_cause_totals.get('_TOTAL_', 0)
+        except OperationalError, e:
+            LOG.error(u'Unable to read the donation totals: {0}'.format(e))
 
         return context
 
@@ -317,19 +318,23 @@ class BulkRewardUploadWizard(SessionWizardView):
         csv_file = form_list[0].cleaned_data['csv_file']
         LOG.info("Rewards bulk upload: Uploaded file {0}".format(csv_file.name))
 
-        # Re-read the file and actually make the payments
+        # Re-read the file and pay the rewards in the background (a job which
+        # does not start here is run by the run_reward_payouts command)
         data = self.get_all_cleaned_data()
-        summary = process_csv(
-            data, make_payments=True, sender=self.request.user)
-        amount_paid = summary.get('amount_paid', 0)
+        job = create_payout_job(data, self.request.user)
+        start_payout_job(job)
 
         # no need to keep the file
         self.file_storage.delete(csv_file.name)
 
+        # link to the progress of the job, so the uploader can follow it
         messages.add_message(
-            self.request, messages.INFO, _(
-                'Rewards applied successfully. Total amount paid: {0}'
-                ).format(amount_paid))
+            self.request, messages.INFO, format_html(
+                _('Rewards are being paid. Number of payments: {0}. '
+                  '<a href="{1}">Follow the progress</a>'),
+                job.rows.count(),
+                reverse('rewards_payout_progress', args=[job.pk])),
+            extra_tags='safe')
 
         # redirect to account home (which will show message)
         return HttpResponseRedirect(reverse('accounts_home'))
@@ -341,6 +346,23 @@ bulk_reward_upload_wizard = BulkRewardUploadWizard.as_view([
     BulkRewardUploadConfirmationForm])
 
 
+@login_required
+def payout_job_progress(request, pk):
+    """
+    Returns the progress of a rewards payout job as JSON: the number of rows
+    per status, the amount paid so far and the rows processed per second.
+    """
+    job = get_object_or_404(RewardPayoutJob, pk=pk)
+    if job.sender_id != request.user.pk and not request.user.is_superuser:
+        return HttpResponseForbidden()
+
+    progress = job.get_progress()
+    for key in ('created', 'started', 'finished'):
+        value = getattr(job, key)
+        progress[key] = value and value.isoformat()
+    return HttpResponse(json.dumps(progress), content_type='application/json')
+
+
 ##########################
 # Admin related data views
 ##########################
@@ -0,0 +1,262 @@
+import json
+import logging
+
+from cc3.core.utils import chunks
+
+from .models import ActionStatus, Rule, RuleStatus
+
+
+LOG = logging.getLogger(__name__)
+
+# Number of ids per IN (...) lookup
+BATCH_QUERY_SIZE = 500
+
+
+class RuleSetBatch(object):
+    """
+    Runs the rules of a RuleSet for many lists of instances at once.
+
+    Does the same as calling ``RuleSet.run`` for each list in turn: the rule
+    chain of each list is run in rule order, and each RuleStatus and
+    ActionStatus is written right around its own action. But the rules and
+    conditions are loaded once, and the process model instances the
+    conditions evaluate, the existing RuleStatus rows and the identities a
+    rule already performed its action for are fetched in bulk per rule, for
+    the lists still to run.
+
+    Actions are performed for an identity, so the process model instances
+    of an identity are fetched again (on their own) after an action was
+    performed for it.
+    """
+    def __init__(self, ruleset):
+        self.rules = list(Rule.objects.filter(
+            ruleset=ruleset, active=True).order_by('sequence').select_related(
+                'process_model').prefetch_related('condition_set'))
+        self.actions = {}
+        self.instances_lists = []
+        # index of the list whose rule chain is running
+        self.position = 0
+        # process model instances, by (process model, instance identifier,
+        # instance qualifier) and identity
+        self.process_model_instances = {}
+        # RuleStatus rows, by rule id and RuleStatus key
+        self.rule_statuses = {}
+        # identities (as stored) with a RuleStatus, by rule id, for rules
+        # that only perform their action once
+        self.action_done = {}
+
+    def get_instance(self, instances_list, rule):
+        model_class = rule.process_model.model_class()
+        for _instance in instances_list:
+            if isinstance(_instance, model_class):
+                return _instance
+
+    def get_pending_instances(self, rule):
+        """
+        Returns the instances of the rule process model in the lists whose
+        rule chains have not finished yet.
+        """
+        instances = (
+            self.get_instance(instances_list, rule)
+            for instances_list in self.instances_lists[self.position:])
+        return [instance for instance in instances if instance is not None]
+
+    def load_process_model_instances(self, rule, identities):
+        """
+        Fetches the process model instances of the rule for identities.
+        Identities without exactly one process model instance map to None,
+        as the conditions fail for those.
+        """
+        key = (rule.process_model_id, rule.instance_identifier,
+               rule.instance_qualifier)
+        loaded = self.process_model_instances.setdefault(key, {})
+        identities = set(identities) - set([None])
+
+        found = {}
+        try:
+            kwargs = {}
+            if rule.instance_qualifier:
+                kwargs = json.loads(rule.instance_qualifier)
+            queryset = rule.process_model.model_class().objects.filter(
+                **kwargs)
+            lookup = '{0}__in'.format(rule.instance_identifier)
+            for identities_chunk in chunks(list(identities),
+                                           BATCH_QUERY_SIZE):
+                for process_model_instance in queryset.filter(
+                        **{lookup: identities_chunk}):
+                    found.setdefault(getattr(
+                        process_model_instance, rule.instance_identifier),
+                        []).append(process_model_instance)
+        except Exception, e:
+            LOG.error(u"Error loading instances for rule {0}: {1}".format(
+                rule, e))
+
+        for identity in identities:
+            process_model_instances = found.get(identity, [])
+            if len(process_model_instances) == 1:
+                loaded[identity] = process_model_instances[0]
+            else:
+                LOG.error(u"Error in rule {0}: {1} instances for {2}".format(
+                    rule, len(process_model_instances), identity))
+                loaded[identity] = None
+
+    def get_process_model_instance(self, rule, identity):
+        """
+        Returns the process model instance of the rule for identity, or None.
+        """
+        if identity is None:
+            return None
+
+        key = (rule.process_model_id, rule.instance_identifier,
+               rule.instance_qualifier)
+        if key not in self.process_model_instances:
+            self.load_process_model_instances(rule, [
+                getattr(instance, rule.instance_identifier, None)
+                for instance in self.get_pending_instances(rule)])
+        if identity not in self.process_model_instances[key]:
+            # fetched before an action changed them
+            self.load_process_model_instances(rule, [identity])
+        return self.process_model_instances[key][identity]
+
+    def forget_process_model_instances(self, identity):
+        """
+        Drops the fetched process model instances for identity, after an
+        action was performed for it.
+        """
+        for loaded in self.process_model_instances.values():
+            loaded.pop(identity, None)
+
+    def get_action_done(self, rule):
+        """
+        Returns the set of identities (as stored) for which the rule already
+        has a RuleStatus, for a rule that only performs its action once.
+        """
+        if rule.id not in self.action_done:
+            identities = set(
+                unicode(getattr(instance, rule.instance_identifier))
+                for instance in self.get_pending_instances(rule)
+                if hasattr(instance, rule.instance_identifier))
+            done = self.action_done[rule.id] = set()
+            for identities_chunk in chunks(list(identities),
+                                           BATCH_QUERY_SIZE):
+                done.update(rule.rulestatus_set.filter(
+                    content_type=rule.process_model,
+                    identity__in=identities_chunk).values_list(
+                        'identity', flat=True))
+        return self.action_done[rule.id]
+
+    def get_rule_status(self, rule, condition, instance, identity):
+        """
+        Returns the RuleStatus of the rule for instance, creating it unless
+        it exists (as ``get_or_create`` would).
+        """
+        if rule.id not in self.rule_statuses:
+            rule_statuses = self.rule_statuses[rule.id] = {}
+            object_ids = list(set(
+                _instance.id for _instance in self.get_pending_instances(rule)))
+            for object_ids_chunk in chunks(object_ids, BATCH_QUERY_SIZE):
+                for rule_status in rule.rulestatus_set.filter(
+                        object_id__in=object_ids_chunk):
+                    rule_statuses.setdefault((
+                        rule_status.condition_id, rule_status.content_type_id,
+                        rule_status.object_id, rule_status.identity),
+                        rule_status)
+
+        rule_statuses = self.rule_statuses[rule.id]
+        key = (condition.id, rule.process_model_id, instance.id,
+               unicode(identity))
+        if key not in rule_statuses:
+            rule_statuses[key] = RuleStatus.objects.create(
+                rule=rule,
+                condition=condition,
+                content_type=rule.process_model,
+                object_id=instance.id,
+                identity=identity
+            )
+        return rule_statuses[key]
+
+    def run_evaluate(self, rule, instance):
+        """
+        Evaluates the rule for instance, and performs its action if it
+        matches. Returns the RuleStatus id, or None, see
+        ``Rule.run_evaluate``.
+        """
+        identity = getattr(instance, rule.instance_identifier, None)
+        process_model_instance = self.get_process_model_instance(
+            rule, identity)
+        if process_model_instance is None:
+            return
+
+        condition = rule.get_matching_condition(
+            lambda _condition: _condition.evaluate(process_model_instance))
+        if condition is None:
+            return
+
+        if rule.perform_action_once:
+            action_done = self.get_action_done(rule)
+            if unicode(identity) in action_done:
+                return
+            action_done.add(unicode(identity))
+
+        rule_status = self.get_rule_status(rule, condition, instance, identity)
+
+        if rule.action_class:
+            if rule.id not in self.actions:
+                self.actions[rule.id] = rule.get_action()
+            performed_result = rule.perform_action(
+                identity, action=self.actions[rule.id])
+            ActionStatus.objects.get_or_create(
+                action=rule.action_class,
+                rule_status=rule_status,
+                performed=performed_result[:255]  # avoid overflow
+            )
+            self.forget_process_model_instances(identity)
+
+        return rule_status.id
+
+    def run_rules(self, instances_list):
+        """
+        Runs the rule chain for a list of instances, see ``RuleSet.run``.
+        """
+        rule_results = []
+        instance_identifier = None
+        instance = None
+
+        for rule in self.rules:
+            instance = self.get_instance(instances_list, rule)
+            result = self.run_evaluate(rule, instance)
+            if not instance_identifier:
+                instance_identifier = rule.instance_identifier
+            if result:
+                rule_results.append({
+                    "identity": getattr(instance, instance_identifier),
+                    "result": result
+                })
+                if rule.exit_on_match:
+                    return rule_results
+            else:
+                if rule.exit_on_fail:
+                    return rule_results
+
+        if not rule_results:
+            rule_results = [{'identity': getattr(
+                instance, instance_identifier or '', None), 'result': None}]
+        return rule_results
+
+    def run(self, instances_lists, processed=None):
+        """
+        Returns the rule results for each of the instances_lists, see
+        ``RuleSet.run``.
+
+        ``processed(index)`` is called as soon as the rule chain of the list
+        at index has finished, so callers can record it before the next list
+        runs.
+        """
+        self.instances_lists = list(instances_lists)
+        rule_results = []
+        for index, instances_list in enumerate(self.instances_lists):
+            self.position = index
+            rule_results.append(self.run_rules(instances_list))
+            if processed is not None:
+                processed(index)
+        return rule_results
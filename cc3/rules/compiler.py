@@ -0,0 +1,266 @@
+"""
+Compiles rule Conditions into Python callables.
+
+``Condition.evaluate_eval`` formats the field value into a source string and
+evaluates it, twice when there is a field expression, for every instance.
+A ``CompiledCondition`` parses the field expression and the expression once
+and compares the (typed) values directly, with the same results:
+
+* dates and datetimes compare as dates and datetimes,
+* text compares with the text of the expression,
+* numbers compare with the value of the expression (floats and Decimals as
+  the float literal of their text, which keeps 12 significant digits of a
+  float),
+* ``is`` is only compiled for text, and for numbers and None with the
+  expression ``None``, as the source literals were compiled to shared
+  constants.
+
+Values it cannot handle exactly like the source string would (other types,
+text with quotes or backslashes, expressions with a lower precedence than the
+operator) raise ``NotCompiled``, so the caller can fall back to the eval.
+"""
+import ast
+import datetime
+import math
+import operator
+from decimal import Decimal
+
+from django.utils import dateparse, timezone
+
+from .utils import last_month_first_of_month
+
+
+OPERATORS = {
+    '==': operator.eq,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '!=': operator.ne,
+    'is': operator.is_,
+}
+
+# names available to expressions, as in Condition.evaluate_eval
+SAFE_GLOBALS = {
+    '__builtins__': None,
+    'dateparse': dateparse,
+    'timezone': timezone,
+    'timedelta': datetime.timedelta,
+    'date': datetime.date,
+    'last_month_first_of_month': last_month_first_of_month,
+}
+
+# names the field value is bound to in a compiled field expression: as
+# python value where '{0}' was not quoted, as (byte or unicode) text where it
+# was quoted
+FIELD_VALUE = '__field_value__'
+FIELD_TEXT = '__field_text__'
+FIELD_BYTES = '__field_bytes__'
+
+# characters which mean something else inside a quoted literal
+LITERAL_UNSAFE = ("'", '"', '\\', '\n', '\r')
+
+# expressions which would not be evaluated as a whole after the operator
+LOW_PRECEDENCE = (ast.BoolOp, ast.Compare, ast.IfExp, ast.Lambda)
+
+# not available without builtins, but accepted by ast.literal_eval
+BUILTIN_NAMES = ('True', 'False')
+
+NUMBER_TYPES = (int, long, float, Decimal)
+
+_compiled = {}
+
+
+class NotCompiled(Exception):
+    """The condition (for this value) has to be evaluated from source"""
+
+
+def has_unsafe_characters(text):
+    return any(character in text for character in LITERAL_UNSAFE)
+
+
+def literal_number(value):
+    """
+    Returns number as the literal of its text would evaluate: floats and
+    Decimals are formatted (as ``evaluate_eval`` does) and read as float.
+    """
+    if isinstance(value, (float, Decimal)):
+        value = float(u'{0}'.format(value))
+        # 'inf' and 'nan' are names, not literals
+        if math.isinf(value) or math.isnan(value):
+            raise NotCompiled(value)
+    return value
+
+
+def uses_builtins(tree):
+    return any(isinstance(node, ast.Name) and node.id in BUILTIN_NAMES
+               for node in ast.walk(tree))
+
+
+class FieldValueTransformer(ast.NodeTransformer):
+    """
+    Replaces the formatted field value in a parsed field expression with
+    names bound to the value when evaluating.
+    """
+    def __init__(self):
+        self.uses_value = False
+        self.uses_text = False
+        self.uses_bytes = False
+
+    def visit_Attribute(self, node):
+        # '5.real' is no attribute of 5, but a syntax error
+        if isinstance(node.value, ast.Name) and node.value.id == FIELD_VALUE:
+            raise NotCompiled(node.attr)
+        return self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id == FIELD_VALUE:
+            self.uses_value = True
+        return node
+
+    def visit_Str(self, node):
+        if FIELD_VALUE not in node.s:
+            return node
+        # a literal without u'' prefix is a utf-8 byte string
+        if isinstance(node.s, unicode):
+            self.uses_text = True
+            name = FIELD_TEXT
+        else:
+            self.uses_bytes = True
+            name = FIELD_BYTES
+        template = node.s.replace('{', '{{').replace('}', '}}').replace(
+            FIELD_VALUE, '{0}')
+        # '<template>'.format(<field value text>)
+        return ast.copy_location(ast.Call(
+            func=ast.Attribute(value=ast.Str(s=template), attr='format',
+                               ctx=ast.Load()),
+            args=[ast.Name(id=name, ctx=ast.Load())],
+            keywords=[], starargs=None, kwargs=None), node)
+
+
+class CompiledCondition(object):
+    """
+    A condition parsed once, to be called with process model instances.
+    """
+    def __init__(self, evaluates_field, field_expression, evaluate_operator,
+                 evaluate_expression):
+        self.evaluates_field = evaluates_field
+        self.compare = OPERATORS.get(evaluate_operator)
+        # equal text literals are the same constant
+        self.text_compare = (
+            operator.eq if evaluate_operator == 'is' else self.compare)
+        self.expression_text = evaluate_expression
+        self.text_compiled = (
+            self.compare is not None and
+            not has_unsafe_characters(evaluate_expression))
+
+        self.field_code = None
+        self.uses_value = self.uses_text = self.uses_bytes = False
+        if field_expression:
+            self.compile_field_expression(field_expression)
+
+        self.expression_compiled = False
+        self.expression_is_constant = False
+        self.expression = None
+        if self.compare is not None:
+            self.compile_expression(evaluate_expression)
+        if evaluate_operator == 'is' and not (
+                self.expression_is_constant and self.expression is None):
+            self.expression_compiled = False
+
+    def compile_field_expression(self, field_expression):
+        try:
+            tree = ast.parse(field_expression.format(FIELD_VALUE), mode='eval')
+        except Exception:
+            raise NotCompiled(field_expression)
+        if uses_builtins(tree):
+            raise NotCompiled(field_expression)
+        transformer = FieldValueTransformer()
+        tree = ast.fix_missing_locations(transformer.visit(tree))
+        for node in ast.walk(tree):
+            for field, value in ast.iter_fields(node):
+                # left in an attribute name, keyword etc.
+                if (isinstance(value, basestring) and FIELD_VALUE in value and
+                        not isinstance(node, ast.Name)):
+                    raise NotCompiled(field_expression)
+        self.field_code = compile(tree, '<field expression>', 'eval')
+        self.uses_value = transformer.uses_value
+        self.uses_text = transformer.uses_text
+        self.uses_bytes = transformer.uses_bytes
+
+    def compile_expression(self, evaluate_expression):
+        try:
+            tree = ast.parse(evaluate_expression, mode='eval')
+        except SyntaxError:
+            return
+        if uses_builtins(tree) or isinstance(tree.body, LOW_PRECEDENCE) or (
+                isinstance(tree.body, ast.UnaryOp) and
+                isinstance(tree.body.op, ast.Not)):
+            return
+        try:
+            self.expression = ast.literal_eval(tree)
+            self.expression_is_constant = True
+        except ValueError:
+            self.expression = compile(tree, '<expression>', 'eval')
+        self.expression_compiled = True
+
+    def get_expression(self, scope):
+        if self.expression_is_constant:
+            return self.expression
+        return eval(self.expression, SAFE_GLOBALS, scope)
+
+    def get_field_value(self, value, scope):
+        if self.uses_value:
+            if isinstance(value, bool) or not (
+                    value is None or isinstance(value, NUMBER_TYPES)):
+                raise NotCompiled(value)
+            scope[FIELD_VALUE] = literal_number(value)
+        if self.uses_text or self.uses_bytes:
+            text = u'{0}'.format(value)
+            if has_unsafe_characters(text):
+                raise NotCompiled(value)
+            scope[FIELD_TEXT] = text
+            scope[FIELD_BYTES] = text.encode('utf-8')
+        return eval(self.field_code, SAFE_GLOBALS, scope)
+
+    def __call__(self, process_model_instance):
+        value = getattr(process_model_instance, self.evaluates_field)
+        scope = {'value': value}
+        if self.field_code is not None:
+            value = self.get_field_value(value, scope)
+
+        if isinstance(value, datetime.date):
+            if not self.expression_compiled:
+                raise NotCompiled(value)
+            return self.compare(value, self.get_expression(scope))
+        if isinstance(value, unicode):
+            if not self.text_compiled or has_unsafe_characters(value):
+                raise NotCompiled(value)
+            return self.text_compare(value, self.expression_text)
+        if not self.expression_compiled or isinstance(value, bool) or not (
+                value is None or isinstance(value, NUMBER_TYPES)):
+            raise NotCompiled(value)
+        return self.compare(literal_number(value), self.get_expression(scope))
+
+
+class UncompiledCondition(object):
+    """Stands in for a condition which can only be evaluated from source"""
+    def __call__(self, process_model_instance):
+        raise NotCompiled()
+
+
+def compile_condition(condition):
+    """
+    Returns the callable for the condition. Conditions with the same field,
+    field expression, operator and expression share it.
+    """
+    key = (condition.evaluates_field, condition.field_expression,
+           condition.evaluate_operator, condition.evaluate_expression)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        try:
+            compiled = CompiledCondition(*key)
+        except NotCompiled:
+            compiled = UncompiledCondition()
+        _compiled[key] = compiled
+    return compiled
@@ -0,0 +1,54 @@
+import datetime
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cc3.rules.models import Condition
+
+
+class ProcessModelInstance(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Command(BaseCommand):
+    help = ('Time evaluating typical rule conditions compiled and from '
+            'source, for the rows of a large upload')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, dest='rows', default=100000,
+            help='Number of process model instances to evaluate')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        instances = [ProcessModelInstance(
+            amount=Decimal(i % 500) / 4,
+            date_joined=now - datetime.timedelta(days=i % 90))
+            for i in xrange(options['rows'])]
+        conditions = [
+            Condition(evaluates_field='amount', evaluate_operator='>=',
+                      evaluate_expression=u'(125*1.05)'),
+            Condition(
+                evaluates_field='date_joined', evaluate_operator='<',
+                evaluate_expression=u'timezone.now() - timedelta(days=30)'),
+        ]
+
+        started = time.time()
+        expected = [[condition.evaluate_eval(instance)
+                     for condition in conditions] for instance in instances]
+        eval_elapsed = time.time() - started
+
+        started = time.time()
+        results = [[condition.evaluate(instance)
+                    for condition in conditions] for instance in instances]
+        compiled_elapsed = time.time() - started
+
+        if results != expected:
+            raise CommandError(
+                u'Compiled conditions differ from evaluating them from source')
+        self.stdout.write(
+            u'{0} rows: {1:.2f}s from source, {2:.2f}s compiled'.format(
+                len(instances), eval_elapsed, compiled_elapsed))
@@ -10,6 +10,7 @@ from django.db import models
 from django.utils import dateparse
 from django.utils.translation import ugettext_lazy as _
 
+from .compiler import NotCompiled, compile_condition
 from .utils import str_to_class, last_month_first_of_month
 
 
@@ -40,6 +41,19 @@ class RuleSet(models.Model):
     def __unicode__(self):
         return u'%s' % self.name
 
+    def run_batch(self, instances_lists, processed=None):
+        """
+        Run all rules in this set for each of the lists of instances, in
+        bulk. Returns the rule results of each list, as ``run`` does.
+
+        ``processed(index)`` is called when the rules for the list at index
+        have run, see ``RuleSetBatch.run``.
+        """
+        # importing here, to avoid circular import
+        from .batch import RuleSetBatch
+
+        return RuleSetBatch(self).run(instances_lists, processed=processed)
+
     def run(self, instances_list):
         """
         Run all rules in this set.
@@ -169,17 +183,9 @@ class Rule(models.Model):
         if not self.active:
             return
 
-        hits = 0
-        condition = None
-
-        for condition in self.condition_set.all():
-            result = condition.run_evaluate(instance)
-            if result:
-                hits += 1
-            elif condition.join_condition == 'AND':
-                return
-
-        if hits == 0:
+        condition = self.get_matching_condition(
+            lambda _condition: _condition.run_evaluate(instance))
+        if condition is None:
             return
 
         # what is the instances identity?
@@ -204,24 +210,7 @@ class Rule(models.Model):
         # class if no action class, then obviously don't do anything, carry on
         # the ruleset sequence.
         if self.action_class:
-            madule = self.action_class[:self.action_class.rindex(".")]
-            klass = self.action_class[self.action_class.rindex(".") + 1:]
-            action = str_to_class(madule, klass)
-
-            # prepare kwargs
-            parameters = self.parameter_names.split(",")
-            values = self.parameter_values.split(",")
-            kwargs = dict(zip(parameters, values))
-
-            # add instance specific id
-            kwargs[self.instance_identifier] = identity
-
-            # hand over rule id, so that any rule field(s) can be used in
-            # payment description
-            kwargs['rule_id'] = self.id
-
-            # perform action as rule passed, and no limit to
-            performed_result = action.perform(**kwargs)
+            performed_result = self.perform_action(identity)
             ActionStatus.objects.get_or_create(
                 action=self.action_class,
                 rule_status=rule_status,
@@ -230,6 +219,53 @@ class Rule(models.Model):
 
         return rule_status.id
 
+    def get_matching_condition(self, evaluate):
+        """
+        Applies evaluate(condition) to the conditions, and returns the last
+        condition evaluated if they match (see run_evaluate), or None.
+        """
+        hits = 0
+        condition = None
+
+        for condition in self.condition_set.all():
+            result = evaluate(condition)
+            if result:
+                hits += 1
+            elif condition.join_condition == 'AND':
+                return
+
+        if hits == 0:
+            return
+
+        return condition
+
+    def get_action(self):
+        madule = self.action_class[:self.action_class.rindex(".")]
+        klass = self.action_class[self.action_class.rindex(".") + 1:]
+        return str_to_class(madule, klass)
+
+    def perform_action(self, identity, action=None):
+        """
+        Performs the action for the instance identity, returns the result.
+        """
+        if action is None:
+            action = self.get_action()
+
+        # prepare kwargs
+        parameters = self.parameter_names.split(",")
+        values = self.parameter_values.split(",")
+        kwargs = dict(zip(parameters, values))
+
+        # add instance specific id
+        kwargs[self.instance_identifier] = identity
+
+        # hand over rule id, so that any rule field(s) can be used in
+        # payment description
+        kwargs['rule_id'] = self.id
+
+        # perform action as rule passed, and no limit to
+        return action.perform(**kwargs)
+
 
 class Condition(models.Model):
     """
@@ -278,7 +314,16 @@ class Condition(models.Model):
         return " ".join(text)
 
     def run_evaluate(self, instance):
-        value = process_model_instance = None
+        process_model_instance = self.get_process_model_instance(instance)
+        if process_model_instance is None:
+            return False
+        return self.evaluate(process_model_instance)
+
+    def get_process_model_instance(self, instance):
+        """
+        Returns the instance of the rule process_model with the identity of
+        instance (and the rule instance_qualifier), or None.
+        """
         process_model = self.rule.process_model
 
         try:
@@ -289,12 +334,36 @@ class Condition(models.Model):
             if instance_qualifier:
                 extra_dict = json.loads(instance_qualifier)
                 kwargs = dict(kwargs, **extra_dict)
-            process_model_instance = process_model.model_class().objects.get(
-                **kwargs)
+            return process_model.model_class().objects.get(**kwargs)
         except Exception, e:
             LOG.error("Error in condition {0}: {1}".format(
                 self.__unicode__(), e))
-            return False
+            return None
+
+    def save(self, *args, **kwargs):
+        super(Condition, self).save(*args, **kwargs)
+        # compile again, for the changed fields
+        self._compiled = None
+
+    def get_compiled(self):
+        """Returns the condition compiled into a callable, see compiler"""
+        if getattr(self, '_compiled', None) is None:
+            self._compiled = compile_condition(self)
+        return self._compiled
+
+    def evaluate(self, process_model_instance):
+        """Evaluates the condition for the process_model_instance"""
+        try:
+            return self.get_compiled()(process_model_instance)
+        except NotCompiled:
+            return self.evaluate_eval(process_model_instance)
+
+    def evaluate_eval(self, process_model_instance):
+        """
+        Evaluates the condition for the process_model_instance, by formatting
+        and evaluating the condition source
+        """
+        value = None
 
         # make a list of safe functions:
         # http://lybniz2.sourceforge.net/safeeval.html
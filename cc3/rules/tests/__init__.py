@@ -1,3 +1,5 @@
 #from .test_models import (
 #    RuleTests,
 #)
+from .test_batch import RuleSetBatchTests
+from .test_compiler import CompiledConditionTests
@@ -0,0 +1,166 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from cc3.cyclos.models.account import User
+from cc3.cyclos.tests.test_factories import UserFactory
+
+from ..models import ActionStatus, RuleSet, RuleStatus
+from .test_factories import RuleFactory, ConditionFactory
+
+
+class MarkProcessed(object):
+    """
+    Action which sets the last name of a user to 'processed'.
+    """
+    def perform(self, *args, **kwargs):
+        if unicode(kwargs['id']) == kwargs.get('fail_id'):
+            raise ValueError('Action failed')
+        User.objects.filter(pk=kwargs['id']).update(last_name='processed')
+        return u'processed {0}'.format(kwargs['id'])
+
+
+class RuleSetBatchTests(TestCase):
+    """
+    Test case for running a RuleSet over a batch of instances.
+    """
+    def setUp(self):
+        self.users = [UserFactory.create() for i in range(4)]
+        self.ruleset = RuleSet.objects.create(name='Batch')
+        content_type = ContentType.objects.get_for_model(User)
+
+        # matches all users but the first
+        self.rule_1 = RuleFactory.create(
+            ruleset=self.ruleset,
+            process_model=content_type,
+            instance_identifier='id',
+            exit_on_fail=True,
+        )
+        ConditionFactory.create(
+            rule=self.rule_1,
+            evaluates_field='id',
+            evaluate_operator='>',
+            evaluate_expression=str(self.users[0].id),
+        )
+        # matches the last user only, and only once
+        self.rule_2 = RuleFactory.create(
+            ruleset=self.ruleset,
+            process_model=content_type,
+            instance_identifier='id',
+            perform_action_once=True,
+        )
+        ConditionFactory.create(
+            rule=self.rule_2,
+            evaluates_field='id',
+            evaluate_operator='==',
+            evaluate_expression=str(self.users[3].id),
+        )
+
+    def _add_action_rules(self, parameter_names='', parameter_values=''):
+        content_type = ContentType.objects.get_for_model(User)
+        # marks all users
+        self.rule_3 = RuleFactory.create(
+            ruleset=self.ruleset,
+            process_model=content_type,
+            instance_identifier='id',
+            action_class='cc3.rules.tests.test_batch.MarkProcessed',
+            parameter_names=parameter_names,
+            parameter_values=parameter_values,
+        )
+        ConditionFactory.create(
+            rule=self.rule_3,
+            evaluates_field='id',
+            evaluate_operator='>',
+            evaluate_expression='0',
+        )
+        # matches the users marked by rule_3
+        self.rule_4 = RuleFactory.create(
+            ruleset=self.ruleset,
+            process_model=content_type,
+            instance_identifier='id',
+        )
+        ConditionFactory.create(
+            rule=self.rule_4,
+            evaluates_field='last_name',
+            evaluate_operator='==',
+            evaluate_expression='processed',
+        )
+
+    def _results(self, rule_results):
+        return [[(result['identity'], result['result'] is not None)
+                 for result in results] for results in rule_results]
+
+    def test_run_batch_as_run(self):
+        """
+        Tests that running in a batch gives the same results and rule
+        statuses as running the rules per instance.
+        """
+        instances_lists = [[user] for user in self.users]
+
+        expected = [self.ruleset.run(instances_list)
+                    for instances_list in instances_lists]
+        expected_statuses = RuleStatus.objects.count()
+        RuleStatus.objects.all().delete()
+
+        rule_results = self.ruleset.run_batch(instances_lists)
+
+        self.assertEqual(self._results(rule_results), self._results(expected))
+        self.assertEqual(RuleStatus.objects.count(), expected_statuses)
+        self.assertEqual(
+            rule_results[3][1]['result'],
+            RuleStatus.objects.get(rule=self.rule_2).id)
+
+    def test_run_batch_exit_on_fail(self):
+        """
+        Tests that an instance failing an exit_on_fail rule has no results.
+        """
+        rule_results = self.ruleset.run_batch([[self.users[0]]])
+        self.assertEqual(rule_results, [[]])
+
+    def test_run_batch_perform_action_once(self):
+        """
+        Tests that a rule to perform its action once doesn't match again.
+        """
+        self.ruleset.run_batch([[self.users[3]]])
+        rule_results = self.ruleset.run_batch([[self.users[3]]])
+
+        self.assertEqual(self._results(rule_results),
+                         [[(self.users[3].id, True)]])
+        self.assertEqual(RuleStatus.objects.filter(rule=self.rule_2).count(),
+                         1)
+
+    def test_run_batch_sees_actions(self):
+        """
+        Tests that a rule sees the changes made by the action of an earlier
+        rule, as when running the rules per instance.
+        """
+        self._add_action_rules()
+
+        rule_results = self.ruleset.run_batch(
+            [[user] for user in self.users])
+
+        self.assertEqual(ActionStatus.objects.filter(
+            rule_status__rule=self.rule_3).count(), 3)
+        self.assertEqual(RuleStatus.objects.filter(rule=self.rule_4).count(),
+                         3)
+        self.assertEqual(
+            rule_results[1][-1]['result'],
+            RuleStatus.objects.get(
+                rule=self.rule_4, identity=self.users[1].id).id)
+
+    def test_run_batch_processed(self):
+        """
+        Tests that each list is reported processed as soon as its rules have
+        run, with its actions recorded, when a later action fails.
+        """
+        self._add_action_rules('fail_id', str(self.users[2].id))
+        processed = []
+
+        self.assertRaises(
+            ValueError, self.ruleset.run_batch,
+            [[user] for user in self.users], processed.append)
+
+        self.assertEqual(processed, [0, 1])
+        self.assertEqual(list(ActionStatus.objects.filter(
+            rule_status__rule=self.rule_3).values_list(
+                'rule_status__identity', flat=True)),
+            [unicode(self.users[1].id)])
@@ -0,0 +1,129 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.utils import timezone
+
+from cc3.cyclos.models.account import User
+
+from ..compiler import CompiledCondition, NotCompiled
+from ..models import Condition, RuleSet
+from .test_factories import RuleFactory, ConditionFactory
+
+
+class ProcessModelInstance(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class CompiledConditionTests(TestCase):
+    """
+    Test case for conditions compiled into callables.
+    """
+    def _condition(self, field, operator, expression, field_expression=u''):
+        return Condition(evaluates_field=field, evaluate_operator=operator,
+                         evaluate_expression=expression,
+                         field_expression=field_expression)
+
+    def _assert_as_eval(self, condition, values):
+        compiled = CompiledCondition(
+            condition.evaluates_field, condition.field_expression,
+            condition.evaluate_operator, condition.evaluate_expression)
+        for value in values:
+            instance = ProcessModelInstance(field=value)
+            self.assertEqual(compiled(instance),
+                             condition.evaluate_eval(instance))
+
+    def test_numbers(self):
+        """
+        Tests that numbers compare with the value of the expression.
+        """
+        values = [None, 0, 5, 10L, 131.25, 0.1 + 0.2, 1 / 3.0,
+                  Decimal('131.25'), Decimal('7.5')]
+        for operator in ('==', '>', '<', '>=', '<=', '!='):
+            self._assert_as_eval(
+                self._condition('field', operator, u'(125*1.05)'), values)
+            # floats compare as their text: 0.1 + 0.2 == 0.3
+            self._assert_as_eval(
+                self._condition('field', operator, u'0.3'), values)
+            self._assert_as_eval(
+                self._condition('field', operator, u'timezone.now().month'),
+                values)
+        self._assert_as_eval(self._condition('field', 'is', u'None'), values)
+        self._assert_as_eval(self._condition(
+            'field', '>', u'10', field_expression=u'{0} * 2'), values[1:])
+
+    def test_dates(self):
+        """
+        Tests that dates and datetimes compare as dates and datetimes.
+        """
+        now = timezone.now()
+        values = [now, now - datetime.timedelta(days=40),
+                  datetime.datetime(2015, 3, 1, 12, 0, tzinfo=timezone.utc)]
+        self._assert_as_eval(self._condition(
+            'field', '<', u'timezone.now() - timedelta(days=30)'), values)
+        self._assert_as_eval(self._condition(
+            'field', '==', u'timezone.now().month',
+            field_expression=u"dateparse.parse_datetime('{0}').month"),
+            values)
+        self._assert_as_eval(self._condition(
+            'field', '>=', u'date(2015, 2, 1)'),
+            [value.date() for value in values])
+
+    def test_text(self):
+        """
+        Tests that text compares with the text of the expression, and that
+        text which would change the source is evaluated from source.
+        """
+        values = [u'abc', u'ABC', u'caf\xe9']
+        for operator in ('==', '!=', 'is', '<'):
+            self._assert_as_eval(
+                self._condition('field', operator, u'abc'), values)
+        self._assert_as_eval(self._condition(
+            'field', '==', u'ABC', field_expression=u"u'{0}'.upper()"),
+            values)
+
+        condition = self._condition('field', '==', u'abc')
+        instance = ProcessModelInstance(field=u'a\\b')
+        self.assertRaises(NotCompiled, condition.get_compiled(), instance)
+        self.assertFalse(condition.evaluate(instance))
+
+    def test_save_compiles_again(self):
+        """
+        Tests that a saved condition evaluates its changed expression.
+        """
+        rule = RuleFactory.create(
+            ruleset=RuleSet.objects.create(name='Compiled'),
+            process_model=ContentType.objects.get_for_model(User))
+        condition = ConditionFactory.create(
+            rule=rule, evaluates_field='field', evaluate_operator='>',
+            evaluate_expression=u'10')
+        instance = ProcessModelInstance(field=5)
+        self.assertFalse(condition.evaluate(instance))
+
+        condition.evaluate_expression = u'1'
+        condition.save()
+        self.assertTrue(condition.evaluate(instance))
+
+    def test_sample_as_eval(self):
+        """
+        Tests that the compiled conditions give the same results as
+        evaluating them from source for a sample of upload rows (see the
+        benchmark_conditions command for timings).
+        """
+        now = timezone.now()
+        instances = [ProcessModelInstance(
+            amount=Decimal(i % 500) / 4,
+            date_joined=now - datetime.timedelta(days=i % 90))
+            for i in xrange(0, 1000, 7)]
+        conditions = [
+            self._condition('amount', '>=', u'(125*1.05)'),
+            self._condition('date_joined', '<',
+                            u'timezone.now() - timedelta(days=30)'),
+        ]
+
+        for condition in conditions:
+            for instance in instances:
+                self.assertEqual(condition.evaluate(instance),
+                                 condition.evaluate_eval(instance))
@@ -1,10 +1,14 @@
 import logging
 
 from django.conf.urls import patterns, url
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.admin.views.main import ChangeList
-from django.http import HttpResponseRedirect
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.utils.http import is_safe_url
 from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.http import require_POST
 
 from cc3.cyclos.models import CC3Community
 
@@ -68,6 +72,26 @@ class DashboardAdmin(admin.ModelAdmin):
         request.session['stats_community_code'] = community_code
         return HttpResponseRedirect(refresh_url)
 
+    def refresh_graphs_view(self, request):
+        """ Refresh the graph snapshots of a dashboard (for the community
+        filter in the session) and return to the dashboard (POST only) """
+        community_code = request.session.get('stats_community_code', '')
+        dashboard_id = request.POST.get('id', '')
+        if not dashboard_id.isdigit():
+            raise Http404
+        dashboard = get_object_or_404(Dashboard, pk=dashboard_id)
+        for graph in dashboard.graph_set.filter(active=True):
+            graph.refresh_snapshot(community_code)
+        messages.success(request, _(u"Graphs refreshed"))
+
+        next_url = request.GET.get('next')
+        if not is_safe_url(url=next_url, host=request.get_host()):
+            next_url = u'{0}?id={1}'.format(reverse(
+                'admin:{0}_{1}_changelist'.format(
+                    self.model._meta.app_label, self.model._meta.model_name)),
+                dashboard.pk)
+        return HttpResponseRedirect(next_url)
+
     def get_urls(self):
         urls = super(DashboardAdmin, self).get_urls()
         custom_urls = patterns(
@@ -75,6 +99,10 @@ class DashboardAdmin(admin.ModelAdmin):
             url(r'^update_filter/$',
                 self.admin_site.admin_view(self.update_filter_view),
                 name='admin_update_filter'),
+            url(r'^refresh_graphs/$',
+                self.admin_site.admin_view(
+                    require_POST(self.refresh_graphs_view)),
+                name='admin_refresh_graphs'),
         )
         return custom_urls + urls
 
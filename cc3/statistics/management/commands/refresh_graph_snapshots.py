@@ -0,0 +1,61 @@
+import logging
+import sys
+
+from django.core.management.base import BaseCommand
+
+from cc3.cyclos.models import CC3Community
+from cc3.statistics.models import Graph
+
+LOG = logging.getLogger('management_commands')
+
+
+class Command(BaseCommand):
+
+    """Run the SQL of the dashboard graphs and store the results"""
+
+    help = ('Refresh the snapshots of the statistics graphs, for all '
+            'communities. Schedule this to run regularly (e.g. nightly).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dashboard', type=int, dest='dashboard',
+            help='Only refresh the graphs of this dashboard (id)')
+        parser.add_argument(
+            '--stale', action='store_true', dest='stale', default=False,
+            help='Only refresh snapshots which are out of date')
+
+    def handle(self, *args, **options):
+        graphs = Graph.objects.filter(active=True, dashboard__active=True)
+        if options['dashboard']:
+            graphs = graphs.filter(dashboard=options['dashboard'])
+
+        community_filter_codes = [''] + list(
+            CC3Community.objects.values_list('code', flat=True))
+
+        refreshed = failed = 0
+        for graph in graphs:
+            done = set()
+            for code in community_filter_codes:
+                # graphs without community filter have a single snapshot
+                code = graph._get_snapshot_filter_code(code)
+                if code in done:
+                    continue
+                done.add(code)
+
+                if options['stale']:
+                    snapshot = graph.snapshots.filter(
+                        community_filter_code=code).first()
+                    if snapshot and not snapshot.is_stale:
+                        continue
+                try:
+                    snapshot = graph.refresh_snapshot(code)
+                    refreshed += 1
+                    LOG.debug(u"Refreshed '{0}' ({1}) in {2:.2f}s".format(
+                        graph.title, code, snapshot.duration))
+                except Exception:
+                    failed += 1
+                    LOG.error(u"Failed to refresh '{0}' ({1})".format(
+                        graph.title, code), exc_info=sys.exc_info())
+
+        self.stdout.write(u'Refreshed {0} graph snapshots ({1} failed)'.format(
+            refreshed, failed))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('statistics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('community_filter_code', models.CharField(default=b'', max_length=50, blank=True)),
+                ('data', models.BinaryField()),
+                ('refreshed_at', models.DateTimeField()),
+                ('duration', models.FloatField(help_text='Seconds taken to run the SQL')),
+                ('graph', models.ForeignKey(related_name='snapshots', to='statistics.Graph')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='graphsnapshot',
+            unique_together=set([('graph', 'community_filter_code')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('statistics', '0002_graphsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='x_fill_missing',
+            field=models.BooleanField(default=False, help_text="Add columns for missing months (multi bar graphs with x type 'YYYYMM')"),
+        ),
+    ]
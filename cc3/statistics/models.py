@@ -1,3 +1,4 @@
+import cPickle as pickle
 import datetime
 import importlib
 import logging
@@ -6,8 +7,10 @@ import time
 
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from .pivot import pivot_series, pivot_table
 from .sql import COMMON_SQL
 from .utils import run_custom_sql, run_cyclos_sql
 
@@ -24,6 +27,11 @@ else:
 
 LOG = logging.getLogger(__name__)
 
+# Graph snapshots older than this (in seconds) are shown as out of date. The
+# snapshots are refreshed by the ``refresh_graph_snapshots`` command, which
+# should be scheduled to run more often than this.
+SNAPSHOT_MAX_AGE = getattr(settings, 'STATS_SNAPSHOT_MAX_AGE', 24 * 60 * 60)
+
 
 GRAPH_TYPE_TABLE = 'T'
 GRAPH_TYPE_BAR_GRAPH = 'B'
@@ -92,6 +100,10 @@ class Graph(models.Model):
     x_output_format = models.CharField(
         max_length=50, blank=True, default='',
         help_text=_(u"Output format for x values (depending on x type), or leave blank"))
+    x_fill_missing = models.BooleanField(default=False, help_text=_(
+        u"Add columns for missing months (multi bar graphs with x type "
+        u"'YYYYMM')"
+    ))
     x_max_columns = models.IntegerField(blank=True, null=True,
         help_text=_(u"Limit the number of x columns shown"))
     table_add_totals_row = models.BooleanField(default=False, help_text=_(
@@ -123,11 +135,58 @@ class Graph(models.Model):
 
         return u""
 
+    @property
+    def snapshot(self):
+        """The GraphSnapshot for the (annotated) community_filter_code"""
+        if getattr(self, '_snapshot', None) is None:
+            self._snapshot = self.get_snapshot(
+                getattr(self, 'community_filter_code', ''))
+        return self._snapshot
+
     @property
     def chartdata(self):
+        """The chartdata, from the snapshot of the last run of the SQL"""
+        return self.snapshot.chartdata
+
+    def _get_snapshot_filter_code(self, community_filter_code):
+        # Without a community filter in the SQL the results are the same for
+        # every community, so they share a snapshot
+        if '{{community_filter}}' not in self._get_sql():
+            return ''
+        return community_filter_code or ''
+
+    def get_snapshot(self, community_filter_code=''):
+        """
+        Return the GraphSnapshot for the community filter code, running the
+        SQL if there is none yet.
+        """
+        try:
+            return self.snapshots.get(
+                community_filter_code=self._get_snapshot_filter_code(
+                    community_filter_code))
+        except GraphSnapshot.DoesNotExist:
+            return self.refresh_snapshot(community_filter_code)
+
+    def refresh_snapshot(self, community_filter_code=''):
+        """Run the SQL and store the resulting chartdata in a GraphSnapshot"""
+        community_filter_code = self._get_snapshot_filter_code(
+            community_filter_code)
+        started = time.time()
+        chartdata = self.get_chartdata(community_filter_code)
+        snapshot, created = GraphSnapshot.objects.update_or_create(
+            graph=self, community_filter_code=community_filter_code,
+            defaults={
+                'data': pickle.dumps(chartdata, pickle.HIGHEST_PROTOCOL),
+                'refreshed_at': timezone.now(),
+                'duration': time.time() - started,
+            })
+        self._snapshot = None
+        return snapshot
+
+    def get_chartdata(self, community_filter_code=''):
+        """Run the SQL and return the chartdata (for the community filter)"""
         chartdata_to_return = {}
         data = []
-        community_filter_code = getattr(self, 'community_filter_code', '')
         raw_sql = self._get_raw_sql(community_filter_code=community_filter_code)
         #LOG.debug("raw_sql: {0}".format(raw_sql))
         if raw_sql:
@@ -169,36 +228,10 @@ class Graph(models.Model):
             #       {'y': [7, 7], 'name': 'Instelligen'}
             #   ]
             # }
-            xdata = data[0].keys()
-            ydata = []
-            for _dict in data:
-                ydata_dict = {}
-                _count = 0
-                for k, v in _dict.items():
-                    if _count == 0:
-                        ydata_dict['name'] = v
-                    else:
-                        if 'y' in ydata_dict:
-                            ydata_dict['y'].append(v)
-                        else:
-                            ydata_dict['y'] = [v, ]
-                    _count += 1
-                ydata.append(ydata_dict)
-
-            if self.table_add_totals_row:
-
-                cols = [row['y'] for row in ydata]
-                totals = [sum(x) for x in zip(*cols)]
-            else:
-                totals = []
 
             # x_max_columns currently ignored for table
-
-            chartdata_to_return = {
-                'x': xdata,
-                'data': ydata,
-                'totals': totals,
-            }
+            chartdata_to_return = pivot_table(
+                data, add_totals=self.table_add_totals_row)
 
         if self.graph_type == GRAPH_TYPE_BAR_GRAPH:
             # example SQL;
@@ -227,7 +260,6 @@ class Graph(models.Model):
         if self.graph_type == GRAPH_TYPE_MULTI_BAR_GRAPH:
             # example SQL;
             # - see statistics/sql/icare4u_userstats_3.sql
-            xdata = []
 
             # data =
             # [
@@ -244,32 +276,12 @@ class Graph(models.Model):
             #   {'x': 201502, 'y1': None, 'y2': None, 'y3': 2L, 'name': 'Spaardoelen'}
             # ]
 
-            # get all X values
-            for _dict in data:
-                for k, v in _dict.items():
-                    if k == 'x':
-                        if str(v) not in xdata:
-                            xdata.append(str(v))
-
-            # sort the dates
-            sorted(xdata)
-
-            # get all yN values and series names
-            ydata_dict = {}
-            name_dict = {}
-            for _dict in data:
-                for k, v in _dict.items():
-                    if k not in ['x', 'name']:
-                        if str(k) not in ydata_dict:
-                            ydata_dict[str(k)] = [0] * len(xdata)
-                        if v:
-                            str_date = str(_dict['x'])
-                            if str_date in xdata:
-                                index_of_date_in_xdata = xdata.index(str_date)
-                                ydata_dict[str(k)][index_of_date_in_xdata] = v
-                            yname = _dict.get('name', '')
-                            if yname:
-                                name_dict[k.replace('y', 'name')] = yname
+            # pivot into one list of values per yN, aligned with the
+            # (sorted) x values
+            is_yearmonth = self.x_type == X_TYPE_YEARMONTH
+            xdata, ydata_dict, name_dict = pivot_series(
+                data, sort_x=is_yearmonth,
+                fill_months=is_yearmonth and self.x_fill_missing)
 
             # {
             # 'name4': 'series 4',
@@ -326,8 +338,8 @@ class Graph(models.Model):
         return extra
 
 
-    def _get_raw_sql(self, community_filter_code):
-        """Returns the sql to be executed
+    def _get_sql(self):
+        """Returns the sql, before filling in the community filter
 
         Starts with db field, and if that's empty looks for coded snippet,
         first project-specific, then common
@@ -340,6 +352,11 @@ class Graph(models.Model):
                 raw_sql = CUSTOM_SQL[self.sql_key]
             except KeyError:
                 raw_sql = COMMON_SQL[self.sql_key]
+        return raw_sql
+
+    def _get_raw_sql(self, community_filter_code):
+        """Returns the sql to be executed"""
+        raw_sql = self._get_sql()
 
         if '{{community_filter}}' in raw_sql:
             # replace it with the filter code
@@ -358,8 +375,6 @@ class Graph(models.Model):
 
     def _process_xdata(self, xdata):
         """Re-format xdata according to x_type"""
-        # TODO: might also want to fill in missing months?
-
         if self.x_type == X_TYPE_YEARMONTH:
             if self.x_output_format:
                 fmt = self.x_output_format
@@ -369,3 +384,31 @@ class Graph(models.Model):
                 datetime.datetime.strptime(val, '%Y%m'
                                            ).strftime(fmt) for val in xdata]
         return xdata
+
+
+class GraphSnapshot(models.Model):
+    """
+    Chartdata of a Graph, as returned by its SQL at ``refreshed_at``, for a
+    community filter code (blank for all communities)
+    """
+    graph = models.ForeignKey('Graph', related_name='snapshots')
+    community_filter_code = models.CharField(
+        max_length=50, blank=True, default='')
+    data = models.BinaryField()
+    refreshed_at = models.DateTimeField()
+    duration = models.FloatField(
+        help_text=_(u"Seconds taken to run the SQL"))
+
+    class Meta:
+        unique_together = ('graph', 'community_filter_code')
+
+    @property
+    def chartdata(self):
+        if getattr(self, '_chartdata', None) is None:
+            self._chartdata = pickle.loads(str(self.data))
+        return self._chartdata
+
+    @property
+    def is_stale(self):
+        return timezone.now() - self.refreshed_at > datetime.timedelta(
+            seconds=SNAPSHOT_MAX_AGE)
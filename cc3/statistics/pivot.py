@@ -0,0 +1,94 @@
+"""
+Reshaping of SQL result rows into the columnar chartdata used by the graphs.
+
+Every function makes a fixed number of passes over the rows, looking up x
+positions in a dict, so the work grows linearly with the number of rows.
+"""
+
+
+def month_range(first, last):
+    """Returns all 'YYYYMM' strings from ``first`` up to and incl. ``last``"""
+    year, month = divmod(int(first), 100)
+    last = int(last)
+    months = []
+    while year * 100 + month <= last:
+        months.append('{0:04d}{1:02d}'.format(year, month))
+        month += 1
+        if month > 12:
+            year += 1
+            month = 1
+    return months
+
+
+def pivot_series(rows, sort_x=False, fill_months=False):
+    """
+    Pivots rows with an 'x' value, an optional series 'name' and one or more
+    'yN' values into columns, for a multi bar graph.
+
+    Returns ``(xdata, ydata, names)``: the x values as strings, a dict with a
+    list of values per 'yN' (aligned with xdata, 0 where there is no value)
+    and a dict with the series name per 'nameN'.
+
+    If ``sort_x`` the x values are sorted, otherwise they keep the order in
+    which they first appear. If ``fill_months`` the x values are taken to be
+    'YYYYMM' months and missing months in between are added (and sorted).
+    """
+    xdata = []
+    x_index = {}
+    for row in rows:
+        x = str(row['x'])
+        if x not in x_index:
+            x_index[x] = len(xdata)
+            xdata.append(x)
+
+    if fill_months and xdata:
+        xdata = month_range(min(xdata), max(xdata))
+    elif sort_x:
+        xdata.sort()
+    if sort_x or fill_months:
+        x_index = dict((x, i) for i, x in enumerate(xdata))
+
+    ydata = {}
+    names = {}
+    size = len(xdata)
+    for row in rows:
+        position = x_index[str(row['x'])]
+        yname = row.get('name', '')
+        for key, value in row.iteritems():
+            if key == 'x' or key == 'name':
+                continue
+            key = str(key)
+            column = ydata.get(key)
+            if column is None:
+                column = ydata[key] = [0] * size
+            if value:
+                column[position] = value
+                if yname:
+                    names[key.replace('y', 'name')] = yname
+
+    return xdata, ydata, names
+
+
+def pivot_table(rows, add_totals=False):
+    """
+    Splits rows into a header, named rows of values and (optionally) column
+    totals, for a table. The first column of each row is its name.
+
+    Returns a dict with 'x' (the column names), 'data' (a dict with 'name'
+    and list of values 'y' per row) and 'totals'.
+    """
+    if not rows:
+        return {'x': [], 'data': [], 'totals': []}
+
+    columns = list(rows[0].keys())
+    data = []
+    totals = [0] * (len(columns) - 1) if add_totals else []
+    for row in rows:
+        values = list(row.values())
+        y = values[1:]
+        data.append({'name': values[0], 'y': y})
+        if add_totals:
+            for i, value in enumerate(y):
+                totals[i] += value
+
+    return {'x': columns, 'data': data, 'totals': totals}
@@ -0,0 +1,3 @@
+from .test_admin import RefreshGraphsViewTestCase
+from .test_models import GraphSnapshotTestCase
+from .test_pivot import PivotTestCase
@@ -0,0 +1,65 @@
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from mock import patch
+
+from cc3.cyclos.tests.test_factories import UserFactory
+
+from ..models import Dashboard, Graph, GRAPH_TYPE_BAR_GRAPH
+
+
+class RefreshGraphsViewTestCase(TestCase):
+    """
+    Test case for the dashboard ``refresh_graphs_view`` admin view.
+    """
+    def setUp(self):
+        self.admin = UserFactory.create(is_superuser=True, is_staff=True)
+        self.client.login(username=self.admin.username, password='testing')
+
+        self.dashboard = Dashboard.objects.create(title='Users', sequence=1)
+        Graph.objects.create(
+            title='New users', dashboard=self.dashboard, sequence=1,
+            graph_type=GRAPH_TYPE_BAR_GRAPH,
+            raw_sql='SELECT x, y1 FROM stats WHERE {{community_filter}} 1')
+        self.url = reverse('admin:admin_refresh_graphs')
+        self.changelist_url = reverse('admin:statistics_dashboard_changelist')
+
+    @patch('cc3.statistics.models.Graph.refresh_snapshot')
+    def test_get_not_allowed(self, mock):
+        """
+        Tests that the graphs are not refreshed on a GET request.
+        """
+        response = self.client.get(self.url, {'id': self.dashboard.pk})
+
+        self.assertEqual(response.status_code, 405)
+        self.assertFalse(mock.called)
+
+    @patch('cc3.statistics.models.Graph.refresh_snapshot')
+    def test_refresh(self, mock):
+        """
+        Tests that the graphs are refreshed, and the view returns to the
+        dashboard.
+        """
+        next_url = '{0}?id={1}&o=1'.format(
+            self.changelist_url, self.dashboard.pk)
+
+        response = self.client.post(
+            '{0}?next={1}'.format(self.url, next_url.replace('&', '%26')),
+            {'id': self.dashboard.pk})
+
+        self.assertEqual(mock.call_count, 1)
+        self.assertRedirects(response, next_url, fetch_redirect_response=False)
+
+    @patch('cc3.statistics.models.Graph.refresh_snapshot')
+    def test_unsafe_next(self, mock):
+        """
+        Tests that the view doesn't redirect to another site.
+        """
+        response = self.client.post(
+            '{0}?next=http://example.org/'.format(self.url),
+            {'id': self.dashboard.pk})
+
+        self.assertRedirects(
+            response, '{0}?id={1}'.format(
+                self.changelist_url, self.dashboard.pk),
+            fetch_redirect_response=False)
@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from mock import patch
+
+from ..models import Dashboard, Graph, GRAPH_TYPE_BAR_GRAPH
+
+
+class GraphSnapshotTestCase(TestCase):
+    """
+    Test case for the snapshots of the ``Graph`` chartdata.
+    """
+    def setUp(self):
+        self.dashboard = Dashboard.objects.create(title='Users', sequence=1)
+        self.graph = Graph.objects.create(
+            title='New users', dashboard=self.dashboard, sequence=1,
+            graph_type=GRAPH_TYPE_BAR_GRAPH,
+            raw_sql='SELECT x, y1 FROM stats WHERE {{community_filter}} 1')
+        self.data = [{'x': 'Jan', 'y1': 3}, {'x': 'Feb', 'y1': 5}]
+
+    @patch('cc3.statistics.models.run_custom_sql')
+    def test_chartdata_from_snapshot(self, mock):
+        """
+        Tests that the SQL is only run once, after that the chartdata comes
+        from the snapshot.
+        """
+        mock.return_value = self.data
+
+        chartdata = self.graph.chartdata
+        self.assertEqual(chartdata, {'x': ['Jan', 'Feb'], 'y': [3.0, 5.0]})
+        graph = Graph.objects.get(pk=self.graph.pk)
+        self.assertEqual(graph.chartdata, chartdata)
+        self.assertEqual(mock.call_count, 1)
+
+    @patch('cc3.statistics.models.run_custom_sql')
+    def test_refresh_snapshot(self, mock):
+        """
+        Tests that refreshing runs the SQL again and updates the snapshot.
+        """
+        mock.return_value = self.data
+        self.graph.get_snapshot()
+
+        mock.return_value = self.data[:1]
+        self.graph.refresh_snapshot()
+
+        graph = Graph.objects.get(pk=self.graph.pk)
+        self.assertEqual(graph.chartdata, {'x': ['Jan'], 'y': [3.0]})
+        self.assertEqual(graph.snapshots.count(), 1)
+
+    @patch('cc3.statistics.models.run_custom_sql')
+    def test_snapshot_per_community(self, mock):
+        """
+        Tests that there is a snapshot per community filter, unless the SQL
+        has no community filter.
+        """
+        mock.return_value = self.data
+
+        self.assertNotEqual(self.graph.get_snapshot('').pk,
+                            self.graph.get_snapshot('ABC').pk)
+
+        self.graph.raw_sql = 'SELECT x, y1 FROM stats'
+        self.graph.save()
+        self.assertEqual(self.graph.get_snapshot('DEF').community_filter_code,
+                         '')
+
+    @patch('cc3.statistics.models.run_custom_sql')
+    def test_stale(self, mock):
+        """
+        Tests that a snapshot older than ``STATS_SNAPSHOT_MAX_AGE`` is stale.
+        """
+        mock.return_value = self.data
+        snapshot = self.graph.get_snapshot()
+        self.assertFalse(snapshot.is_stale)
+
+        snapshot.refreshed_at = timezone.now() - timedelta(days=2)
+        self.assertTrue(snapshot.is_stale)
@@ -0,0 +1,110 @@
+import time
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils.datastructures import SortedDict
+
+from ..pivot import month_range, pivot_series, pivot_table
+
+
+class PivotTestCase(TestCase):
+    """
+    Test case for reshaping SQL results into chartdata.
+    """
+    def setUp(self):
+        self.rows = [
+            {'x': 201411, 'y1': 1L, 'y2': None, 'name': 'Businesses'},
+            {'x': 201410, 'y1': 5L, 'y2': None, 'name': 'Businesses'},
+            {'x': 201501, 'y1': 7L, 'y2': None, 'name': 'Businesses'},
+            {'x': 201410, 'y1': None, 'y2': 4L, 'name': 'Institutions'},
+            {'x': 201501, 'y1': None, 'y2': 2L, 'name': 'Institutions'},
+        ]
+
+    def test_month_range(self):
+        """
+        Tests that the months run over the year end.
+        """
+        self.assertEqual(month_range('201411', '201502'),
+                         ['201411', '201412', '201501', '201502'])
+        self.assertEqual(month_range('201502', '201411'), [])
+
+    def test_pivot_series_order(self):
+        """
+        Tests that x values keep their order unless sorting is asked for.
+        """
+        xdata, ydata, names = pivot_series(self.rows)
+        self.assertEqual(xdata, ['201411', '201410', '201501'])
+        self.assertEqual(ydata, {'y1': [1, 5, 7], 'y2': [0, 4, 2]})
+        self.assertEqual(names, {'name1': 'Businesses',
+                                 'name2': 'Institutions'})
+
+        xdata, ydata, names = pivot_series(self.rows, sort_x=True)
+        self.assertEqual(xdata, ['201410', '201411', '201501'])
+        self.assertEqual(ydata, {'y1': [5, 1, 7], 'y2': [4, 0, 2]})
+
+    def test_pivot_series_fill_months(self):
+        """
+        Tests that missing months are added with zero values.
+        """
+        xdata, ydata, names = pivot_series(self.rows, fill_months=True)
+        self.assertEqual(xdata, ['201410', '201411', '201412', '201501'])
+        self.assertEqual(ydata, {'y1': [5, 1, 0, 7], 'y2': [4, 0, 0, 2]})
+
+    def test_pivot_table(self):
+        """
+        Tests that the first column names the row, and the totals.
+        """
+        rows = [
+            SortedDict([('User type', u'Spaarders'),
+                        ('Total number', Decimal('151')),
+                        ('Active', Decimal('144'))]),
+            SortedDict([('User type', u'Businesses'),
+                        ('Total number', Decimal('15')),
+                        ('Active', Decimal('15'))]),
+        ]
+        self.assertEqual(pivot_table(rows, add_totals=True), {
+            'x': ['User type', 'Total number', 'Active'],
+            'data': [
+                {'name': u'Spaarders', 'y': [151, 144]},
+                {'name': u'Businesses', 'y': [15, 15]},
+            ],
+            'totals': [166, 159],
+        })
+        self.assertEqual(pivot_table(rows)['totals'], [])
+        self.assertEqual(pivot_table([]),
+                         {'x': [], 'data': [], 'totals': []})
+
+    def _series_rows(self, months, count):
+        return [{'x': int(months[i % len(months)]),
+                 'y{0}'.format(i % 4 + 1): i,
+                 'name': 'series {0}'.format(i % 4 + 1)}
+                for i in xrange(count)]
+
+    def _pivot_time(self, rows):
+        # best of three, to leave out pauses of a busy machine
+        timings = []
+        for i in range(3):
+            started = time.time()
+            pivot_series(rows, fill_months=True)
+            timings.append(time.time() - started)
+        return min(timings)
+
+    def test_pivot_series_linear(self):
+        """
+        Tests that 100k rows over ten years of months are pivoted, in time
+        linear in the number of rows.
+        """
+        months = month_range('200501', '201412')
+        small_rows = self._series_rows(months, 10000)
+        rows = self._series_rows(months, 100000)
+
+        xdata, ydata, names = pivot_series(rows, fill_months=True)
+
+        self.assertEqual(xdata, months)
+        self.assertEqual(sorted(ydata.keys()), ['y1', 'y2', 'y3', 'y4'])
+        self.assertEqual(len(ydata['y1']), len(months))
+        # ten times the rows take about ten times as long (a hundred times
+        # if pivoting were quadratic); compared rather than measured against
+        # a fixed bound, so it doesn't depend on the speed of the machine
+        self.assertLess(self._pivot_time(rows),
+                        30 * self._pivot_time(small_rows))
@@ -25,14 +25,10 @@ def run_custom_sql(_sql, _params):
 
 
 def run_cyclos_sql(_sql, _params):
-    from cc3.cyclos.dbaccess import (
-        get_cyclos_connection, close_cyclos_connection, cyclos_query_results)
-    conn = get_cyclos_connection(results_as_dict=False)
-
-    cursor = conn['cursor']
-    cursor.execute(_sql, _params)
-    data = dictfetchall(cursor)
-    #data = [row for row in cyclos_query_results(conn, _sql, _params)]
-    close_cyclos_connection(conn)
+    from cc3.cyclos.dbaccess import cyclos_connection
+    with cyclos_connection(results_as_dict=False) as conn:
+        cursor = conn['cursor']
+        cursor.execute(_sql, _params)
+        data = dictfetchall(cursor)
 
     return data